@@ -0,0 +1,125 @@
+"""
+Throughput benchmark of handling short traces one by one and in batches.
+
+Single messages are mapped with map_to_map and priced with calculate_price, batches
+with map_to_map_batch and calculate_prices. Both serialize every route to the wire.
+
+Run with: python -m src.benchmarks.bench_batch --messages 400 --sizes 1,10,50,200
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+
+from src.benchmarks.synthetic import grid_graph, price_model, random_trace
+from src.router_service.models.vehicle import VehicleInt
+from src.router_service.services.calculator import Calculator
+from src.router_service.services.pricer import Pricer
+
+VEHICLE = VehicleInt(
+    id="250aae3e-4c20-46e4-b5dc-7b32af4dbf9a",
+    vehicleClassification="M1",
+    fuelType="Diesel",
+)
+
+
+def handle_single(calculator: Calculator, pricer: Pricer, traces: list) -> list:
+    """
+    Handle every trace on its own.
+
+    :param calculator: The calculator
+    :param pricer: The pricer
+    :param traces: The traces
+    :return: The serialized routes of the traces that could be mapped
+    """
+    serialized = []
+    for trace in traces:
+        try:
+            route = calculator.map_to_map(trace, "long", "timeStamp")
+        except ValueError:
+            # Dropped like the receiver drops failed messages
+            continue
+        serialized.append(json.dumps(pricer.calculate_price(route, VEHICLE).to_wire()))
+    return serialized
+
+
+def handle_batch(calculator: Calculator, pricer: Pricer, traces: list) -> list:
+    """
+    Handle the traces as one batch.
+
+    :param calculator: The calculator
+    :param pricer: The pricer
+    :param traces: The traces
+    :return: The serialized routes of the traces that could be mapped
+    """
+    routes = calculator.map_to_map_batch(
+        [(trace, "long", "timeStamp") for trace in traces]
+    )
+    routes = [route for route in routes if not isinstance(route, Exception)]
+    pricer.calculate_prices(routes, [VEHICLE] * len(routes))
+    return [json.dumps(route.to_wire()) for route in routes]
+
+
+def run(
+    messages: int = 400,
+    sizes=(1, 10, 50, 200),
+    length: int = 60,
+    rows: int = 60,
+    cols: int = 60,
+) -> dict:
+    """
+    Measure the throughput per batch size.
+
+    :param messages: Number of messages to handle per batch size
+    :param sizes: Batch sizes, 1 handles every message on its own
+    :param length: Number of points per trace
+    :param rows: Number of node rows of the graph
+    :param cols: Number of node columns of the graph
+    :return: Dict of batch size to messages per second
+    """
+    calculator = Calculator(grid_graph(rows=rows, cols=cols))
+    pricer = Pricer(price_model())
+    traces = [
+        random_trace(calculator.area_graph, length=length, seed=seed)
+        for seed in range(messages)
+    ]
+    # Warm up the caches of the calculator and pricer
+    handle_single(calculator, pricer, traces[:20])
+
+    results = {}
+    for size in sizes:
+        start = time.perf_counter()
+        for offset in range(0, messages, size):
+            chunk = traces[offset : offset + size]
+            if size == 1:
+                handle_single(calculator, pricer, chunk)
+            else:
+                handle_batch(calculator, pricer, chunk)
+        results[size] = messages / (time.perf_counter() - start)
+    return results
+
+
+def main(argv=None):
+    """
+    Run the benchmark from the command line.
+
+    :param argv: The arguments, sys.argv if not given
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--sizes", default="1,10,50,200")
+    parser.add_argument("--length", type=int, default=60)
+    parser.add_argument("--rows", type=int, default=60)
+    parser.add_argument("--cols", type=int, default=60)
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.WARNING)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = run(args.messages, sizes, args.length, args.rows, args.cols)
+    for size, rate in results.items():
+        print(f"batch {size:>4}: {rate:.0f} msg/s", file=sys.stderr)  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Micro-benchmark comparing per-point and batched nearest edge snapping.
+
+Run with: python -m src.benchmarks.bench_nearest_edges [trace length] [repeats]
+"""
+import sys
+import timeit
+
+import numpy as np
+from src.benchmarks.synthetic import grid_graph, random_trace
+from src.router_service.helpers import custom_nearest_edge as cne
+
+
+def run(trace_length: int = 2000, repeats: int = 5):
+    """
+    Time both snapping paths on a synthetic graph and trace.
+
+    :param trace_length: Number of points in the trace
+    :param repeats: Number of timed runs per path, the best one is reported
+    :return: Dict with the best time of each path in seconds and the speedup
+    """
+    graph = grid_graph()
+    geoms, rtree = cne.init_rtree(graph)
+    edge_ids = cne.init_edge_ids(geoms)
+    trace = random_trace(graph, length=trace_length)
+    lats = np.array([point["lat"] for point in trace])
+    lons = np.array([point["long"] for point in trace])
+
+    def per_point():
+        return [
+            cne.nearest_edges(geoms, rtree, lons=point["lat"], lats=point["long"])
+            for point in trace
+        ]
+
+    def batch():
+        return cne.nearest_edges_batch(edge_ids, rtree, lats, lons)
+
+    assert [tuple(edge) for edge in batch().tolist()] == per_point()
+
+    per_point_time = min(timeit.repeat(per_point, number=1, repeat=repeats))
+    batch_time = min(timeit.repeat(batch, number=1, repeat=repeats))
+    return {
+        "trace_length": trace_length,
+        "per_point_seconds": per_point_time,
+        "batch_seconds": batch_time,
+        "speedup": per_point_time / batch_time,
+    }
+
+
+if __name__ == "__main__":
+    result = run(*[int(arg) for arg in sys.argv[1:3]])
+    print(  # noqa: T201
+        f"{result['trace_length']} points: "
+        f"per point {result['per_point_seconds'] * 1000:.1f} ms, "
+        f"batch {result['batch_seconds'] * 1000:.1f} ms, "
+        f"speedup {result['speedup']:.0f}x"
+    )
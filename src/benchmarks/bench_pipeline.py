@@ -0,0 +1,298 @@
+"""
+Benchmark timing every stage of the route pipeline on a synthetic graph and traces.
+
+Every stage is timed on its own with the output of the previous stages as input, and
+the results are written as JSON so runs on different commits can be compared.
+
+Run with: python -m src.benchmarks.bench_pipeline --output results.json
+Compare with: python -m src.benchmarks.bench_pipeline --baseline results.json
+"""
+import argparse
+import copy
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+import uuid
+
+import numpy as np
+from src.benchmarks.synthetic import grid_graph, price_model, random_trace
+from src.router_service.helpers.helpers import remove_duplicates
+from src.router_service.helpers.route_formatter import generate_formatted_route
+from src.router_service.helpers.time import (
+    fill_timestamps,
+    get_edge_times,
+    get_start_and_end_time_of_edges,
+    interpolate_timestamps,
+    match_timestamps,
+    parse_timestamps,
+)
+from src.router_service.models.message_envelope import MessageEnvelope
+from src.router_service.models.vehicle import VehicleInt
+from src.router_service.services.calculator import Calculator
+from src.router_service.services.pricer import Pricer
+
+VEHICLE = VehicleInt(
+    id="250aae3e-4c20-46e4-b5dc-7b32af4dbf9a",
+    vehicleClassification="M1",
+    fuelType="Diesel",
+)
+
+
+def time_stage(stage, repeats: int) -> dict:
+    """
+    Time a stage.
+
+    :param stage: Function without arguments running the stage once
+    :param repeats: Number of timed runs
+    :return: Dict with the best and median time in milliseconds
+    """
+    times = timeit.repeat(stage, number=1, repeat=repeats)
+    return {
+        "min_ms": min(times) * 1000,
+        "median_ms": statistics.median(times) * 1000,
+    }
+
+
+def stages(calculator: Calculator, pricer: Pricer, trace: list) -> dict:
+    """
+    Prepare the stages of map_to_map, pricing and serializing for a trace.
+
+    Runs the pipeline once to get the input of every stage.
+
+    :param calculator: The calculator
+    :param pricer: The pricer
+    :param trace: The coordinates
+    :return: Dict of stage name to a function running the stage
+    """
+    edge_table = calculator.edge_table
+    lats, lons = calculator.get_lat_lon_arrays(trace, "long")
+    coordinate_edges = calculator.snap(lats, lons)
+    route_node_ids = calculator.connect_edges(coordinate_edges)
+    raw_timestamps = [coordinate["timeStamp"] for coordinate in trace]
+    timestamps = parse_timestamps(raw_timestamps)
+    edge_start_end_timestamps = get_start_and_end_time_of_edges(
+        timestamps, coordinate_edges
+    )
+    nearest_edges = remove_duplicates(coordinate_edges)
+    route_edges = calculator.get_route_edges(route_node_ids)
+    route_edge_tuples = edge_table.edge_tuples(route_edges)
+    indexed = match_timestamps(
+        nearest_edges, route_edge_tuples, edge_start_end_timestamps
+    )
+
+    def fill():
+        if calculator.timestamp_fill_mode == "interpolate":
+            return interpolate_timestamps(indexed, edge_table.length[route_edges])
+        filled = fill_timestamps(dict(indexed), len(route_edges) - 1)
+        return get_edge_times(filled, len(route_edges))
+
+    start_times, end_times = fill()
+
+    def format_route():
+        return generate_formatted_route(
+            route_node_ids, edge_table, route_edges, start_times, end_times
+        )
+
+    formatted = format_route()
+    priced = pricer.calculate_price(copy.copy(formatted), VEHICLE)
+    conversation_id = uuid.uuid4()
+
+    def connect():
+        # Bridging is cached, time the searches and not the cache
+        calculator.bridge_cache.clear()
+        return calculator.connect_edges(coordinate_edges)
+
+    def serialize():
+        return MessageEnvelope(
+            messageId=uuid.uuid4(),
+            conversationId=conversation_id,
+            messageType=["urn:message:LTS.DTOs:RouteDTO"],
+            message=priced.to_wire(),
+        ).json(by_alias=True)
+
+    def end_to_end():
+        calculator.bridge_cache.clear()
+        route = calculator.map_to_map(trace, "long", "timeStamp")
+        return MessageEnvelope(
+            messageId=uuid.uuid4(),
+            conversationId=conversation_id,
+            messageType=["urn:message:LTS.DTOs:RouteDTO"],
+            message=pricer.calculate_price(route, VEHICLE).to_wire(),
+        ).json(by_alias=True)
+
+    return {
+        "coordinates": lambda: calculator.get_lat_lon_arrays(trace, "long"),
+        "nearest_edges": lambda: calculator.snap(lats, lons),
+        "gap_fill_shortest_path": connect,
+        "hmm_match": lambda: calculator.match_hmm(lats, lons),
+        "route_edges": lambda: calculator.get_route_edges(route_node_ids),
+        "parse_timestamps": lambda: parse_timestamps(raw_timestamps),
+        "edge_timestamps": lambda: match_timestamps(
+            remove_duplicates(coordinate_edges),
+            edge_table.edge_tuples(route_edges),
+            get_start_and_end_time_of_edges(timestamps, coordinate_edges),
+        ),
+        "fill_timestamps": fill,
+        "generate_formatted_route": format_route,
+        # Pricing sets the prices of the route, price a copy of the formatted route
+        "calculate_price": lambda: pricer.calculate_price(
+            copy.copy(formatted), VEHICLE
+        ),
+        "serialize": serialize,
+        "end_to_end": end_to_end,
+    }
+
+
+def git_commit() -> str:
+    """
+    Get the commit the benchmark runs on.
+
+    :return: The commit hash or None outside a git checkout
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(
+    lengths=(500, 2000),
+    repeats: int = 5,
+    rows: int = 40,
+    cols: int = 40,
+    noise: float = 0.00005,
+    gap_fill_mode: str = "expand",
+    timestamp_fill_mode: str = "copy",
+) -> dict:
+    """
+    Time every stage for traces of the given lengths.
+
+    :param lengths: Number of points of the traces
+    :param repeats: Number of timed runs per stage
+    :param rows: Number of node rows of the graph
+    :param cols: Number of node columns of the graph
+    :param noise: GPS noise of the traces in degrees
+    :param gap_fill_mode: GAP_FILL_MODE of the calculator
+    :param timestamp_fill_mode: TIMESTAMP_FILL_MODE of the calculator
+    :return: Dict with the run metadata and the timings per trace length and stage
+    """
+    start = time.perf_counter()
+    calculator = Calculator(grid_graph(rows=rows, cols=cols))
+    calculator.gap_fill_mode = gap_fill_mode
+    calculator.timestamp_fill_mode = timestamp_fill_mode
+    graph_seconds = time.perf_counter() - start
+    pricer = Pricer(price_model())
+
+    results = {}
+    for length in lengths:
+        trace = random_trace(calculator.area_graph, length=length, noise=noise)
+        results[str(length)] = {
+            name: time_stage(stage, repeats)
+            for name, stage in stages(calculator, pricer, trace).items()
+        }
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "graph": {
+                "rows": rows,
+                "cols": cols,
+                "nodes": calculator.area_graph.number_of_nodes(),
+                "edges": calculator.area_graph.number_of_edges(),
+                "setup_seconds": graph_seconds,
+            },
+            "repeats": repeats,
+            "noise": noise,
+            "gap_fill_mode": gap_fill_mode,
+            "timestamp_fill_mode": timestamp_fill_mode,
+        },
+        "results": results,
+    }
+
+
+def compare(result: dict, baseline: dict) -> list:
+    """
+    Compare the median times of a run with a baseline run.
+
+    :param result: The run
+    :param baseline: The baseline run
+    :return: List of (trace length, stage, baseline ms, ms, ratio) for shared stages
+    """
+    rows = []
+    for length, timings in result["results"].items():
+        for stage, timing in timings.items():
+            base = baseline["results"].get(length, {}).get(stage)
+            if base is None:
+                continue
+            rows.append(
+                (
+                    length,
+                    stage,
+                    base["median_ms"],
+                    timing["median_ms"],
+                    timing["median_ms"] / base["median_ms"],
+                )
+            )
+    return rows
+
+
+def main(argv=None):
+    """
+    Run the benchmark from the command line.
+
+    :param argv: The arguments, sys.argv if not given
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lengths", type=int, nargs="+", default=[500, 2000])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--rows", type=int, default=40)
+    parser.add_argument("--cols", type=int, default=40)
+    parser.add_argument("--noise", type=float, default=0.00005)
+    parser.add_argument("--gap-fill-mode", default="expand")
+    parser.add_argument("--timestamp-fill-mode", default="copy")
+    parser.add_argument("--output", help="File to write the JSON results to")
+    parser.add_argument("--baseline", help="JSON results to compare with")
+    args = parser.parse_args(argv)
+
+    # The pipeline logs every route, which would end up in the timings
+    logging.disable(logging.WARNING)
+    result = run(
+        lengths=args.lengths,
+        repeats=args.repeats,
+        rows=args.rows,
+        cols=args.cols,
+        noise=args.noise,
+        gap_fill_mode=args.gap_fill_mode,
+        timestamp_fill_mode=args.timestamp_fill_mode,
+    )
+    logging.disable(logging.NOTSET)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()  # noqa: T201
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        for length, stage, base, current, ratio in compare(result, baseline):
+            print(  # noqa: T201
+                f"{length:>6} {stage:<26} {base:9.2f} ms -> {current:9.2f} ms "
+                f"({ratio:.2f}x)",
+                file=sys.stderr,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark comparing a connection per message with the persistent Sender.
+
+Runs against the stand-in broker, so it measures the client side and local round
+trips only.
+
+Run with: python -m src.benchmarks.bench_sender [messages]
+"""
+import json
+import logging
+import sys
+import time
+import uuid
+
+from masstransitpython import RabbitMQConfiguration
+from pika import PlainCredentials
+from src.benchmarks.stand_in_broker import StandInBroker
+from src.router_service.library_overrides.RabbitMQSender import RabbitMQSender
+from src.router_service.services.sender import Sender
+
+EXCHANGE = "LTS.DTOs:RouteDTO"
+
+
+def message(segments: int = 200) -> dict:
+    """
+    Route message of about the size the service sends.
+
+    :param segments: Number of segments
+    :return: The message in the wire format
+    """
+    node = {"id": "1234567890", "lat": 50.8503396, "lon": 4.3517103}
+    return {
+        "id": "250aae3e-4c20-46e4-b5dc-7b32af4dbf9a",
+        "priceTotal": 1.23,
+        "segments": [
+            {
+                "start": node,
+                "way": {"id": "987654321"},
+                "end": node,
+                "time": "2023-06-01T13:04:30",
+                "price": 0.01,
+            }
+        ]
+        * segments,
+    }
+
+
+def connection_per_message(conf, body: bytes, route: dict):
+    """
+    Send like the old Sender, opening and declaring on every message.
+
+    :param conf: RabbitMQConfiguration object
+    :param body: The consumed message
+    :param route: The route to send
+    """
+    with RabbitMQSender(conf) as sender:
+        sender.set_exchange(exchange=EXCHANGE)
+        response = sender.create_masstransit_response(route, json.loads(body))
+        sender.publish(message=response)
+
+
+def run(messages: int = 500):
+    """
+    Time publishing on both paths.
+
+    :param messages: Number of messages per path
+    :return: Dict with the messages per second of every path
+    """
+    broker = StandInBroker()
+    conf = RabbitMQConfiguration(
+        PlainCredentials("guest", "guest"),
+        queue="py-router",
+        host=broker.host,
+        port=broker.port,
+        virtual_host="/",
+    )
+    body = json.dumps({"conversationId": str(uuid.uuid4()), "message": {}}).encode()
+    route = message()
+    # The publisher logs every message, which would dominate the timings
+    logging.disable(logging.WARNING)
+    results = {"messages": messages}
+    try:
+        start = time.perf_counter()
+        for _ in range(messages):
+            connection_per_message(conf, body, route)
+        results["connection_per_message"] = messages / (time.perf_counter() - start)
+
+        for name, confirm in (("persistent", False), ("persistent_confirms", True)):
+            sender = Sender(conf, EXCHANGE, confirm=confirm)
+            start = time.perf_counter()
+            for _ in range(messages):
+                sender.send_message(body=body, message=route)
+            results[name] = messages / (time.perf_counter() - start)
+            sender.close()
+        results["published"] = broker.published
+        results["connections_opened"] = broker.connections_opened
+    finally:
+        logging.disable(logging.NOTSET)
+        broker.stop()
+    return results
+
+
+if __name__ == "__main__":
+    result = run(*[int(arg) for arg in sys.argv[1:2]])
+    print(  # noqa: T201
+        f"{result['messages']} messages/s: "
+        f"connection per message {result['connection_per_message']:.0f}, "
+        f"persistent {result['persistent']:.0f}, "
+        f"persistent with confirms {result['persistent_confirms']:.0f}"
+    )
@@ -0,0 +1,158 @@
+"""
+Soak benchmark comparing a full collection after every message with a frozen heap.
+
+Every mode runs in its own forked process that loads the graph, handles the same
+messages through Receiver.handler and samples its RSS with psutil.
+
+Run with: python -m src.benchmarks.bench_soak --messages 500 --output soak.json
+"""
+import argparse
+import gc
+import json
+import logging
+import multiprocessing
+import statistics
+import sys
+import time
+
+import numpy as np
+import psutil
+from src.benchmarks.synthetic import grid_graph, price_model, random_trace
+from src.router_service.helpers import memory
+from src.router_service.models.vehicle import VehicleInt
+from src.router_service.services.calculator import Calculator
+from src.router_service.services.pricer import Pricer
+from src.router_service.services.receiver import Receiver
+
+VEHICLE = VehicleInt(
+    id="250aae3e-4c20-46e4-b5dc-7b32af4dbf9a",
+    vehicleClassification="M1",
+    fuelType="Diesel",
+)
+MODES = ("collect", "frozen")
+
+
+def soak(mode: str, messages: int, rows: int, cols: int, length: int) -> dict:
+    """
+    Handle messages in the current process and measure latency and RSS.
+
+    :param mode: "collect" runs gc.collect after every message like the receiver used
+        to, "frozen" freezes the heap after loading the graph
+    :param messages: Number of messages to handle
+    :param rows: Number of node rows of the graph
+    :param cols: Number of node columns of the graph
+    :param length: Number of points per trace
+    :return: Dict with latency percentiles and RSS samples
+    """
+    process = psutil.Process()
+    calculator = Calculator(grid_graph(rows=rows, cols=cols))
+    pricer = Pricer(price_model())
+    traces = [
+        random_trace(calculator.area_graph, length=length, seed=seed)
+        for seed in range(20)
+    ]
+    bodies = [json.dumps({"message": trace}).encode() for trace in traces]
+
+    def handle(message):
+        route = calculator.map_to_map(message, "long", "timeStamp")
+        return json.dumps(pricer.calculate_price(route, VEHICLE).to_wire())
+
+    receiver = Receiver(None, "exchange", handle)
+    if mode == "frozen":
+        memory.configure_gc()
+        memory.freeze_heap()
+    rss_loaded = process.memory_info().rss
+
+    latencies = []
+    rss = []
+    for number in range(messages):
+        start = time.perf_counter()
+        receiver.handler(None, None, None, bodies[number % len(bodies)])
+        if mode == "collect":
+            gc.collect()
+        latencies.append(time.perf_counter() - start)
+        if number % max(messages // 20, 1) == 0:
+            rss.append(process.memory_info().rss)
+    rss.append(process.memory_info().rss)
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "messages": messages,
+        "latency_ms": {
+            "mean": float(latencies_ms.mean()),
+            "p50": float(np.percentile(latencies_ms, 50)),
+            "p99": float(np.percentile(latencies_ms, 99)),
+            "max": float(latencies_ms.max()),
+        },
+        "rss_loaded_mb": rss_loaded / 2**20,
+        "rss_steady_mb": statistics.median(rss[len(rss) // 2 :]) / 2**20,
+        "rss_final_mb": rss[-1] / 2**20,
+        "rss_samples_mb": [value / 2**20 for value in rss],
+        "gc_collections": [generation["collections"] for generation in gc.get_stats()],
+        "gc_frozen": gc.get_freeze_count(),
+    }
+
+
+def _soak_child(queue, *args):
+    """
+    Run soak in a forked process and send back the result.
+
+    :param queue: Queue to put the result on
+    :param args: Arguments of soak
+    """
+    logging.disable(logging.WARNING)
+    queue.put(soak(*args))
+
+
+def run(messages: int = 300, rows: int = 60, cols: int = 60, length: int = 500) -> dict:
+    """
+    Soak every mode in a fresh process.
+
+    :param messages: Number of messages per mode
+    :param rows: Number of node rows of the graph
+    :param cols: Number of node columns of the graph
+    :param length: Number of points per trace
+    :return: Dict of mode to its results
+    """
+    context = multiprocessing.get_context("fork")
+    results = {}
+    for mode in MODES:
+        queue = context.Queue()
+        child = context.Process(
+            target=_soak_child, args=(queue, mode, messages, rows, cols, length)
+        )
+        child.start()
+        results[mode] = queue.get()
+        child.join()
+    return results
+
+
+def main(argv=None):
+    """
+    Run the benchmark from the command line.
+
+    :param argv: The arguments, sys.argv if not given
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--rows", type=int, default=60)
+    parser.add_argument("--cols", type=int, default=60)
+    parser.add_argument("--length", type=int, default=500)
+    parser.add_argument("--output", help="File to write the JSON results to")
+    args = parser.parse_args(argv)
+
+    results = run(args.messages, args.rows, args.cols, args.length)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    for mode, result in results.items():
+        latency = result["latency_ms"]
+        print(  # noqa: T201
+            f"{mode:>8}: p50 {latency['p50']:.1f} ms, p99 {latency['p99']:.1f} ms, "
+            f"steady RSS {result['rss_steady_mb']:.0f} MB",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
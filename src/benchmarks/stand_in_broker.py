@@ -0,0 +1,195 @@
+"""
+Minimal in-process AMQP 0-9-1 broker for benchmarking and testing publishers.
+
+It speaks just enough of the protocol for pika to connect, declare, publish and use
+publisher confirms. Published messages are counted and dropped.
+"""
+import socket
+import socketserver
+import threading
+
+from pika import frame, spec
+
+SERVER_PROPERTIES = {
+    "product": "stand-in broker",
+    "capabilities": {
+        "publisher_confirms": True,
+        "basic.nack": True,
+        "exchange_exchange_bindings": True,
+        "consumer_cancel_notify": True,
+        "connection.blocked": True,
+        "authentication_failure_close": True,
+    },
+}
+
+_REPLIES = {
+    spec.Channel.Open: spec.Channel.OpenOk,
+    spec.Channel.Close: spec.Channel.CloseOk,
+    spec.Exchange.Declare: spec.Exchange.DeclareOk,
+    spec.Queue.Bind: spec.Queue.BindOk,
+    spec.Basic.Qos: spec.Basic.QosOk,
+    spec.Confirm.Select: spec.Confirm.SelectOk,
+}
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """
+    Handles one client connection.
+    """
+
+    def handle(self):
+        """
+        Run the connection until the client or the broker closes it.
+        """
+        broker = self.server.broker
+        broker.register(self.request)
+        buffer = b""
+        confirming = set()
+        delivery_tags = {}
+        self.request.sendall(
+            frame.Method(
+                0, spec.Connection.Start(server_properties=SERVER_PROPERTIES)
+            ).marshal()
+        )
+        try:
+            while True:
+                data = self.request.recv(65536)
+                if not data:
+                    return
+                buffer += data
+                replies = []
+                while True:
+                    consumed, decoded = frame.decode_frame(buffer)
+                    if decoded is None:
+                        break
+                    buffer = buffer[consumed:]
+                    reply = self._reply(decoded, broker, confirming, delivery_tags)
+                    if reply is not None:
+                        replies.append(reply.marshal())
+                    if isinstance(reply, frame.Method) and isinstance(
+                        reply.method, spec.Connection.CloseOk
+                    ):
+                        self.request.sendall(b"".join(replies))
+                        return
+                if replies:
+                    self.request.sendall(b"".join(replies))
+        except OSError:
+            return
+        finally:
+            broker.unregister(self.request)
+
+    @staticmethod
+    def _reply(decoded, broker, confirming, delivery_tags):
+        """
+        Get the reply to a frame.
+
+        :param decoded: The frame
+        :param broker: The broker
+        :param confirming: Channels in confirm mode
+        :param delivery_tags: Last delivery tag per channel
+        :return: Frame to send or None
+        """
+        if not isinstance(decoded, frame.Method):
+            if isinstance(decoded, frame.Body):
+                broker.count()
+                channel = decoded.channel_number
+                if channel in confirming:
+                    delivery_tags[channel] = delivery_tags.get(channel, 0) + 1
+                    return frame.Method(
+                        channel, spec.Basic.Ack(delivery_tag=delivery_tags[channel])
+                    )
+            return None
+        method = decoded.method
+        channel = decoded.channel_number
+        if isinstance(method, spec.Connection.StartOk):
+            return frame.Method(
+                0, spec.Connection.Tune(channel_max=2047, frame_max=131072, heartbeat=0)
+            )
+        if isinstance(method, spec.Connection.Open):
+            return frame.Method(0, spec.Connection.OpenOk())
+        if isinstance(method, spec.Connection.Close):
+            return frame.Method(0, spec.Connection.CloseOk())
+        if isinstance(method, spec.Queue.Declare):
+            return frame.Method(
+                channel,
+                spec.Queue.DeclareOk(
+                    queue=method.queue, message_count=0, consumer_count=0
+                ),
+            )
+        if isinstance(method, spec.Confirm.Select):
+            confirming.add(channel)
+        for request, reply in _REPLIES.items():
+            if isinstance(method, request):
+                return frame.Method(channel, reply())
+        return None
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class StandInBroker:
+    """
+    Broker running on a background thread on a free local port.
+    """
+
+    def __init__(self):
+        """
+        Start the broker.
+        """
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.broker = self
+        self.host, self.port = self._server.server_address
+        self._lock = threading.Lock()
+        self._connections = set()
+        self.published = 0
+        self.connections_opened = 0
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def register(self, connection):
+        """
+        Track a client connection.
+
+        :param connection: The client socket
+        """
+        with self._lock:
+            self._connections.add(connection)
+            self.connections_opened += 1
+
+    def unregister(self, connection):
+        """
+        Stop tracking a client connection.
+
+        :param connection: The client socket
+        """
+        with self._lock:
+            self._connections.discard(connection)
+
+    def count(self):
+        """
+        Count a published message.
+        """
+        with self._lock:
+            self.published += 1
+
+    def drop_connections(self):
+        """
+        Close all client connections, like a broker restart.
+        """
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def stop(self):
+        """
+        Stop the broker.
+        """
+        self.drop_connections()
+        self._server.shutdown()
+        self._server.server_close()
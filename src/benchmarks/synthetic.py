@@ -0,0 +1,217 @@
+"""
+Deterministic synthetic road graphs and GPS traces for benchmarks and tests.
+
+The graphs mimic the shape of a projected osmnx graph (EPSG:4326, x/y/lon/lat on
+nodes, osmid/name/highway/length on edges) so they can be fed straight into the
+Calculator without downloading anything.
+"""
+import math
+from datetime import datetime, timedelta
+
+import numpy as np
+from networkx import MultiDiGraph
+from src.router_service.helpers.helpers import haversine
+from src.router_service.models.price_model import PriceModel
+
+ORIGIN_LAT = 51.4416
+ORIGIN_LON = 5.4697
+SPACING = 0.001  # degrees, roughly 70-110 meters
+HIGHWAY_TYPES = ["residential", "tertiary", "secondary", "primary", "motorway"]
+
+
+def grid_graph(rows: int = 40, cols: int = 40, seed: int = 42) -> MultiDiGraph:
+    """
+    Generate a two-way grid road graph with osmnx style attributes.
+
+    :param rows: Number of node rows
+    :param cols: Number of node columns
+    :param seed: Seed for the random attributes and coordinate jitter
+    :return: The graph
+    """
+    rng = np.random.default_rng(seed)
+    graph = MultiDiGraph(crs="EPSG:4326")
+
+    def node_id(row, col):
+        return 1_000_000 + row * cols + col
+
+    for row in range(rows):
+        for col in range(cols):
+            lat = ORIGIN_LAT + row * SPACING + rng.normal(0, SPACING / 20)
+            lon = ORIGIN_LON + col * SPACING + rng.normal(0, SPACING / 20)
+            graph.add_node(
+                node_id(row, col), x=lon, y=lat, lon=lon, lat=lat, street_count=4
+            )
+
+    way_id = 5_000_000
+    for row in range(rows):
+        for col in range(cols):
+            for d_row, d_col in ((0, 1), (1, 0)):
+                if row + d_row >= rows or col + d_col >= cols:
+                    continue
+                u = node_id(row, col)
+                v = node_id(row + d_row, col + d_col)
+                way_id += 1
+                highway = HIGHWAY_TYPES[int(rng.integers(len(HIGHWAY_TYPES)))]
+                if rng.random() < 0.05:
+                    # osmnx merges ways with different types into lists
+                    highway = [highway, HIGHWAY_TYPES[0]]
+                osmid = way_id if rng.random() > 0.05 else [way_id, way_id + 10**7]
+                attributes = {
+                    "osmid": osmid,
+                    "highway": highway,
+                    "oneway": False,
+                    "length": float(
+                        haversine(
+                            graph.nodes[u]["lat"],
+                            graph.nodes[u]["lon"],
+                            graph.nodes[v]["lat"],
+                            graph.nodes[v]["lon"],
+                        )
+                    ),
+                }
+                if rng.random() > 0.1:
+                    attributes["name"] = f"Street {row if d_col else col}"
+                graph.add_edge(u, v, key=0, reversed=False, **attributes)
+                graph.add_edge(v, u, key=0, reversed=True, **attributes)
+    return graph
+
+
+def random_trace(
+    graph: MultiDiGraph,
+    length: int = 500,
+    noise: float = 0.00005,
+    seed: int = 7,
+    longitude_field: str = "long",
+    time_field: str = "timeStamp",
+    interval: float = 1.0,
+) -> list[dict]:
+    """
+    Generate a noisy GPS trace following a random walk over the graph.
+
+    The walk never immediately turns back and mostly keeps going straight, and
+    points are interpolated along each traversed edge so consecutive points are a
+    few meters apart.
+
+    :param graph: Graph generated by grid_graph
+    :param length: Number of points in the trace
+    :param noise: Standard deviation of the GPS noise in degrees
+    :param seed: Seed for the walk and the noise
+    :param longitude_field: Name of the longitude field, "long" (domestic) or "lon"
+    :param time_field: Name of the time field, "timeStamp" (domestic) or "time"
+    :param interval: Seconds between points
+    :return: List of coordinate dicts like the ones in incoming messages
+    """
+    rng = np.random.default_rng(seed)
+    nodes = list(graph.nodes)
+    current = nodes[int(rng.integers(len(nodes)))]
+    previous = None
+    start_time = datetime(2023, 6, 1, 7, 30, 0)
+    points = []
+    while len(points) < length:
+        successors = [n for n in graph.successors(current) if n != previous]
+        if not successors:
+            successors = list(graph.successors(current))
+        following = successors[int(rng.integers(len(successors)))]
+        if previous is not None and rng.random() < 0.8:
+            # Keep going in the same direction when the road continues
+            heading = _heading(graph, previous, current)
+            following = min(
+                successors,
+                key=lambda node: abs(
+                    (_heading(graph, current, node) - heading + math.pi) % (2 * math.pi)
+                    - math.pi
+                ),
+            )
+        start = graph.nodes[current]
+        end = graph.nodes[following]
+        steps = max(
+            2,
+            math.ceil(graph.edges[current, following, 0]["length"] / 12),
+        )
+        for step in range(steps):
+            if len(points) >= length:
+                break
+            fraction = step / steps
+            lat = start["lat"] + (end["lat"] - start["lat"]) * fraction
+            lon = start["lon"] + (end["lon"] - start["lon"]) * fraction
+            time = start_time + timedelta(seconds=interval * len(points))
+            points.append(
+                {
+                    "lat": float(lat + rng.normal(0, noise)),
+                    longitude_field: float(lon + rng.normal(0, noise)),
+                    # .NET style timestamp with 7 fractional digits
+                    time_field: time.strftime("%Y-%m-%dT%H:%M:%S.%f") + "0Z",
+                }
+            )
+        previous, current = current, following
+    return points
+
+
+def trace_length(points: list[dict], longitude_field: str = "long") -> float:
+    """
+    Get the distance along a trace, the length of its walk for a trace without noise.
+
+    :param points: The coordinates, as returned by random_trace
+    :param longitude_field: Name of the longitude field
+    :return: The length in meters
+    """
+    lats = np.array([point["lat"] for point in points])
+    lons = np.array([point[longitude_field] for point in points])
+    return float(haversine(lats[:-1], lons[:-1], lats[1:], lons[1:]).sum())
+
+
+def route_length(graph: MultiDiGraph, route: list) -> float:
+    """
+    Get the length of a route.
+
+    :param graph: The graph the route is on
+    :param route: The node ids of the route
+    :return: The length in meters
+    """
+    return float(sum(graph.edges[u, v, 0]["length"] for u, v in zip(route, route[1:])))
+
+
+def u_turns(route: list) -> int:
+    """
+    Count the times a route goes straight back to the node it came from.
+
+    :param route: The node ids of the route
+    :return: The number of u-turns
+    """
+    return sum(a == c for a, c in zip(route, route[2:]))
+
+
+def price_model() -> PriceModel:
+    """
+    Generate a price model like the one from the payment service.
+
+    :return: The price model
+    """
+    modifiers = [
+        ("basePrice", "base", 0.13),
+        ("highway", "motorway", 0.8),
+        ("highway", "primary", 1.1),
+        ("highway", "secondary", 1.35),
+        ("highway", "residential", 0.2),
+        ("vehicleClassification", "M1", 1.15),
+        ("fuelType", "Diesel", 0.3),
+        ("fuelType", "Electric", 0.05),
+    ] + [("rushPrice", str(hour), 1.5) for hour in (7, 8, 16, 17)]
+    return PriceModel.parse_obj(
+        [
+            {
+                "id": str(index),
+                "priceTitle": title,
+                "priceType": "percentage",
+                "valueName": name,
+                "valueDescription": value,
+            }
+            for index, (title, name, value) in enumerate(modifiers)
+        ]
+    )
+
+
+def _heading(graph: MultiDiGraph, u, v):
+    start = graph.nodes[u]
+    end = graph.nodes[v]
+    return math.atan2(end["lat"] - start["lat"], end["lon"] - start["lon"])
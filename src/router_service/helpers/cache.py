@@ -0,0 +1,143 @@
+"""
+In memory caches.
+"""
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Size bounded least recently used cache with hit, miss and eviction counters.
+    """
+
+    def __init__(self, max_size: int):
+        """
+        Create the cache.
+
+        :param max_size: Maximum number of entries, 0 disables the cache
+        """
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        """
+        Get the number of entries.
+
+        :return: The number of entries
+        """
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Get an entry and mark it as most recently used.
+
+        :param key: The key
+        :param default: Value to return if the key isn't cached
+        :return: The cached value or the default
+        """
+        value = self._entries.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Add or replace an entry, evicting the least recently used entries if full.
+
+        :param key: The key
+        :param value: The value
+        """
+        if self.max_size <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Remove all entries, the counters are kept.
+        """
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Get the counters and current size.
+
+        :return: Dict with size, max_size, hits, misses and evictions
+        """
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class TTLCache(LRUCache):
+    """
+    Size bounded least recently used cache whose entries expire after a fixed time.
+    """
+
+    def __init__(self, max_size: int, ttl: float, clock=time.monotonic):
+        """
+        Create the cache.
+
+        :param max_size: Maximum number of entries, 0 disables the cache
+        :param ttl: Seconds an entry stays valid after it was put
+        :param clock: Function returning the current time in seconds
+        """
+        super().__init__(max_size)
+        self.ttl = ttl
+        self.clock = clock
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        """
+        Get an entry that hasn't expired and mark it as most recently used.
+
+        :param key: The key
+        :param default: Value to return if the key isn't cached or expired
+        :return: The cached value or the default
+        """
+        entry = self._entries.get(key, _MISSING)
+        if entry is not _MISSING and entry[0] <= self.clock():
+            del self._entries[key]
+            self.expirations += 1
+            entry = _MISSING
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        """
+        Add or replace an entry, evicting the least recently used entries if full.
+
+        :param key: The key
+        :param value: The value
+        """
+        super().put(key, (self.clock() + self.ttl, value))
+
+    def stats(self) -> dict:
+        """
+        Get the counters and current size.
+
+        :return: Dict with size, max_size, ttl, hits, misses, evictions and expirations
+        """
+        stats = super().stats()
+        stats["ttl"] = self.ttl
+        stats["expirations"] = self.expirations
+        return stats
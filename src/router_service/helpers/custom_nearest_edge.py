@@ -5,6 +5,7 @@ import numpy as np
 import pandas
 from networkx import MultiDiGraph
 from osmnx import utils_graph
+import shapely
 from shapely import Point, STRtree
 
 
@@ -20,6 +21,18 @@ def init_rtree(graph: MultiDiGraph):
     return geoms, rtree
 
 
+def init_edge_ids(geoms: pandas.Series) -> np.ndarray:
+    """
+    Get the (u, v, key) ids of every edge in rtree order as an int array.
+
+    :param geoms: Geometry series indexed by u/v/key, as returned by init_rtree.
+    :return: Array of shape (edges, 3) where row i belongs to rtree position i.
+    """
+    return np.column_stack(
+        [geoms.index.get_level_values(level) for level in range(3)]
+    ).astype(np.int64)
+
+
 def nearest_edges(
     geoms: pandas.DataFrame,
     rtree: STRtree,
@@ -59,3 +72,31 @@ def nearest_edges(
         ne = ne[0]
 
     return ne
+
+
+def nearest_edges_batch(
+    edge_ids: np.ndarray,
+    rtree: STRtree,
+    lats: np.ndarray,
+    lons: np.ndarray,
+) -> np.ndarray:
+    """
+    Find the nearest edge of every point of a trace with a single rtree query.
+
+    Unlike nearest_edges this doesn't build a Point per coordinate or touch the
+    geometry dataframe, which makes it a lot cheaper for long traces.
+
+    :param edge_ids: Edge ids in rtree order, as returned by init_edge_ids.
+    :param rtree: A query-only R-tree spatial index created using the Sort-Tile-Recursive (STR) algorithm.
+    :param lats: Array of latitudes.
+    :param lons: Array of longitudes.
+    :return: Array of shape (points, 3) with the u, v and key of each nearest edge.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    if np.isnan(lats).any() or np.isnan(lons).any():  # pragma: no cover
+        raise ValueError("`lats` and `lons` cannot contain nulls")
+
+    points = shapely.points(lons, lats)
+    pos = rtree.query_nearest(points, all_matches=False, return_distance=False)[1]
+    return edge_ids[pos]
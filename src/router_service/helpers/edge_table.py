@@ -0,0 +1,116 @@
+"""
+Precomputed per-edge attribute arrays for building routes without dataframes.
+"""
+import numpy as np
+from networkx import MultiDiGraph
+
+
+class EdgeTable:
+    """
+    Edge attributes and node coordinates of a graph as arrays, edges in rtree order.
+
+    Missing string attributes are stored as "", like the fillna("") on the old route
+    dataframes.
+    """
+
+    def __init__(self, graph: MultiDiGraph, edge_ids: np.ndarray):
+        """
+        Build the table.
+
+        :param graph: The graph
+        :param edge_ids: Edge ids in rtree order, as returned by init_edge_ids
+        """
+        self.edge_ids = edge_ids
+        edge_list = [tuple(edge) for edge in edge_ids.tolist()]
+        edge_data = [graph.edges[edge] for edge in edge_list]
+
+        self.osmid = np.empty(len(edge_data), dtype=object)
+        self.osmid[:] = [data.get("osmid", "") for data in edge_data]
+        self.name = np.empty(len(edge_data), dtype=object)
+        self.name[:] = [data.get("name", "") for data in edge_data]
+        self.highway = np.empty(len(edge_data), dtype=object)
+        self.highway[:] = [data.get("highway", "") for data in edge_data]
+        self.length = np.array(
+            [data.get("length", 0.0) for data in edge_data], dtype=np.float64
+        )
+
+        self._index_node_pairs()
+
+        nodes = list(graph.nodes)
+        self.node_index = {node: position for position, node in enumerate(nodes)}
+        self.node_lon = np.array(
+            [graph.nodes[node].get("lon", graph.nodes[node]["x"]) for node in nodes],
+            dtype=np.float64,
+        )
+        self.node_lat = np.array(
+            [graph.nodes[node].get("lat", graph.nodes[node]["y"]) for node in nodes],
+            dtype=np.float64,
+        )
+
+    @classmethod
+    def concat(cls, tables: list, keep: np.ndarray = None) -> "EdgeTable":
+        """
+        Join the tables of several graphs that share node ids, without the graphs.
+
+        :param tables: The tables, with integer node ids
+        :param keep: Boolean mask of the edges of all tables to keep, all if not given
+        :return: The table of the joined graph, edges in the order of the tables
+        """
+        table = cls.__new__(cls)
+        for name in ("edge_ids", "osmid", "name", "highway", "length"):
+            joined = np.concatenate([getattr(part, name) for part in tables])
+            setattr(table, name, joined if keep is None else joined[keep])
+        table._index_node_pairs()
+
+        node_ids = np.concatenate(
+            [
+                np.fromiter(part.node_index, dtype=np.int64, count=len(part.node_index))
+                for part in tables
+            ]
+        )
+        _, first = np.unique(node_ids, return_index=True)
+        first.sort()
+        table.node_index = dict(zip(node_ids[first].tolist(), range(len(first))))
+        table.node_lon = np.concatenate([part.node_lon for part in tables])[first]
+        table.node_lat = np.concatenate([part.node_lat for part in tables])[first]
+        return table
+
+    def _index_node_pairs(self):
+        """
+        Index the edge between every pair of nodes.
+
+        Routes are node sequences, between two nodes the shortest parallel edge is used,
+        the first one if several are as short.
+        """
+        positions = np.arange(len(self.length))
+        # Written longest first, so the shortest and first parallel edge is kept
+        order = np.lexsort((-positions, -self.length))
+        self.node_pair_index = dict(
+            zip(
+                zip(self.edge_ids[order, 0].tolist(), self.edge_ids[order, 1].tolist()),
+                order.tolist(),
+            )
+        )
+
+    def route_edges(self, route_node_ids: list) -> np.ndarray:
+        """
+        Get the edges of a route in the order they are driven.
+
+        :param route_node_ids: The route as an ordered list of nodes
+        :return: Array with the position of every route edge in the table
+        """
+        lookup = self.node_pair_index
+        return np.fromiter(
+            (lookup[pair] for pair in zip(route_node_ids, route_node_ids[1:])),
+            dtype=np.int64,
+            count=max(len(route_node_ids) - 1, 0),
+        )
+
+    def edge_tuples(self, positions: np.ndarray) -> list:
+        """
+        Get the (u, v, key) of the edges at the given positions.
+
+        :param positions: Positions in the table
+        :return: List of (u, v, key) tuples
+        """
+        return [tuple(edge) for edge in self.edge_ids[positions].tolist()]
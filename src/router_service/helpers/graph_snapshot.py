@@ -0,0 +1,265 @@
+"""
+Persisted graph snapshots for fast startup.
+
+A snapshot is a folder of .npy arrays plus a small json file. Loading it skips
+downloading and projecting the graph. The graph is rebuilt from the arrays, so every
+process holds its own copy.
+
+The snapshot folder is a symlink to the current version of the snapshot, a folder
+next to it. A new version is written completely before the symlink is swapped to it.
+
+Layout:
+    meta.json           Graph attributes, region key and the attribute vocabularies
+    node_ids.npy        int64 (nodes,)
+    node_coords.npy     float64 (nodes, 4) with x, y, lon, lat
+    node_streets.npy    int32 (nodes,) street count, -1 when missing
+    edge_ids.npy        int64 (edges, 3) with u, v, key in rtree order
+    edge_length.npy     float64 (edges,)
+    edge_<attr>.npy     int32 (edges,) index into the vocabulary of attr, -1 when missing
+    geom_coords.npy     float64 (points, 2) coordinates of all edge geometries
+    geom_offsets.npy    int64 (edges + 1,) start of every edge geometry in geom_coords
+"""
+import fcntl
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas
+import shapely
+from geopandas import GeoSeries
+from networkx import MultiDiGraph
+
+SNAPSHOT_VERSION = 1
+META_FILE = "meta.json"
+NODE_ATTRIBUTES = ["x", "y", "lon", "lat"]
+
+
+def snapshot_exists(folder: str) -> bool:
+    """
+    Check if the folder contains a snapshot.
+
+    :param folder: The snapshot folder
+    :return: True if a snapshot was written to the folder
+    """
+    return os.path.isfile(os.path.join(folder, META_FILE))
+
+
+def save_snapshot(graph: MultiDiGraph, geoms: pandas.Series, folder: str, region=None):
+    """
+    Write the graph and its edge geometries to a snapshot folder.
+
+    The snapshot is written to a new version folder, and the snapshot folder is then
+    atomically replaced by a symlink to it. Replicas starting at the same time read
+    either the previous or the new version, never a half written one. The previous
+    version is kept until the next save, for replicas that are still loading it.
+    Writers wait for each other with a lock file.
+
+    :param graph: The projected graph
+    :param geoms: Geometry series indexed by u/v/key, as returned by init_rtree
+    :param folder: The snapshot folder, replaced if it already exists
+    :param region: Key of the region the graph was loaded for, checked when loading
+    """
+    folder = os.path.abspath(folder)
+    parent, name = os.path.split(folder)
+    os.makedirs(parent, exist_ok=True)
+    with open(os.path.join(parent, f".{name}.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        version = tempfile.mkdtemp(prefix=f".{name}-", dir=parent)
+        _write_arrays(graph, geoms, version, region)
+        _swap(folder, version)
+    logging.warning(
+        f"Saved graph snapshot with {len(graph)} nodes and "
+        f"{graph.number_of_edges()} edges"
+    )
+
+
+def _write_arrays(graph: MultiDiGraph, geoms: pandas.Series, folder: str, region):
+    """
+    Write the arrays and meta file of a snapshot.
+
+    :param graph: The projected graph
+    :param geoms: Geometry series indexed by u/v/key
+    :param folder: The empty version folder
+    :param region: Key of the region the graph was loaded for
+    """
+    node_ids = np.fromiter(graph.nodes, dtype=np.int64, count=len(graph))
+    node_data = [graph.nodes[node] for node in graph.nodes]
+    node_coords = np.array(
+        [[data.get(name, np.nan) for name in NODE_ATTRIBUTES] for data in node_data],
+        dtype=np.float64,
+    ).reshape(-1, len(NODE_ATTRIBUTES))
+    node_streets = np.array(
+        [data.get("street_count", -1) for data in node_data], dtype=np.int32
+    )
+
+    edge_ids = np.column_stack(
+        [geoms.index.get_level_values(level) for level in range(3)]
+    ).astype(np.int64)
+    edge_data = [graph.edges[u, v, key] for u, v, key in edge_ids.tolist()]
+    edge_length = np.array(
+        [data.get("length", np.nan) for data in edge_data], dtype=np.float64
+    )
+
+    # Every other edge attribute is stored as an index into a per attribute
+    # vocabulary. Values can be lists, so they are keyed on their json form.
+    attribute_names = sorted(
+        {name for data in edge_data for name in data} - {"length", "geometry"}
+    )
+    vocabularies = {}
+    edge_attributes = {}
+    for name in attribute_names:
+        lookup = {}
+        vocabulary = []
+        codes = np.full(len(edge_data), -1, dtype=np.int32)
+        for index, data in enumerate(edge_data):
+            if name not in data:
+                continue
+            value = data[name]
+            key = json.dumps(value, default=str)
+            if key not in lookup:
+                lookup[key] = len(vocabulary)
+                vocabulary.append(value)
+            codes[index] = lookup[key]
+        vocabularies[name] = vocabulary
+        edge_attributes[name] = codes
+
+    _, geom_coords, (geom_offsets,) = shapely.to_ragged_array(geoms.values)
+
+    arrays = {
+        "node_ids": node_ids,
+        "node_coords": node_coords,
+        "node_streets": node_streets,
+        "edge_ids": edge_ids,
+        "edge_length": edge_length,
+        "geom_coords": geom_coords,
+        "geom_offsets": geom_offsets.astype(np.int64),
+    }
+    arrays.update({f"edge_{name}": codes for name, codes in edge_attributes.items()})
+    for name, array in arrays.items():
+        np.save(os.path.join(folder, f"{name}.npy"), array)
+
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "region": region,
+        "graph": dict(graph.graph),
+        "edge_attributes": attribute_names,
+        "vocabularies": vocabularies,
+    }
+    with open(os.path.join(folder, META_FILE), "w") as file:
+        json.dump(meta, file, default=str)
+
+
+def _swap(folder: str, version: str):
+    """
+    Point the snapshot folder at a new version and remove all but the previous one.
+
+    Must be called with the lock of the folder held.
+
+    :param folder: The absolute snapshot folder
+    :param version: The new version folder, next to the snapshot folder
+    """
+    parent, name = os.path.split(folder)
+    previous = os.readlink(folder) if os.path.islink(folder) else None
+    if previous is None and os.path.isdir(folder):
+        # A snapshot written before snapshots were versioned
+        shutil.rmtree(folder)
+    link = os.path.join(parent, f".{name}.link")
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(version), link)
+    os.replace(link, folder)
+
+    # Versions of crashed writers and older snapshots
+    keep = {os.path.basename(version), previous}
+    for entry in os.listdir(parent):
+        if entry.startswith(f".{name}-") and entry not in keep:
+            shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
+
+
+def load_snapshot(folder: str, region=None) -> (MultiDiGraph, pandas.Series):
+    """
+    Load a graph and its edge geometries from a snapshot folder.
+
+    Edges in the loaded graph don't carry a geometry attribute, the geometries
+    are only returned as the series the rtree is built from.
+
+    :param folder: The snapshot folder
+    :param region: Region key the snapshot has to be made for, not checked if None
+    :return: The graph and the geometry series indexed by u/v/key
+    """
+    # Read every file from the same version, even if it is swapped while loading
+    folder = os.path.realpath(folder)
+    if not snapshot_exists(folder):
+        raise FileNotFoundError(f"No graph snapshot in {folder}")
+    with open(os.path.join(folder, META_FILE)) as file:
+        meta = json.load(file)
+    if meta["version"] != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported graph snapshot version {meta['version']}")
+    if region is not None and meta["region"] != region:
+        raise ValueError(
+            f"Graph snapshot is for region {meta['region']}, expected {region}"
+        )
+
+    def load(name):
+        return np.load(os.path.join(folder, f"{name}.npy"))
+
+    node_ids = load("node_ids")
+    node_coords = load("node_coords")
+    node_streets = load("node_streets")
+    edge_ids = load("edge_ids")
+    edge_length = load("edge_length")
+
+    graph = MultiDiGraph(**meta["graph"])
+    graph.add_nodes_from(
+        (
+            node,
+            dict(
+                zip(NODE_ATTRIBUTES, coords),
+                **({"street_count": streets} if streets >= 0 else {}),
+            ),
+        )
+        for node, coords, streets in zip(
+            node_ids.tolist(), node_coords.tolist(), node_streets.tolist()
+        )
+    )
+
+    attribute_columns = [
+        (name, load(f"edge_{name}").tolist(), meta["vocabularies"][name])
+        for name in meta["edge_attributes"]
+    ]
+
+    def edge_data(index, length):
+        data = {"length": length}
+        for name, codes, vocabulary in attribute_columns:
+            code = codes[index]
+            if code >= 0:
+                data[name] = vocabulary[code]
+        return data
+
+    graph.add_edges_from(
+        (u, v, key, edge_data(index, length))
+        for index, ((u, v, key), length) in enumerate(
+            zip(edge_ids.tolist(), edge_length.tolist())
+        )
+    )
+
+    geometries = shapely.from_ragged_array(
+        shapely.GeometryType.LINESTRING,
+        load("geom_coords"),
+        (load("geom_offsets"),),
+    )
+    geoms = GeoSeries(
+        geometries,
+        crs=meta["graph"].get("crs"),
+        index=pandas.MultiIndex.from_arrays(
+            [edge_ids[:, 0], edge_ids[:, 1], edge_ids[:, 2]], names=["u", "v", "key"]
+        ),
+        name="geometry",
+    )
+    logging.warning(
+        f"Loaded graph snapshot with {len(node_ids)} nodes and {len(edge_ids)} edges"
+    )
+    return graph, geoms
@@ -0,0 +1,362 @@
+"""
+The road network split into square tiles that are loaded when a trace needs them.
+
+Every tile is a graph snapshot in its own folder. An edge is written to every tile
+its geometry overlaps, so the tiles around a point always contain all edges near it.
+The loaded tiles share one graph joined on their node ids, an edge written to several
+tiles is only added once and removed when the last tile holding it is evicted.
+
+Layout:
+    tiles.json          Region key, tile size and the node and edge count of every tile
+    <row>_<col>/        Graph snapshot of the tile, see graph_snapshot
+"""
+import json
+import logging
+import math
+import os
+import shutil
+from collections import OrderedDict
+
+import numpy as np
+import pandas
+import shapely
+from geopandas import GeoSeries
+from networkx import MultiDiGraph
+from shapely import STRtree
+from src.router_service.helpers import custom_nearest_edge as cne
+from src.router_service.helpers import graph_snapshot
+from src.router_service.helpers.edge_table import EdgeTable
+from src.router_service.helpers.helpers import EARTH_RADIUS
+from src.router_service.helpers.metrics import CACHE_REQUESTS
+
+TILES_VERSION = 1
+INDEX_FILE = "tiles.json"
+# Measured as the resident memory of loaded tiles, including the rtree, geometries and
+# edge table composed from them
+BYTES_PER_ELEMENT = 1400
+
+
+def tile_name(row: int, col: int) -> str:
+    """
+    Get the folder name of a tile.
+
+    :param row: The tile row
+    :param col: The tile column
+    :return: The name
+    """
+    return f"{row}_{col}"
+
+
+def tiles_exist(folder: str, region=None) -> bool:
+    """
+    Check if the folder contains tiles of the region.
+
+    :param folder: The tile folder
+    :param region: Region key the tiles have to be made for, not checked if None
+    :return: True if a complete set of tiles was written to the folder
+    """
+    path = os.path.join(folder, INDEX_FILE)
+    if not os.path.isfile(path):
+        return False
+    with open(path) as file:
+        index = json.load(file)
+    return index["version"] == TILES_VERSION and (
+        region is None or index["region"] == region
+    )
+
+
+def write_tiles(
+    graph: MultiDiGraph,
+    geoms: pandas.Series,
+    folder: str,
+    tile_size: float,
+    region=None,
+):
+    """
+    Split a graph into tiles and write them to a folder.
+
+    :param graph: The projected graph
+    :param geoms: Geometry series indexed by u/v/key, as returned by init_rtree
+    :param folder: The tile folder, replaced if it already exists
+    :param tile_size: Size of a tile in degrees
+    :param region: Key of the region the graph was loaded for, checked when loading
+    """
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
+    os.makedirs(folder)
+
+    bounds = shapely.bounds(np.asarray(geoms.values))
+    first = np.floor(bounds[:, 1::-1] / tile_size).astype(np.int64)
+    last = np.floor(bounds[:, 3:1:-1] / tile_size).astype(np.int64)
+    tile_edges = {}
+    for position, ((row0, col0), (row1, col1)) in enumerate(
+        zip(first.tolist(), last.tolist())
+    ):
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                tile_edges.setdefault((row, col), []).append(position)
+
+    tiles = {}
+    for (row, col), positions in sorted(tile_edges.items()):
+        tile_geoms = geoms.iloc[positions]
+        tile_graph = graph.edge_subgraph(tile_geoms.index.tolist())
+        graph_snapshot.save_snapshot(
+            tile_graph,
+            tile_geoms,
+            os.path.join(folder, tile_name(row, col)),
+            region=region,
+        )
+        tiles[tile_name(row, col)] = {
+            "nodes": len(tile_graph),
+            "edges": len(positions),
+        }
+
+    # Written last, a folder without index is never read
+    with open(os.path.join(folder, INDEX_FILE), "w") as file:
+        json.dump(
+            {
+                "version": TILES_VERSION,
+                "region": region,
+                "tile_size": tile_size,
+                "graph": dict(graph.graph),
+                "tiles": tiles,
+            },
+            file,
+            default=str,
+        )
+    logging.warning(f"Wrote {len(tiles)} graph tiles of {tile_size} degrees")
+
+
+class Tile:
+    """
+    The edges of a loaded tile, its graph is part of the graph of the tile store.
+    """
+
+    __slots__ = ("edges", "geoms", "table", "nbytes")
+
+    def __init__(
+        self, edges: list, geoms: pandas.Series, table: EdgeTable, nbytes: int
+    ):
+        """
+        Create the tile.
+
+        :param edges: The (u, v, key) of the edges of the tile
+        :param geoms: Geometry series of the tile indexed by u/v/key
+        :param table: Edge table of the tile, edges in the order of geoms
+        :param nbytes: Estimated memory of the tile
+        """
+        self.edges = edges
+        self.geoms = geoms
+        self.table = table
+        self.nbytes = nbytes
+
+
+class TileStore:
+    """
+    The tiles needed by recent traces, in least recently used order.
+
+    The loaded tiles form one graph that is changed in place when tiles are loaded or
+    evicted, so every edge is held once. Least recently used tiles are evicted while
+    the loaded tiles take more than the memory budget, tiles the current trace needs
+    are never evicted.
+    """
+
+    def __init__(self, folder: str, max_bytes: int, margin: float):
+        """
+        Open the tiles in a folder, no tile is loaded yet.
+
+        :param folder: The tile folder, as written by write_tiles
+        :param max_bytes: Memory budget of the loaded tiles, 0 for no budget
+        :param margin: Meters around every point whose tiles are loaded as well, less
+            than the tile size
+        """
+        with open(os.path.join(folder, INDEX_FILE)) as file:
+            index = json.load(file)
+        self.folder = folder
+        self.tile_size = index["tile_size"]
+        if math.degrees(margin / EARTH_RADIUS) >= self.tile_size:
+            raise ValueError(
+                f"The tile margin of {margin}m is not smaller than the tiles of "
+                f"{self.tile_size} degrees"
+            )
+        self.graph_attributes = index["graph"]
+        self.available = index["tiles"]
+        self.max_bytes = max_bytes
+        self.margin = margin
+        self.graph = MultiDiGraph(**self.graph_attributes)
+        self._tiles = OrderedDict()
+        # Number of loaded tiles holding an edge, for the edges held by more than one
+        self._shared = {}
+        self.nbytes = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def __len__(self):
+        """
+        Get the number of loaded tiles.
+
+        :return: The number of tiles
+        """
+        return len(self._tiles)
+
+    def tiles_for(self, lats: np.ndarray, lons: np.ndarray) -> list:
+        """
+        Get the tiles within the margin of any of the points.
+
+        :param lats: Array of latitudes
+        :param lons: Array of longitudes
+        :return: Sorted list of (row, col) of tiles that exist
+        """
+        if not len(lats):
+            return []
+        lat_margin = math.degrees(self.margin / EARTH_RADIUS)
+        lon_margin = lat_margin / max(
+            math.cos(math.radians(float(np.max(np.abs(lats))))), 0.01
+        )
+        # Offsets at most a tile apart, so they hit every tile within the margin. The
+        # margin in longitude can be larger than a tile far from the equator.
+        lat_offsets = np.linspace(
+            -lat_margin, lat_margin, math.ceil(2 * lat_margin / self.tile_size) + 1
+        )
+        lon_offsets = np.linspace(
+            -lon_margin, lon_margin, math.ceil(2 * lon_margin / self.tile_size) + 1
+        )
+        rows = np.floor((lats[:, None] + lat_offsets) / self.tile_size).astype(np.int64)
+        cols = np.floor((lons[:, None] + lon_offsets) / self.tile_size).astype(np.int64)
+        keys = set(
+            zip(
+                np.repeat(rows, len(lon_offsets), axis=1).ravel().tolist(),
+                np.tile(cols, len(lat_offsets)).ravel().tolist(),
+            )
+        )
+        return sorted(key for key in keys if tile_name(*key) in self.available)
+
+    def require(self, lats: np.ndarray, lons: np.ndarray) -> bool:
+        """
+        Make sure the tiles around the points are loaded.
+
+        When tiles were loaded, the least recently used other tiles are evicted while
+        over the budget.
+
+        :param lats: Array of latitudes
+        :param lons: Array of longitudes
+        :return: True if the loaded tiles changed
+        """
+        needed = self.tiles_for(lats, lons)
+        changed = False
+        for key in needed:
+            if key in self._tiles:
+                CACHE_REQUESTS.inc(cache="tile", result="hit")
+                self._tiles.move_to_end(key)
+            else:
+                CACHE_REQUESTS.inc(cache="tile", result="miss")
+                self._tiles[key] = self.load(key)
+                self.nbytes += self._tiles[key].nbytes
+                changed = True
+        if not changed:
+            return False
+        needed = set(needed)
+        for key in list(self._tiles):
+            if self.max_bytes <= 0 or self.nbytes <= self.max_bytes:
+                break
+            if key not in needed:
+                self.evict(key)
+        if self.max_bytes > 0 and self.nbytes > self.max_bytes:
+            logging.warning(
+                f"The {len(needed)} tiles a trace needs take {self.nbytes} bytes, "
+                f"over the budget of {self.max_bytes}"
+            )
+        return changed
+
+    def load(self, key: tuple) -> Tile:
+        """
+        Load a tile and add its nodes and edges to the graph.
+
+        :param key: The (row, col) of the tile
+        :return: The tile
+        """
+        name = tile_name(*key)
+        graph, geoms = graph_snapshot.load_snapshot(os.path.join(self.folder, name))
+        edge_ids = cne.init_edge_ids(geoms)
+        table = EdgeTable(graph, edge_ids)
+        edges = [tuple(edge) for edge in edge_ids.tolist()]
+        self.graph.add_nodes_from(graph.nodes(data=True))
+        new_edges = []
+        for u, v, key_, data in graph.edges(keys=True, data=True):
+            if self.graph.has_edge(u, v, key_):
+                self._shared[(u, v, key_)] = self._shared.get((u, v, key_), 1) + 1
+            else:
+                new_edges.append((u, v, key_, data))
+        self.graph.add_edges_from(new_edges)
+        self.loads += 1
+        counts = self.available[name]
+        return Tile(
+            edges, geoms, table, (counts["nodes"] + counts["edges"]) * BYTES_PER_ELEMENT
+        )
+
+    def evict(self, key: tuple):
+        """
+        Evict a tile, removing the edges no other loaded tile holds from the graph.
+
+        :param key: The (row, col) of the tile
+        """
+        tile = self._tiles.pop(key)
+        removed = []
+        for edge in tile.edges:
+            holders = self._shared.get(edge)
+            if holders is None:
+                removed.append(edge)
+            elif holders > 2:
+                self._shared[edge] = holders - 1
+            else:
+                del self._shared[edge]
+        self.graph.remove_edges_from(removed)
+        nodes = {node for u, v, _ in removed for node in (u, v)}
+        self.graph.remove_nodes_from(
+            [node for node in nodes if not self.graph.degree(node)]
+        )
+        self.nbytes -= tile.nbytes
+        self.evictions += 1
+
+    def compose(self) -> (MultiDiGraph, pandas.Series, STRtree, EdgeTable):
+        """
+        Get the graph of the loaded tiles with its spatial index and edge table.
+
+        The graph is the graph of the store, the geometries and edge table are joined
+        from the tiles, and only the rtree is built over all edges.
+
+        :return: The graph, its edge geometries, the rtree over those geometries and
+            the edge table
+        """
+        if not self._tiles:
+            geoms = GeoSeries(
+                [],
+                crs=self.graph_attributes.get("crs"),
+                index=pandas.MultiIndex.from_arrays(
+                    [[], [], []], names=["u", "v", "key"]
+                ),
+                name="geometry",
+            )
+            table = EdgeTable(self.graph, cne.init_edge_ids(geoms))
+            return self.graph, geoms, STRtree(geoms), table
+        tiles = list(self._tiles.values())
+        geoms = pandas.concat([tile.geoms for tile in tiles])
+        keep = ~geoms.index.duplicated()
+        geoms = geoms[keep]
+        table = EdgeTable.concat([tile.table for tile in tiles], keep)
+        return self.graph, geoms, STRtree(geoms), table
+
+    def stats(self) -> dict:
+        """
+        Get the counters and current size.
+
+        :return: Dict with tiles, available, bytes, max_bytes, loads and evictions
+        """
+        return {
+            "tiles": len(self._tiles),
+            "available": len(self.available),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
@@ -1,8 +1,39 @@
 """
 Contains helper functions for the router service.
 """
+import numpy as np
 
-from src.router_service.models.route_models import Route
+
+EARTH_RADIUS = 6371009  # meters
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Get the great circle distance in meters between (arrays of) points.
+
+    :param lat1: Latitude of the first point
+    :param lon1: Longitude of the first point
+    :param lat2: Latitude of the second point
+    :param lon2: Longitude of the second point
+    :return: Distance in meters
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def road(edge: tuple) -> tuple:
+    """
+    Get the road of an edge, the same for both directions of a two-way road.
+
+    :param edge: The (u, v) or (u, v, key) of the edge
+    :return: The (u, v) with the smallest node first
+    """
+    u, v = edge[0], edge[1]
+    return (u, v) if u <= v else (v, u)
 
 
 def remove_duplicates(seq):
@@ -32,18 +63,3 @@ def get_first_occurrence_indexes(seq):
             indexes.append(index)
             seen_add(x)
     return indexes
-
-
-def remove_way_id_lists(route: Route):
-    """
-    Remove the list of osmid's from the way object in each segment.
-
-    This is done because the way object as agreed with other teams has a single way id.
-
-    :param route: The route with segments that way id list have to be removed from.
-    :return: The route with the lists replaced with their first element.
-    """
-    for seg in route.segments:
-        if type(seg.way.osmid) is list:
-            seg.way.osmid = seg.way.osmid[0]
-    return route
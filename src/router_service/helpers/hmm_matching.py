@@ -0,0 +1,259 @@
+"""
+Hidden Markov map matching.
+
+Every GPS point gets up to k candidate edges within a search radius. The emission
+cost of a candidate is based on its distance to the point, the transition cost
+between candidates of consecutive points on how much the network distance differs
+from the great circle distance between the points (Newson & Krumm, 2009). The
+cheapest sequence of candidates is decoded with Viterbi.
+
+Network distances are only searched up to a cutoff based on the distance between
+the points, so the work per point is bounded by k bounded Dijkstra searches. Parts of
+the chain that aren't connected within that cutoff are joined by a search bounded by
+bridge_cutoff, points that can't be reached within it are skipped.
+"""
+import logging
+import math
+
+import networkx
+import numpy as np
+import shapely
+from networkx import MultiDiGraph
+from shapely import STRtree
+from src.router_service.helpers.helpers import haversine
+from src.router_service.helpers.path_search import bounded_shortest_paths
+
+METERS_PER_DEGREE = 111_320
+# Allowed backwards movement along the same edge, as a fraction of its length,
+# before it is treated as driving around the block.
+SAME_EDGE_TOLERANCE = 0.05
+
+
+def find_candidates(
+    geometries: np.ndarray,
+    rtree: STRtree,
+    lats: np.ndarray,
+    lons: np.ndarray,
+    k: int,
+    radius: float,
+) -> list[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Find up to k candidate edges for every point.
+
+    Points without any edge in the radius get their nearest edge as only candidate.
+
+    :param geometries: Edge geometries in rtree order
+    :param rtree: The rtree over the geometries
+    :param lats: Array of latitudes
+    :param lons: Array of longitudes
+    :param k: Maximum number of candidates per point
+    :param radius: Search radius in meters
+    :return: Per point the rtree positions, fractions along the edge and distances in
+        meters
+    """
+    points = shapely.points(lons, lats)
+    # Longitude degrees are the shortest, so this radius covers at least the meters
+    degrees = radius / (
+        METERS_PER_DEGREE * math.cos(math.radians(np.max(np.abs(lats))))
+    )
+    point_index, edge_index = rtree.query(points, predicate="dwithin", distance=degrees)
+
+    missing = np.setdiff1d(np.arange(len(points)), point_index)
+    if len(missing):
+        nearest = rtree.query_nearest(points[missing], all_matches=False)
+        point_index = np.concatenate([point_index, missing[nearest[0]]])
+        edge_index = np.concatenate([edge_index, nearest[1]])
+
+    edge_geometries = geometries[edge_index]
+    fractions = shapely.line_locate_point(
+        edge_geometries, points[point_index], normalized=True
+    )
+    snapped = shapely.line_interpolate_point(
+        edge_geometries, fractions, normalized=True
+    )
+    distances = haversine(
+        lats[point_index],
+        lons[point_index],
+        shapely.get_y(snapped),
+        shapely.get_x(snapped),
+    )
+
+    # Sort by point, then distance, and keep the first k of every point
+    order = np.lexsort((distances, point_index))
+    point_index = point_index[order]
+    group_starts = np.flatnonzero(np.diff(point_index, prepend=-1))
+    group_sizes = np.diff(np.append(group_starts, len(point_index)))
+    rank = np.arange(len(point_index)) - np.repeat(group_starts, group_sizes)
+    keep = order[rank < k]
+    splits = np.flatnonzero(np.diff(point_index[rank < k])) + 1
+    return list(
+        zip(
+            np.split(edge_index[keep], splits),
+            np.split(fractions[keep], splits),
+            np.split(distances[keep], splits),
+        )
+    )
+
+
+class _PathSearch:
+    """
+    Bounded shortest path searches on the graph, cached per source node for one trace.
+    """
+
+    def __init__(self, graph: MultiDiGraph):
+        self.graph = graph
+        self.searches = {}
+
+    def search(self, source, cutoff: float) -> (dict, dict):
+        """
+        Get the distances and paths from the source to all nodes within the cutoff.
+
+        :param source: The source node
+        :param cutoff: Maximum distance in meters
+        :return: Dicts with the distance and path to every reached node
+        """
+        cached = self.searches.get(source)
+        if cached is None or cached[0] < cutoff:
+            distances, paths = networkx.single_source_dijkstra(
+                self.graph, source, cutoff=cutoff, weight="length"
+            )
+            cached = (cutoff, distances, paths)
+            self.searches[source] = cached
+        return cached[1], cached[2]
+
+
+def match(
+    graph: MultiDiGraph,
+    geometries: np.ndarray,
+    rtree: STRtree,
+    edge_ids: np.ndarray,
+    lats: np.ndarray,
+    lons: np.ndarray,
+    k: int = 5,
+    radius: float = 50.0,
+    sigma: float = 10.0,
+    beta: float = 5.0,
+    bridge_cutoff: float = 2000.0,
+) -> (list, list):
+    """
+    Match the points to a path on the graph.
+
+    If no candidates of two consecutive points are connected within the search cutoff,
+    the chain is restarted and both parts are joined by a path of at most bridge_cutoff
+    meters. Points whose matched edge can't be reached within it are left out of the
+    route, like GAP_FILL_MODE "bridge" does.
+
+    :param graph: The graph to match on
+    :param geometries: Edge geometries in rtree order
+    :param rtree: The rtree over the geometries
+    :param edge_ids: Edge ids in rtree order, as returned by init_edge_ids
+    :param lats: Array of latitudes
+    :param lons: Array of longitudes
+    :param k: Maximum number of candidates per point
+    :param radius: Candidate search radius in meters
+    :param sigma: Standard deviation of the GPS noise in meters
+    :param beta: Scale of the transition cost in meters
+    :param bridge_cutoff: Maximum length in meters of a path joining two chains
+    :return: The matched (u, v, key) edge of every point and the ordered route nodes
+    """
+    candidates = find_candidates(geometries, rtree, lats, lons, k, radius)
+    step_distances = haversine(lats[:-1], lons[:-1], lats[1:], lons[1:])
+    edge_lengths = {}
+    path_search = _PathSearch(graph)
+
+    def edge_length(position):
+        if position not in edge_lengths:
+            u, v, key = edge_ids[position].tolist()
+            edge_lengths[position] = graph.edges[u, v, key]["length"]
+        return edge_lengths[position]
+
+    def emission(distances):
+        return 0.5 * (distances / sigma) ** 2
+
+    def network_distance(edge_from, fraction_from, edge_to, fraction_to, cutoff):
+        if edge_from == edge_to and fraction_to >= fraction_from - SAME_EDGE_TOLERANCE:
+            return max(0.0, fraction_to - fraction_from) * edge_length(edge_from)
+        remaining = (1 - fraction_from) * edge_length(edge_from)
+        distances, _ = path_search.search(int(edge_ids[edge_from][1]), cutoff)
+        between = distances.get(int(edge_ids[edge_to][0]))
+        if between is None:
+            return math.inf
+        return remaining + between + fraction_to * edge_length(edge_to)
+
+    # Viterbi, back_pointers[t][j] is the best previous candidate of candidate j at t
+    costs = emission(candidates[0][2])
+    back_pointers = [None]
+    chain_ends = {}
+    for step in range(1, len(candidates)):
+        previous_edges, previous_fractions, _ = candidates[step - 1]
+        edges, fractions, distances = candidates[step]
+        cutoff = 2 * step_distances[step - 1] + 2 * radius + 50
+        transitions = np.full((len(previous_edges), len(edges)), math.inf)
+        for i, (edge_from, fraction_from) in enumerate(
+            zip(previous_edges.tolist(), previous_fractions.tolist())
+        ):
+            if not math.isfinite(costs[i]):
+                continue
+            for j, (edge_to, fraction_to) in enumerate(
+                zip(edges.tolist(), fractions.tolist())
+            ):
+                route_distance = network_distance(
+                    edge_from, fraction_from, edge_to, fraction_to, cutoff
+                )
+                transitions[i, j] = (
+                    abs(route_distance - step_distances[step - 1]) / beta
+                )
+        totals = costs[:, None] + transitions
+        best = np.argmin(totals, axis=0)
+        new_costs = totals[best, np.arange(len(edges))]
+        if not np.isfinite(new_costs).any():
+            logging.warning(f"HMM chain broken at point {step}, restarting")
+            chain_ends[step] = int(np.argmin(costs))
+            costs = emission(distances)
+            back_pointers.append(None)
+            continue
+        costs = new_costs + emission(distances)
+        back_pointers.append(best)
+
+    # Backtrack from the cheapest final candidate, restarting at every chain break
+    states = [0] * len(candidates)
+    state = int(np.argmin(costs))
+    for step in range(len(candidates) - 1, -1, -1):
+        states[step] = state
+        if back_pointers[step] is None:
+            state = chain_ends.get(step, 0)
+        else:
+            state = int(back_pointers[step][state])
+
+    matched = [
+        (int(candidates[step][0][state]), float(candidates[step][1][state]))
+        for step, state in enumerate(states)
+    ]
+    matched_edges = [tuple(edge_ids[position].tolist()) for position, _ in matched]
+
+    # Stitch the matched edges together into a route
+    route = list(matched_edges[0][:2])
+    edge_from, fraction_from = matched[0]
+    skipped = 0
+    for edge_to, fraction_to in matched[1:]:
+        if edge_from == edge_to and fraction_to >= fraction_from - SAME_EDGE_TOLERANCE:
+            fraction_from = fraction_to
+            continue
+        source = int(edge_ids[edge_from][1])
+        target = int(edge_ids[edge_to][0])
+        # Searched while decoding, unless the chain was broken here
+        _, paths = path_search.search(source, 0)
+        path = paths.get(target)
+        if path is None:
+            bridged = bounded_shortest_paths(graph, source, [target], bridge_cutoff)
+            if target not in bridged:
+                skipped += 1
+                continue
+            path = bridged[target][1]
+        route += path[1:] + [int(edge_ids[edge_to][1])]
+        edge_from, fraction_from = edge_to, fraction_to
+    if skipped:
+        logging.warning(
+            f"Skipped {skipped} points that were not reachable within {bridge_cutoff}m"
+        )
+    return matched_edges, route
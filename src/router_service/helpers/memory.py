@@ -0,0 +1,75 @@
+"""
+Garbage collector settings for a process holding a large, long-lived graph.
+"""
+import gc
+import logging
+import os
+
+import psutil
+
+
+def configure_gc(thresholds: str = None):
+    """
+    Set the collection thresholds of the generations.
+
+    :param thresholds: Comma separated thresholds, GC_THRESHOLDS if not given, keeps
+        the interpreter defaults if neither is set
+    """
+    thresholds = thresholds or os.environ.get("GC_THRESHOLDS")
+    if thresholds:
+        gc.set_threshold(*(int(value) for value in thresholds.split(",")))
+    logging.info(f"Garbage collection thresholds: {gc.get_threshold()}")
+
+
+def freeze_heap():
+    """
+    Move every object alive now into the permanent generation.
+
+    Call after loading the graph: later collections, including full ones, then skip
+    the graph, edge table and rtree objects instead of scanning them every time.
+    Objects frozen before are unfrozen first, so a replaced graph can be collected.
+    """
+    gc.unfreeze()
+    gc.collect()
+    gc.freeze()
+    logging.warning(f"Froze {gc.get_freeze_count()} objects after loading the graph")
+
+
+def freeze_new():
+    """
+    Move the objects created since the last freeze into the permanent generation.
+
+    Call after loading more of the graph while serving. Unlike freeze_heap it doesn't
+    collect first, so it takes no time, objects that are garbage already stay until
+    they are freed by reference counting.
+    """
+    gc.freeze()
+
+
+def unfreeze():
+    """
+    Move the frozen objects back into the oldest generation.
+
+    Call after dropping a frozen graph, so the collector frees the parts of it that
+    reference counting can't. The next freeze_new or freeze_heap freezes what is
+    still alive again.
+    """
+    gc.unfreeze()
+
+
+def process_memory(pid: int = None) -> dict:
+    """
+    Get the memory of a process, split in what it shares and what only it uses.
+
+    Pages a forked child still shares with its parent count in rss but not in uss.
+
+    :param pid: The process id, the current process if not given
+    :return: Dict with rss, uss, pss and shared in bytes, pss is 0 if unavailable
+    """
+    info = psutil.Process(pid).memory_full_info()
+    return {
+        "rss": info.rss,
+        "uss": info.uss,
+        "pss": getattr(info, "pss", 0),
+        "shared": info.rss - info.uss,
+    }
@@ -0,0 +1,432 @@
+"""
+Counters and histograms served in the Prometheus text format.
+
+Worker processes drain their metrics after every message and the receiving process
+merges them, so one endpoint shows the metrics of all workers.
+"""
+import bisect
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds, from fast array stages up to slow path searches on long traces
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+# Number of points or edges
+SIZE_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000)
+# Number of messages
+BATCH_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+def _format_labels(labels: tuple, extra: str = "") -> str:
+    """
+    Format label pairs.
+
+    :param labels: Tuple of (name, value) pairs
+    :param extra: Already formatted label to add
+    :return: The labels in braces, or "" without labels
+    """
+    pairs = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """
+    Format a sample value.
+
+    :param value: The value
+    :return: The value as text
+    """
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """
+    Counter that only goes up, per combination of label values.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), lock=None):
+        """
+        Create the counter.
+
+        :param name: The metric name
+        :param documentation: The help text
+        :param labelnames: Names of the labels
+        :param lock: Lock shared with the registry
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = lock or threading.RLock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def inc(self, amount: float = 1, **labels):
+        """
+        Increase the counter.
+
+        :param amount: The amount to add
+        :param labels: The label values
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """
+        Get the current value.
+
+        :param labels: The label values
+        :return: The value
+        """
+        key = self._key(labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def drain(self) -> dict:
+        """
+        Take the values and reset them.
+
+        :return: Dict of labels to value
+        """
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values: dict):
+        """
+        Add values taken from another counter.
+
+        :param values: Dict of labels to value
+        """
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+    def render(self) -> list:
+        """
+        Get the samples in the text format.
+
+        :return: List of lines
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram(Counter):
+    """
+    Histogram with fixed buckets, per combination of label values.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames=(),
+        buckets=DEFAULT_BUCKETS,
+        lock=None,
+    ):
+        """
+        Create the histogram.
+
+        :param name: The metric name
+        :param documentation: The help text
+        :param labelnames: Names of the labels
+        :param buckets: Sorted upper bounds of the buckets, +Inf is added
+        :param lock: Lock shared with the registry
+        """
+        super().__init__(name, documentation, labelnames, lock)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        """
+        Record an observation.
+
+        :param value: The observed value
+        :param labels: The label values
+        """
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Counts per bucket (last one is +Inf), then the sum
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[position] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the seconds the block takes.
+
+        :param labels: The label values
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        """
+        Get the number of observations.
+
+        :param labels: The label values
+        :return: The count
+        """
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            return sum(state[:-1]) if state else 0
+
+    def merge(self, values: dict):
+        """
+        Add observations taken from another histogram.
+
+        :param values: Dict of labels to bucket counts and sum
+        """
+        with self._lock:
+            for key, other in values.items():
+                state = self._values.get(key)
+                if state is None:
+                    self._values[key] = list(other)
+                else:
+                    self._values[key] = [a + b for a, b in zip(state, other)]
+
+    def render(self) -> list:
+        """
+        Get the samples in the text format, with cumulative buckets.
+
+        :return: List of lines
+        """
+        with self._lock:
+            # Observations change the states in place, copy them
+            values = [(key, list(state)) for key, state in sorted(self._values.items())]
+        lines = []
+        for key, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), state[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(key, le)} {cumulative}"
+                )
+            lines.append(
+                f"{self.name}_sum{_format_labels(key)} {_format_value(state[-1])}"
+            )
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    Collection of metrics.
+    """
+
+    def __init__(self):
+        """
+        Create an empty registry.
+        """
+        self._lock = threading.RLock()
+        self._metrics = {}
+
+    def reset_lock(self):
+        """
+        Replace the lock, after a fork it may be held by a thread that is gone.
+        """
+        self._lock = threading.RLock()
+        for metric in self._metrics.values():
+            metric._lock = self._lock
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(
+                    name, *args, lock=self._lock, **kwargs
+                )
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        """
+        Get or create a counter.
+
+        :param name: The metric name
+        :param documentation: The help text
+        :param labelnames: Names of the labels
+        :return: The counter
+        """
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def histogram(
+        self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        """
+        Get or create a histogram.
+
+        :param name: The metric name
+        :param documentation: The help text
+        :param labelnames: Names of the labels
+        :param buckets: Sorted upper bounds of the buckets
+        :return: The histogram
+        """
+        return self._get_or_create(
+            Histogram, name, documentation, labelnames, buckets=buckets
+        )
+
+    def drain(self) -> dict:
+        """
+        Take the values of all metrics and reset them, to send them to another process.
+
+        :return: Dict of metric name to its values
+        """
+        with self._lock:
+            return {name: metric.drain() for name, metric in self._metrics.items()}
+
+    def merge(self, drained: dict):
+        """
+        Add values drained from a registry with the same metrics.
+
+        :param drained: Dict of metric name to its values
+        """
+        with self._lock:
+            for name, values in drained.items():
+                metric = self._metrics.get(name)
+                if metric is not None:
+                    metric.merge(values)
+
+    def render(self) -> str:
+        """
+        Get all metrics in the Prometheus text format.
+
+        :return: The text
+        """
+        lines = []
+        with self._lock:
+            for name, metric in sorted(self._metrics.items()):
+                lines.append(f"# HELP {name} {metric.documentation}")
+                lines.append(f"# TYPE {name} {metric.kind}")
+                lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+os.register_at_fork(after_in_child=REGISTRY.reset_lock)
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "router_stage_seconds", "Seconds spent per pipeline stage.", ("stage",)
+)
+TRACE_POINTS = REGISTRY.histogram(
+    "router_trace_points", "Number of points in a received trace.", buckets=SIZE_BUCKETS
+)
+KEPT_POINTS = REGISTRY.histogram(
+    "router_kept_points",
+    "Number of points of a trace left after thinning.",
+    buckets=SIZE_BUCKETS,
+)
+ROUTE_EDGES = REGISTRY.histogram(
+    "router_route_edges", "Number of edges in a matched route.", buckets=SIZE_BUCKETS
+)
+GAP_FILL_GENERATIONS = REGISTRY.counter(
+    "router_gap_fill_generations_total",
+    "Extra edge generations needed to find a path.",
+)
+GAP_BRIDGES = REGISTRY.counter(
+    "router_gap_bridges_total", "Gaps between matched edges bridged with a search."
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "router_cache_requests_total",
+    "Cache lookups by cache and result.",
+    ("cache", "result"),
+)
+SESSIONS_EVICTED = REGISTRY.counter(
+    "router_sessions_evicted_total", "Evicted match sessions by reason.", ("reason",)
+)
+REGION_LOADS = REGISTRY.counter(
+    "router_region_loads_total", "Loaded region graphs by region.", ("region",)
+)
+REGIONS_UNLOADED = REGISTRY.counter(
+    "router_regions_unloaded_total",
+    "Idle region graphs unloaded by region.",
+    ("region",),
+)
+BATCH_MESSAGES = REGISTRY.histogram(
+    "router_batch_messages",
+    "Number of messages in a handled batch.",
+    buckets=BATCH_BUCKETS,
+)
+MESSAGES = REGISTRY.counter(
+    "router_messages_total", "Consumed messages by result.", ("result",)
+)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serves the registry on every GET.
+    """
+
+    def do_GET(self):
+        """
+        Send the metrics.
+        """
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """
+        Don't log every scrape.
+        """
+
+
+def start_server(port: int, registry: Registry = REGISTRY, host: str = "0.0.0.0"):
+    """
+    Serve the metrics over HTTP on a daemon thread.
+
+    :param port: The port, 0 picks a free one
+    :param registry: The registry to serve
+    :param host: The address to listen on
+    :return: The server, its server_address has the port
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.warning(f"Serving metrics on port {server.server_address[1]}...")
+    return server
@@ -0,0 +1,57 @@
+"""
+Bounded path searches on the road graph.
+"""
+import math
+from heapq import heappop, heappush
+from itertools import count
+
+from networkx import MultiDiGraph
+
+
+def bounded_shortest_paths(
+    graph: MultiDiGraph, source, targets, cutoff: float, weight: str = "length"
+) -> dict:
+    """
+    Find the shortest paths from the source to the targets up to a maximum distance.
+
+    The search stops as soon as every target is reached, so nearby targets are cheap
+    even on a country sized graph. Parallel edges use the lowest weight.
+
+    :param graph: The graph to search
+    :param source: The source node
+    :param targets: The nodes to find paths to
+    :param cutoff: Maximum path length
+    :param weight: Edge attribute to use as weight
+    :return: Dict of (distance, node path) for every target reached within the cutoff
+    """
+    remaining = set(targets)
+    distances = {source: 0.0}
+    predecessors = {source: None}
+    settled = set()
+    tie_breaker = count()
+    heap = [(0.0, next(tie_breaker), source)]
+    succ = graph.succ
+    while heap and remaining:
+        distance, _, node = heappop(heap)
+        if node in settled:
+            continue
+        settled.add(node)
+        remaining.discard(node)
+        if not remaining:
+            break
+        for neighbour, edges in succ[node].items():
+            length = distance + min(data.get(weight, 1) for data in edges.values())
+            if length <= cutoff and length < distances.get(neighbour, math.inf):
+                distances[neighbour] = length
+                predecessors[neighbour] = node
+                heappush(heap, (length, next(tie_breaker), neighbour))
+
+    paths = {}
+    for target in targets:
+        if target not in settled:
+            continue
+        path = [target]
+        while predecessors[path[-1]] is not None:
+            path.append(predecessors[path[-1]])
+        paths[target] = (distances[target], path[::-1])
+    return paths
@@ -1,6 +1,9 @@
 """
 Price helpers.
 """
+import hashlib
+
+import numpy as np
 
 
 def to_int_percent(value: float):
@@ -38,3 +41,34 @@ def get_price_mod_for(item, lookup, default=0):
         item = [item]
     types = [lookup.get(item, default) for item in item]
     return sum(types) / len(types)
+
+
+def round_prices(values: np.ndarray, digits: int = 2) -> np.ndarray:
+    """
+    Round an array of values exactly like the builtin round.
+
+    np.round scales, rounds and scales back, which can differ from round for values
+    that are within floating point error of a tie. Those few are rounded with round.
+
+    :param values: Float array
+    :param digits: Number of decimals
+    :return: The rounded array
+    """
+    rounded = np.round(values, digits)
+    scaled = values * 10**digits
+    ambiguous = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if ambiguous.any():
+        rounded[ambiguous] = [
+            round(value, digits) for value in values[ambiguous].tolist()
+        ]
+    return rounded
+
+
+def price_model_version(price_model) -> str:
+    """
+    Get a version that changes when any modifier of the price model changes.
+
+    :param price_model: The price model
+    :return: Short hash of the modifiers
+    """
+    return hashlib.sha256(price_model.json().encode()).hexdigest()[:12]
@@ -0,0 +1,194 @@
+"""
+Opt-in profiling of sampled and slow messages, dumped to a folder with rotation.
+"""
+import cProfile
+import itertools
+import json
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+
+# Number of functions and allocation sites in the summary
+TOP = 25
+
+
+class Profiler:
+    """
+    Runs one in every sample_rate messages under cProfile and tracemalloc.
+
+    Messages that are not sampled but take longer than threshold seconds are handled
+    again under the profiler, the result of that second run is discarded. Every
+    profiled message is written as a .prof file with a .json file holding the payload
+    and a timing summary. The oldest dumps are removed when the folder grows over
+    max_bytes.
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        sample_rate: int = 0,
+        threshold: float = 0,
+        max_bytes: int = 100 * 1024 * 1024,
+    ):
+        """
+        Create the profiler.
+
+        :param folder: Folder to write the dumps to
+        :param sample_rate: Profile one in every sample_rate messages, 0 disables it
+        :param threshold: Profile messages slower than this in seconds, 0 disables it
+        :param max_bytes: Maximum total size of the dumps
+        """
+        self.folder = folder
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self._counter = itertools.count(1)
+        os.makedirs(folder, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create the profiler configured with the PROFILE_* environment variables.
+
+        :return: The profiler, or None if profiling is disabled
+        """
+        folder = os.environ.get("PROFILE_FOLDER")
+        sample_rate = int(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+        threshold = float(os.environ.get("PROFILE_THRESHOLD", 0))
+        if not folder or (sample_rate <= 0 and threshold <= 0):
+            return None
+        return cls(
+            folder,
+            sample_rate=sample_rate,
+            threshold=threshold,
+            max_bytes=int(os.environ.get("PROFILE_MAX_BYTES", 100 * 1024 * 1024)),
+        )
+
+    def run(self, handler_func, message):
+        """
+        Handle a message, profiling it if it is sampled or slow.
+
+        :param handler_func: The message handler
+        :param message: The decoded message
+        :return: The handler result
+        """
+        number = next(self._counter)
+        if self.sample_rate > 0 and number % self.sample_rate == 0:
+            return self._profile(handler_func, message, number, "sample", None)
+        start = time.perf_counter()
+        result = handler_func(message)
+        seconds = time.perf_counter() - start
+        if 0 < self.threshold < seconds:
+            try:
+                self._profile(handler_func, message, number, "slow", seconds)
+            except Exception as e:
+                logging.warning(f"Profiling slow message failed: {str(e)}")
+        return result
+
+    def _profile(self, handler_func, message, number: int, reason: str, seconds):
+        """
+        Handle a message under cProfile and tracemalloc and dump the results.
+
+        :param handler_func: The message handler
+        :param message: The decoded message
+        :param number: Sequence number of the message
+        :param reason: Why the message is profiled, "sample" or "slow"
+        :param seconds: Seconds the unprofiled run took, if there was one
+        :return: The handler result
+        """
+        profile = cProfile.Profile()
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        error = None
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            return handler_func(message)
+        except Exception as e:
+            error = str(e)
+            raise e
+        finally:
+            profile.disable()
+            profiled_seconds = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            allocations = tracemalloc.take_snapshot().statistics("lineno")[:TOP]
+            if not tracing:
+                tracemalloc.stop()
+            summary = {
+                "reason": reason,
+                "seconds": seconds,
+                "profiled_seconds": profiled_seconds,
+                "error": error,
+                "peak_memory_bytes": peak,
+                "top_allocations": [
+                    {
+                        "line": str(stat.traceback),
+                        "bytes": stat.size,
+                        "count": stat.count,
+                    }
+                    for stat in allocations
+                ],
+                "top_functions": top_functions(profile),
+                "payload": message,
+            }
+            self.dump(profile, summary, number)
+
+    def dump(self, profile: cProfile.Profile, summary: dict, number: int):
+        """
+        Write a profile and its summary, then rotate the folder.
+
+        :param profile: The profile
+        :param summary: The summary
+        :param number: Sequence number of the message
+        """
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{number}"
+        path = os.path.join(self.folder, name)
+        try:
+            profile.dump_stats(path + ".prof")
+            with open(path + ".json", "w") as file:
+                json.dump(summary, file, default=str)
+            logging.warning(f"Profiled {summary['reason']} message to {path}")
+            self.rotate()
+        except OSError as e:
+            logging.warning(f"Writing profile failed: {str(e)}")
+
+    def rotate(self):
+        """
+        Remove the oldest dumps until the folder is at most max_bytes.
+        """
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and entry.name.endswith((".prof", ".json")):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, _, size, _ in entries)
+        for _, _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+
+def top_functions(profile: cProfile.Profile) -> list:
+    """
+    Get the functions with the most cumulative time.
+
+    :param profile: The profile
+    :return: List of dicts with the function, calls, own time and cumulative time
+    """
+    stats = pstats.Stats(profile).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP]
+    return [
+        {
+            "function": f"{file}:{line}({function})",
+            "calls": calls,
+            "total_seconds": total,
+            "cumulative_seconds": cumulative,
+        }
+        for (file, line, function), (_, calls, total, cumulative, _) in rows
+    ]
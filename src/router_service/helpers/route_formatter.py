@@ -1,52 +1,51 @@
 """
-Contains the RouteFormatter for formatting routes into a Route model.
+Contains the RouteFormatter for formatting routes into a CompactRoute.
 """
-import uuid
-
-import pandas
-from src.router_service.helpers.time import get_halfway_time
-from src.router_service.models.route_models import Node, Route, Segment, Way
+import numpy as np
+from src.router_service.helpers.edge_table import EdgeTable
+from src.router_service.helpers.time import get_halfway_times
+from src.router_service.models.compact_route import CompactRoute
 
 
 def generate_formatted_route(
     route: list,
-    route_edges: pandas.DataFrame,
-    route_nodes: pandas.DataFrame,
-    indexed_edge_timestamps: dict[int : tuple[str, str]],
-) -> Route:
+    edge_table: EdgeTable,
+    route_edges: np.ndarray,
+    start_times: np.ndarray,
+    end_times: np.ndarray,
+    segment_count: int = None,
+) -> CompactRoute:
     """
-    Generate a route using the Route model as specified in the route_models.
+    Generate a compact route with the segments as specified in the route_models.
 
     :param route: List of ordered nodes in the route.
-    :param route_edges: Dataframe containing the edges of the route in order.
-    :param route_nodes: Dataframe containing the nodes of the route.
-    :param indexed_edge_timestamps: Timestamps with same index as the edge they belong to.
-    :return: The route as a Route model.
+    :param edge_table: Edge attributes and node coordinates of the graph.
+    :param route_edges: Positions of the route edges in the edge table, in order.
+    :param start_times: datetime64 array with the start time of every route edge.
+    :param end_times: datetime64 array with the end time of every route edge.
+    :param segment_count: Number of route edges to include, all but the last if not given.
+    :return: The route as a CompactRoute.
 
     """
-    out = Route(route_id=uuid.uuid4())
-    for index, node in enumerate(route[:-2]):
-        next_node = route[index + 1]
-        start_data = route_nodes.loc[node, ["lon", "lat"]].to_dict()
-        end_data = route_nodes.loc[next_node, ["lon", "lat"]].to_dict()
-        way_data = route_edges.iloc[index].fillna("").to_dict()
-        start, end = indexed_edge_timestamps[index]
-
-        out.add_segment(
-            Segment(
-                start=Node(
-                    id=str(node), lon=start_data["lon"], lat=start_data["lat"], time=start
-                ),
-                way=Way(
-                    id=str(way_data["osmid"]),
-                    name=way_data["name"],
-                    highway=way_data["highway"],
-                    length=way_data["length"] / 1000,
-                ),
-                end=Node(
-                    id=str(next_node), lon=end_data["lon"], lat=end_data["lat"], time=end
-                ),
-                time=get_halfway_time(start, end),
-            )
-        )
-    return out
+    if segment_count is None:
+        # The last edge of the route isn't included
+        segment_count = max(len(route) - 2, 0)
+    nodes = route[: segment_count + 1] if segment_count else []
+    node_positions = np.fromiter(
+        (edge_table.node_index[node] for node in nodes), dtype=np.int64, count=len(nodes)
+    )
+    edges = route_edges[:segment_count]
+    return CompactRoute(
+        node_ids=[str(node) for node in nodes],
+        node_lats=edge_table.node_lat[node_positions],
+        node_lons=edge_table.node_lon[node_positions],
+        way_ids=[str(osmid) for osmid in edge_table.osmid[edges]],
+        way_names=edge_table.name[edges],
+        highways=edge_table.highway[edges],
+        lengths=edge_table.length[edges] / 1000,
+        start_times=start_times[:segment_count],
+        end_times=end_times[:segment_count],
+        times=get_halfway_times(
+            start_times[:segment_count], end_times[:segment_count]
+        ),
+    )
@@ -0,0 +1,216 @@
+"""
+Thinning of GPS traces before they are matched.
+"""
+import numpy as np
+from src.router_service.helpers.helpers import EARTH_RADIUS, road
+
+
+def project(lats: np.ndarray, lons: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Project coordinates to meters around their first point, precise enough for a trace.
+
+    :param lats: Array of latitudes
+    :param lons: Array of longitudes
+    :return: The x and y of every point in meters
+    """
+    scale = np.radians(1) * EARTH_RADIUS
+    x = (lons - lons[0]) * scale * np.cos(np.radians(lats[0]))
+    y = (lats - lats[0]) * scale
+    return x, y
+
+
+def edge_run_bounds(coordinate_edges: list, directed: bool = True) -> np.ndarray:
+    """
+    Find the first and last point of every run of points on the same edge.
+
+    These points carry all the timestamps the route is timed with, the points in
+    between only repeat their edge.
+
+    :param coordinate_edges: The nearest edge of every point
+    :param directed: False takes both directions of a road as the same edge, snapping
+        picks either one since they share their geometry
+    :return: Boolean mask of the points to keep
+    """
+    keep = np.zeros(len(coordinate_edges), dtype=bool)
+    if not coordinate_edges:
+        return keep
+    if not directed:
+        coordinate_edges = [road(edge) for edge in coordinate_edges]
+    changes = np.array(
+        [
+            index
+            for index in range(1, len(coordinate_edges))
+            if coordinate_edges[index] != coordinate_edges[index - 1]
+        ],
+        dtype=np.intp,
+    )
+    keep[changes] = True
+    keep[changes - 1] = True
+    keep[0] = keep[-1] = True
+    return keep
+
+
+def edge_occurrence_bounds(coordinate_edges: list) -> np.ndarray:
+    """
+    Find the first and last point on every edge, over the whole trace.
+
+    The route is timed with the first and last timestamp of every edge, keeping these
+    points keeps those times when the other points of the edge are dropped.
+
+    :param coordinate_edges: The nearest edge of every point
+    :return: Boolean mask of the points to keep
+    """
+    keep = np.zeros(len(coordinate_edges), dtype=bool)
+    first = {}
+    last = {}
+    for index, edge in enumerate(coordinate_edges):
+        first.setdefault(edge, index)
+        last[edge] = index
+    keep[list(first.values())] = True
+    keep[list(last.values())] = True
+    return keep
+
+
+def collapse_stationary(x: np.ndarray, y: np.ndarray, radius: float) -> np.ndarray:
+    """
+    Keep only the first and last point of every stationary cluster.
+
+    A cluster is a run of points within the radius of its first point.
+
+    :param x: The x of every point in meters
+    :param y: The y of every point in meters
+    :param radius: Cluster radius in meters
+    :return: Boolean mask of the points to keep
+    """
+    keep = np.ones(len(x), dtype=bool)
+    xs, ys = x.tolist(), y.tolist()
+    start = 0
+    squared = radius * radius
+    for index in range(1, len(xs) + 1):
+        if index < len(xs):
+            dx, dy = xs[index] - xs[start], ys[index] - ys[start]
+            if dx * dx + dy * dy <= squared:
+                continue
+        # The cluster ended at the point before this one
+        keep[start + 1 : index - 1] = False
+        start = index
+    return keep
+
+
+def drop_close(
+    x: np.ndarray,
+    y: np.ndarray,
+    timestamps: np.ndarray,
+    keep: np.ndarray,
+    min_distance: float,
+    min_interval: float,
+) -> np.ndarray:
+    """
+    Drop points closer than the minimum distance or time to the previous kept point.
+
+    :param x: The x of every point in meters
+    :param y: The y of every point in meters
+    :param timestamps: datetime64 time of every point, only needed with min_interval
+    :param keep: Boolean mask of the points that are still kept, updated in place
+    :param min_distance: Minimum distance in meters, 0 disables it
+    :param min_interval: Minimum time in seconds, 0 disables it
+    :return: The mask
+    """
+    indexes = np.flatnonzero(keep).tolist()
+    xs, ys = x.tolist(), y.tolist()
+    seconds = (
+        ((timestamps - timestamps[0]) / np.timedelta64(1, "s")).tolist()
+        if min_interval > 0
+        else None
+    )
+    squared = min_distance * min_distance
+    last = indexes[0]
+    for index in indexes[1:-1]:
+        dx, dy = xs[index] - xs[last], ys[index] - ys[last]
+        if dx * dx + dy * dy < squared or (
+            seconds is not None and seconds[index] - seconds[last] < min_interval
+        ):
+            keep[index] = False
+        else:
+            last = index
+    return keep
+
+
+def simplify(
+    x: np.ndarray, y: np.ndarray, keep: np.ndarray, tolerance: float
+) -> np.ndarray:
+    """
+    Drop kept points with Douglas-Peucker simplification.
+
+    :param x: The x of every point in meters
+    :param y: The y of every point in meters
+    :param keep: Boolean mask of the points that are still kept, updated in place
+    :param tolerance: Maximum distance in meters of a dropped point to the simplified
+        line
+    :return: The mask
+    """
+    indexes = np.flatnonzero(keep)
+    if len(indexes) < 3:
+        return keep
+    px, py = x[indexes], y[indexes]
+    retained = np.zeros(len(indexes), dtype=bool)
+    retained[0] = retained[-1] = True
+    stack = [(0, len(indexes) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx, dy = px[last] - px[first], py[last] - py[first]
+        sx, sy = px[first + 1 : last] - px[first], py[first + 1 : last] - py[first]
+        length = np.hypot(dx, dy)
+        if length > 0:
+            distances = np.abs(sx * dy - sy * dx) / length
+        else:
+            distances = np.hypot(sx, sy)
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            middle = first + 1 + farthest
+            retained[middle] = True
+            stack.append((first, middle))
+            stack.append((middle, last))
+    keep[indexes[~retained]] = False
+    return keep
+
+
+def thin(
+    lats: np.ndarray,
+    lons: np.ndarray,
+    timestamps: np.ndarray = None,
+    min_distance: float = 0,
+    min_interval: float = 0,
+    stationary_radius: float = 0,
+    tolerance: float = 0,
+) -> np.ndarray:
+    """
+    Select the points of a trace that are worth matching.
+
+    Stationary clusters are collapsed first, then points too close to the previous kept
+    point are dropped and finally the rest is simplified with Douglas-Peucker. The first
+    and last point of the trace are always kept.
+
+    :param lats: Array of latitudes
+    :param lons: Array of longitudes
+    :param timestamps: datetime64 time of every point, only needed with min_interval
+    :param min_distance: Minimum distance in meters to the previous kept point
+    :param min_interval: Minimum time in seconds since the previous kept point
+    :param stationary_radius: Radius in meters of a stationary cluster
+    :param tolerance: Douglas-Peucker tolerance in meters
+    :return: Boolean mask of the points to keep, 0 disables any of the steps
+    """
+    if len(lats) < 3:
+        return np.ones(len(lats), dtype=bool)
+    x, y = project(lats, lons)
+    if stationary_radius > 0:
+        keep = collapse_stationary(x, y, stationary_radius)
+    else:
+        keep = np.ones(len(lats), dtype=bool)
+    if min_distance > 0 or min_interval > 0:
+        drop_close(x, y, timestamps, keep, min_distance, min_interval)
+    if tolerance > 0:
+        simplify(x, y, keep, tolerance)
+    return keep
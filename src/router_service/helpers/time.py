@@ -1,146 +1,205 @@
 """
 Time helpers.
 """
-import json
+import re
 from datetime import datetime
 
-from geopandas import GeoDataFrame
-from src.router_service.helpers.helpers import get_first_occurrence_indexes
+import numpy as np
+import pandas
+
+UTC_OFFSET = re.compile(r"(Z|[+-]\d{2}:?\d{2})$")
+
+
+def parse_timestamps(timestamps: list[str]) -> np.ndarray:
+    """
+    Parse all ISO 8601 timestamps of a trace at once.
+
+    Any number of fractional digits is accepted, like the 7 digit .NET timestamps
+    (2023-06-01T13:04:30.4366085Z) and 3 digit ones (2023-06-06T21:17:01.042Z).
+    Timestamps with an offset keep their local time, the offset is dropped like the
+    route times always did, so rush hours are priced on the local hour.
+
+    :param timestamps: The timestamp strings
+    :return: datetime64[ns] array of the local times
+    """
+    if not all(timestamp.endswith("Z") for timestamp in timestamps):
+        timestamps = [UTC_OFFSET.sub("", timestamp) for timestamp in timestamps]
+    return pandas.to_datetime(timestamps, format="ISO8601").tz_localize(None).to_numpy()
 
 
 def get_start_and_end_time_of_edges(
-    coordinates: list, nearest_edges: list, time_field: str
-) -> list[(str, str)]:
+    timestamps: np.ndarray, nearest_edges: list, positions: np.ndarray = None
+) -> list[(np.datetime64, np.datetime64)]:
     """
     Get the first and last timestamp associated with an edge.
 
-    :param time_field:
-    :param coordinates: coordinates list with timeStamp property
+    :param timestamps: the timestamp of every coordinate, as returned by parse_timestamps
     :param nearest_edges: the edges to match timestamps to
+    :param positions: the coordinate index of every edge if the coordinates were thinned,
+        it must include the first and last coordinate of every edge
     :return: the timestamps in the same order the edges are in
     """
-    first_occurrence_index = get_first_occurrence_indexes(nearest_edges)
-    last_occurrence_index = get_first_occurrence_indexes(nearest_edges[::-1])
-    # Get the first timestamp
-    first_occurrence_timestamps = [
-        [coordinate[time_field] for coordinate in coordinates][i]
-        for i in first_occurrence_index
-    ]
-    last_occurrence_timestamps = [
-        [coordinate[time_field] for coordinate in coordinates][i]
-        for i in last_occurrence_index
-    ]
+    if positions is None:
+        positions = range(len(nearest_edges))
+    else:
+        positions = positions.tolist()
+    # Dicts keep insertion order, so these are in order of first occurrence
+    first_occurrence_index = {}
+    for index, edge in zip(positions, nearest_edges):
+        first_occurrence_index.setdefault(edge, index)
+    last_occurrence_index = {}
+    for index, edge in zip(reversed(positions), reversed(nearest_edges)):
+        last_occurrence_index.setdefault(edge, len(timestamps) - 1 - index)
     # No idea why but the timestamps where the wrong way around. Now they feel like they should be wrong but aren't...
     return [
-        (x, y) for x, y in zip(last_occurrence_timestamps, first_occurrence_timestamps)
+        (timestamps[last], timestamps[first])
+        for first, last in zip(
+            first_occurrence_index.values(), last_occurrence_index.values()
+        )
     ]
 
 
 def match_timestamps(
     nearest_edges: list[(int, int, int)],
-    route_edges: GeoDataFrame,
-    edge_start_end_timestamps: list[(str, str)],
+    route_edges: list[(int, int, int)],
+    edge_start_end_timestamps: list[(np.datetime64, np.datetime64)],
 ):
     """
     Match the timestamps to the nearest edges they belong to.
 
-    :param nearest_edges: The edges to match index with
-    :param route_edges: The edges dataframe from which to get u/v/key
+    :param nearest_edges: The edges to match index with, without duplicates
+    :param route_edges: The (u, v, key) of the route edges in order
     :param edge_start_end_timestamps: The timestamps
     :return: The times with the same index as the matching edges.
     """
-    working_copy = route_edges.copy().reset_index()
+    nearest_edge_index = {}
+    for index, edge in enumerate(nearest_edges):
+        nearest_edge_index.setdefault(edge, index)
     return_timestamps = {}
-    for i, edge in working_copy.iterrows():
-        try:
-            index = nearest_edges.index((edge["u"], edge["v"], edge["key"]))
+    for i, edge in enumerate(route_edges):
+        index = nearest_edge_index.get(edge)
+        if index is not None:
             return_timestamps[i] = edge_start_end_timestamps[index]
-        except ValueError:
-            continue
     return return_timestamps
 
 
-def fill_timestamps(edge_timestamps: dict[int: tuple[str, str]], highest_index: int):
+def fill_timestamps(edge_timestamps: dict[int: tuple], highest_index: int):
     """
     Fill in the missing indexes using neighbouring timestamps.
 
+    The first half of a gap copies the timestamp before it and the second half the one
+    after it. The middle edge of an odd gap gets the end of the one before and the start
+    of the one after. Gaps at the start or end copy their only neighbour.
+
     :param edge_timestamps: The list of matched timestamps with indexes for their edge
     :param highest_index: The highest index to fill up to
     :return: edge_timestamps with missing indexes filled
     """
-    missing_ranges = []
-    # Find ranges of missing indexes
-    for i in range(highest_index):
-        if i in edge_timestamps.keys():
+    index = 0
+    while index < highest_index:
+        if index in edge_timestamps:
+            index += 1
             continue
-        if len(missing_ranges) == 0:
-            missing_ranges.append([i])
-        elif missing_ranges[-1][-1] == i - 1:
-            missing_ranges[-1].append(i)
-        else:
-            missing_ranges.append([i])
-
-    # First, make sure index 0 and highest_index have timestamps
-    # by setting all elements in that list to the first/last element that has a timestamp
-    if 0 in missing_ranges[0]:
-        for i in missing_ranges[0]:
-            edge_timestamps[i] = edge_timestamps[max(missing_ranges[0]) + 1]
-        missing_ranges.pop(0)
-    if highest_index in missing_ranges[-1]:
-        for i in missing_ranges[-1]:
-            edge_timestamps[i] = edge_timestamps[min(missing_ranges[-1]) - 1]
-        missing_ranges.pop(-1)
-
-    for index, missing_range in enumerate(missing_ranges):
-        # For longer ranges, full copy both sides, then check if any elements are left empty
-        while len(missing_range) > 1:
-            try:
-                edge_timestamps[missing_range[0]] = edge_timestamps[min(missing_range) - 1]
-                edge_timestamps[missing_range[-1]] = edge_timestamps[max(missing_range) + 1]
-                missing_range.pop(0)
-                missing_range.pop(-1)
-            except KeyError as e:
-                print(e)
-                print("------------------------------")
-                print("For ranges:")
-                print(json.dumps(missing_ranges))
-                print("------------------------------")
-                print("For range:")
-                print(json.dumps(missing_range))
-                raise e
-        # Do the 2 way copy for len 1 ranges
-        if len(missing_range) == 1:
-            edge_timestamps[missing_range[0]] = (
-                edge_timestamps[missing_range[0] - 1][1],
-                edge_timestamps[missing_range[0] + 1][0],
-            )
-        # This should only leave len 0  ranges, which we can move on from
+        # Find the end of this gap
+        start = index
+        while index < highest_index and index not in edge_timestamps:
+            index += 1
+        end = index - 1
+        before = edge_timestamps.get(start - 1)
+        after = edge_timestamps.get(end + 1)
+
+        if before is None and after is None:
+            raise ValueError("No timestamps to fill the missing edge timestamps from")
+        if before is None or after is None:
+            for missing in range(start, end + 1):
+                edge_timestamps[missing] = after if before is None else before
+            continue
+
+        half = (end - start + 1) // 2
+        for missing in range(start, start + half):
+            edge_timestamps[missing] = before
+        for missing in range(end - half + 1, end + 1):
+            edge_timestamps[missing] = after
+        if (end - start + 1) % 2:
+            edge_timestamps[start + half] = (before[1], after[0])
 
     return edge_timestamps
 
 
-def get_halfway_time(time_one, time_two):
+def get_edge_times(
+    indexed_edge_timestamps: dict[int: tuple], edge_count: int
+) -> (np.ndarray, np.ndarray):
+    """
+    Get the start and end time of every route edge as arrays.
+
+    :param indexed_edge_timestamps: Filled timestamps with same index as the edge they belong to
+    :param edge_count: The number of route edges
+    :return: datetime64[ns] arrays with the start and end times, NaT where unknown
     """
-    Get the timestamp halfway between the start and end time.
+    times = np.full((edge_count, 2), np.datetime64("NaT"), dtype="datetime64[ns]")
+    for index, start_end in indexed_edge_timestamps.items():
+        if index < edge_count:
+            times[index] = start_end
+    return times[:, 0], times[:, 1]
 
-    Requires string times with format "%Y-%m-%dT%H:%M:%S.%fZ".
 
-    :param time_one: The first timestamp
-    :param time_two: The second timestamp
-    :return: The timestamp halfway between the two inputs
+def interpolate_timestamps(
+    indexed_edge_timestamps: dict[int: tuple], edge_lengths: np.ndarray
+) -> (np.ndarray, np.ndarray):
     """
-    # Parse the datetime strings into datetime objects
-    # TODO: This format doesn't match 2023-06-06T21:17:01.042Z
-    start_time = datetime.fromisoformat(time_one)
-    end_time = datetime.fromisoformat(time_two)
+    Get the start and end time of every route edge, interpolating the unmatched ones.
 
-    # Calculate the time duration between the two datetime objects
-    duration = end_time - start_time
+    Unmatched edges get times proportional to their cumulative length between the
+    surrounding matched edges, so a long bridged stretch is timed by distance instead
+    of copying the times of its neighbours. Edges before the first or after the last
+    matched edge get the time at that edge.
 
-    # Calculate the halfway time by adding half of the duration to the start time
-    halfway_time = start_time + (duration / 2)
+    :param indexed_edge_timestamps: Matched timestamps with same index as the edge they belong to
+    :param edge_lengths: Length of every route edge in order
+    :return: datetime64[ns] arrays with the start and end times
+    """
+    start_times, end_times = get_edge_times(indexed_edge_timestamps, len(edge_lengths))
+    matched = ~np.isnat(start_times)
+    if not matched.any():
+        raise ValueError("No timestamps to interpolate the missing edge timestamps from")
+
+    distance = np.concatenate(([0.0], np.cumsum(edge_lengths)))
+    start_distance = distance[:-1]
+    end_distance = distance[1:]
+    # Interpolate on nanoseconds since the first matched time to keep float precision
+    base = start_times[matched][0]
+    anchor_distance = np.column_stack(
+        (start_distance[matched], end_distance[matched])
+    ).ravel()
+    anchor_time = (
+        np.column_stack((start_times[matched] - base, end_times[matched] - base))
+        .ravel()
+        .astype(np.float64)
+    )
+
+    missing = ~matched
+    for times, distances in ((start_times, start_distance), (end_times, end_distance)):
+        offsets = np.interp(distances[missing], anchor_distance, anchor_time)
+        times[missing] = base + offsets.astype(np.int64).astype("timedelta64[ns]")
+    return start_times, end_times
+
+
+def get_halfway_times(start_times: np.ndarray, end_times: np.ndarray) -> np.ndarray:
+    """
+    Get the times halfway between the start and end times, truncated to seconds.
+
+    :param start_times: datetime64 array of start times
+    :param end_times: datetime64 array of end times
+    :return: datetime64[s] array of the times halfway between
+    """
+    return (start_times + (end_times - start_times) / 2).astype("datetime64[s]")
 
-    # Convert the halfway time to a string
-    halfway_time_str = halfway_time.strftime("%Y-%m-%d %H:%M:%S")
 
-    return halfway_time_str
+def to_datetimes(times: np.ndarray) -> list[datetime]:
+    """
+    Convert a datetime64 array to a list of datetime objects.
+
+    :param times: The datetime64 array
+    :return: List of naive datetimes
+    """
+    return times.astype("datetime64[us]").tolist()
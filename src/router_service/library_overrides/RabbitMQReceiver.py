@@ -0,0 +1,79 @@
+"""
+The custom RabbitMQ Receiver class.
+"""
+import logging
+
+from pika import BlockingConnection, ConnectionParameters
+
+
+class RabbitMQReceiver(object):
+    """
+    The custom RabbitMQ Receiver class.
+
+    Unlike the masstransitpython receiver, messages are acknowledged by the callback and
+    the number of unacknowledged messages is limited by the prefetch count.
+    """
+
+    __slots__ = [
+        "_configuration",
+        "_connection",
+        "_channel",
+        "_queue",
+        "_routing_key",
+        "_exchange",
+        "_prefetch_count",
+        "_on_message_callback",
+    ]
+
+    def __init__(self, configuration, exchange, routing_key="", prefetch_count=1):
+        """
+        Create the RabbitMQ Receiver.
+
+        :param configuration: RabbitMQConfiguration object
+        :param exchange: The exchange to bind the queue to
+        :param routing_key: The routing key
+        :param prefetch_count: Maximum number of unacknowledged messages
+        """
+        self._configuration = configuration
+        self._connection = BlockingConnection(
+            ConnectionParameters(
+                host=self._configuration.host,
+                port=self._configuration.port,
+                virtual_host=self._configuration.virtual_host,
+                credentials=self._configuration.credentials,
+            )
+        )
+        self._channel = self._connection.channel()
+        self._queue = self._configuration.queue
+        self._routing_key = routing_key
+        self._exchange = exchange
+        self._prefetch_count = prefetch_count
+        self._channel.queue_declare(queue=self._queue)
+        self._channel.exchange_declare(
+            exchange=self._exchange, exchange_type="fanout", durable=True
+        )
+        self._channel.queue_bind(
+            queue=self._queue, exchange=self._exchange, routing_key=self._routing_key
+        )
+        self._on_message_callback = None
+
+    def add_on_message_callback(self, on_message_callback):
+        """
+        Set the callback messages are consumed with.
+
+        :param on_message_callback: Function called with (ch, method, properties, body)
+        """
+        self._on_message_callback = on_message_callback
+
+    def start_consuming(self):
+        """
+        Start consuming with manual acknowledgements.
+        """
+        logging.info(f"Listening to {self._queue} queue\n")
+        self._channel.basic_qos(prefetch_count=self._prefetch_count)
+        self._channel.basic_consume(
+            queue=self._queue,
+            on_message_callback=self._on_message_callback,
+            auto_ack=False,
+        )
+        self._channel.start_consuming()
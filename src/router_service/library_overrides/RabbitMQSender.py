@@ -43,6 +43,34 @@ class RabbitMQSender(object):
         self._routing_key = ""
         self._exchange = ""
 
+    @property
+    def is_open(self) -> bool:
+        """
+        Check if the connection and channel can still be published on.
+
+        :return: True if open
+        """
+        return self._connection.is_open and self._channel.is_open
+
+    def process_data_events(self):
+        """
+        Handle pending frames without blocking, so a lost connection is noticed.
+        """
+        self._connection.process_data_events(time_limit=0)
+
+    def enable_confirms(self):
+        """
+        Put the channel in confirm mode, publish then waits for the broker to confirm.
+        """
+        self._channel.confirm_delivery()
+
+    def close(self):
+        """
+        Close the connection if it is still open.
+        """
+        if self._connection.is_open:
+            self._connection.close()
+
     def __enter__(self):
         """
         Return self for use in 'using'.
@@ -86,10 +114,12 @@ class RabbitMQSender(object):
         """
         Create a masstransit compatible response envelope.
 
-        :param message: The message to be sent.
+        :param message: The message to be sent, a model or an object with to_wire.
         :param request_body: The body of a previous masstransit message.
         :return: The MessageEnvelope containing the necessary entries
         """
+        if hasattr(message, "to_wire"):
+            message = message.to_wire()
         return MessageEnvelope(
             messageId=uuid.uuid4(),
             conversationId=request_body["conversationId"],
@@ -106,4 +136,4 @@ class RabbitMQSender(object):
         :param exc_tb:
         :return:
         """
-        self._connection.close()
+        self.close()
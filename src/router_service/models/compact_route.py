@@ -0,0 +1,152 @@
+"""
+Array backed route used while processing, converted to the route models only when sent.
+"""
+import numpy as np
+from src.router_service.models.route_models import Node, Route, Segment, Way
+
+
+class CompactRoute:
+    """
+    Route stored as one array per field instead of a model per segment.
+
+    Segment i runs from node i to node i + 1 over way i, so there is one more node
+    than there are segments.
+
+    :param node_ids: OSM ids of the nodes
+    :param node_lats: Latitudes of the nodes
+    :param node_lons: Longitudes of the nodes
+    :param way_ids: OSM ids of the ways
+    :param way_names: Names of the ways
+    :param highways: Highway types of the ways, a list for merged ways
+    :param lengths: Lengths of the ways in kilometers
+    :param start_times: datetime64 time the segments start
+    :param end_times: datetime64 time the segments end
+    :param times: datetime64[s] time halfway every segment
+    """
+
+    __slots__ = [
+        "node_ids",
+        "node_lats",
+        "node_lons",
+        "way_ids",
+        "way_names",
+        "highways",
+        "lengths",
+        "start_times",
+        "end_times",
+        "times",
+        "prices",
+        "price_total",
+        "vehicle_id",
+        "price_version",
+    ]
+
+    def __init__(
+        self,
+        node_ids: list[str],
+        node_lats: np.ndarray,
+        node_lons: np.ndarray,
+        way_ids: list[str],
+        way_names: np.ndarray,
+        highways: np.ndarray,
+        lengths: np.ndarray,
+        start_times: np.ndarray,
+        end_times: np.ndarray,
+        times: np.ndarray,
+    ):
+        self.node_ids = node_ids
+        self.node_lats = node_lats
+        self.node_lons = node_lons
+        self.way_ids = way_ids
+        self.way_names = way_names
+        self.highways = highways
+        self.lengths = lengths
+        self.start_times = start_times
+        self.end_times = end_times
+        self.times = times
+        self.prices = np.zeros(len(way_ids), dtype=np.float64)
+        self.price_total = 0.0
+        self.vehicle_id = None
+        # Version of the price model the route was priced with, not sent
+        self.price_version = None
+
+    def __len__(self):
+        """
+        Get the number of segments.
+
+        :return: The number of segments
+        """
+        return len(self.way_ids)
+
+    def to_wire(self) -> dict:
+        """
+        Convert the route to the schema agreed with the other teams.
+
+        Gives the same dict as Route.dict(by_alias=True), with the segment times as
+        iso strings like Route.json(by_alias=True) writes them.
+
+        :return: The route as a json serializable dict
+        """
+        nodes = [
+            {"id": node_id, "lat": lat, "lon": lon}
+            for node_id, lat, lon in zip(
+                self.node_ids, self.node_lats.tolist(), self.node_lons.tolist()
+            )
+        ]
+        times = np.datetime_as_string(self.times, unit="s").tolist()
+        return {
+            "id": self.vehicle_id,
+            "priceTotal": self.price_total,
+            "segments": [
+                {
+                    "start": nodes[index],
+                    "way": {"id": way_id},
+                    "end": nodes[index + 1],
+                    "time": time,
+                    "price": price,
+                }
+                for index, (way_id, time, price) in enumerate(
+                    zip(self.way_ids, times, self.prices.tolist())
+                )
+            ],
+        }
+
+    def to_route(self) -> Route:
+        """
+        Convert the route to the Route model.
+
+        :return: The Route model
+        """
+        start_times = self.start_times.astype("datetime64[us]").tolist()
+        end_times = self.end_times.astype("datetime64[us]").tolist()
+        times = self.times.astype("datetime64[us]").tolist()
+        lats = self.node_lats.tolist()
+        lons = self.node_lons.tolist()
+        route = Route(priceTotal=self.price_total)
+        route.vehicle_id = self.vehicle_id
+        for index, price in enumerate(self.prices.tolist()):
+            route.add_segment(
+                Segment(
+                    start=Node(
+                        id=self.node_ids[index],
+                        lat=lats[index],
+                        lon=lons[index],
+                        time=start_times[index],
+                    ),
+                    way=Way(
+                        id=self.way_ids[index],
+                        name=self.way_names[index],
+                        highway=self.highways[index],
+                        length=self.lengths[index],
+                    ),
+                    end=Node(
+                        id=self.node_ids[index + 1],
+                        lat=lats[index + 1],
+                        lon=lons[index + 1],
+                        time=end_times[index],
+                    ),
+                    time=times[index],
+                    price=price,
+                )
+            )
+        return route
@@ -0,0 +1,79 @@
+"""
+Contains the MatchSession, the state of incrementally matching the trace of one vehicle.
+"""
+import sys
+
+# Size of a (start, end) list of datetime64 scalars and its dict slot
+_TIMES_ENTRY_BYTES = 56 + 2 * 32 + 100
+
+
+class MatchSession:
+    """
+    The part of a vehicle's route that was matched but not emitted yet.
+
+    The pending route ends in the edge the vehicle was last matched to. That edge may
+    still get points from the next message, so it is kept until the vehicle moves on.
+    The roads the points moved onto after it are only candidates until later points
+    show which of them the vehicle drove, points near an intersection often snap to a
+    side road.
+    """
+
+    __slots__ = (
+        "nodes",
+        "times",
+        "anchored",
+        "candidates",
+        "junction",
+        "last_seen",
+        "region",
+    )
+
+    def __init__(self):
+        """
+        Create an empty session.
+        """
+        # Ordered nodes of the pending route, pending edge i runs from nodes[i] to nodes[i + 1]
+        self.nodes = []
+        # Pending edge index to the [first, last] datetime64 of the points matched to it
+        self.times = {}
+        # Whether the direction of the first edge is known
+        self.anchored = False
+        # The (u, v) and [first, last] datetime64 of the points of the roads the points
+        # moved onto, not added to the route yet
+        self.candidates = []
+        # Node of the last edge the candidates start from, None if they aren't adjacent
+        self.junction = None
+        self.last_seen = 0.0
+        # Name of the region the nodes belong to, when several regions are loaded
+        self.region = None
+
+    @property
+    def current(self) -> tuple:
+        """
+        Get the edge the vehicle was last matched to.
+
+        :return: Its (u, v), or None if nothing was matched yet
+        """
+        return tuple(self.nodes[-2:]) if self.nodes else None
+
+    def reset(self):
+        """
+        Drop the pending route, the next points start a new one.
+        """
+        self.nodes = []
+        self.times = {}
+        self.anchored = False
+        self.candidates = []
+        self.junction = None
+
+    def nbytes(self) -> int:
+        """
+        Estimate the memory held by the session.
+
+        :return: Number of bytes
+        """
+        return (
+            sys.getsizeof(self.nodes)
+            + sys.getsizeof(self.times)
+            + (len(self.times) + len(self.candidates)) * _TIMES_ENTRY_BYTES
+        )
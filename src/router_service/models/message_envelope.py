@@ -2,7 +2,7 @@
 MessageEnvelope model.
 """
 import uuid
-from typing import List
+from typing import Any, List
 
 from pydantic import BaseModel
 
@@ -15,4 +15,5 @@ class MessageEnvelope(BaseModel):
     messageId: uuid.UUID
     conversationId: uuid.UUID
     messageType: List[str]
-    message: BaseModel
+    # A model, or a dict already in the wire schema
+    message: Any
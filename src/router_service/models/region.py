@@ -0,0 +1,129 @@
+"""
+Contains the Region, an area whose road network is loaded as one graph.
+"""
+import os
+
+REGION_TYPES = ("PLACE", "BBOX")
+
+
+class Region:
+    """
+    A named area, either a geocodable place or a bounding box.
+
+    Regions are configured as "TYPE:value", the same text the key of its snapshots and
+    tiles is made of, so a region keeps its files when it is renamed.
+    """
+
+    __slots__ = ("name", "type", "value", "bounds")
+
+    def __init__(self, name, region_type: str, value: str, bounds: tuple = None):
+        """
+        Create the region.
+
+        :param name: The name of the region, None for the single region of REGION_TYPE
+        :param region_type: PLACE or BBOX
+        :param value: The place, or the north,south,east,west of the bounding box
+        :param bounds: The (north, south, east, west) of the region, parsed from the
+            value of a bounding box if not given
+        """
+        self.name = name
+        self.type = region_type
+        self.value = value
+        if bounds is None and region_type == "BBOX":
+            try:
+                bounds = tuple(float(side) for side in value.split(","))
+            except (AttributeError, ValueError):
+                bounds = None
+            if bounds is not None and len(bounds) != 4:
+                bounds = None
+        self.bounds = bounds
+
+    @classmethod
+    def from_env(cls) -> "Region":
+        """
+        Get the region configured with REGION_TYPE and REGION or NORTH/SOUTH/EAST/WEST.
+
+        :return: The unnamed region
+        """
+        region_type = os.environ.get("REGION_TYPE")
+        match region_type:
+            case "PLACE":
+                value = os.environ.get("REGION")
+            case "BBOX":
+                value = ",".join(
+                    str(os.environ.get(side))
+                    for side in ("NORTH", "SOUTH", "EAST", "WEST")
+                )
+            case _:
+                value = None
+        return cls(None, region_type, value)
+
+    @classmethod
+    def parse(cls, spec: str) -> "Region":
+        """
+        Parse a region configured as "name=TYPE:value".
+
+        :param spec: The region, e.g. "brussels=PLACE:Brussels, Belgium" or
+            "luxembourg=BBOX:50.18,49.44,6.53,5.73"
+        :return: The region
+        """
+        name, _, key = spec.partition("=")
+        region_type, _, value = key.partition(":")
+        name, region_type, value = name.strip(), region_type.strip(), value.strip()
+        if not name or region_type not in REGION_TYPES or not value:
+            raise ValueError(f"Invalid region: {spec}")
+        region = cls(name, region_type, value)
+        if region_type == "BBOX" and region.bounds is None:
+            raise ValueError(f"Invalid bounding box of region {name}: {value}")
+        return region
+
+    @classmethod
+    def parse_all(cls, specs: str) -> list:
+        """
+        Parse regions separated by semicolons.
+
+        :param specs: The regions, see parse
+        :return: List of regions
+        """
+        regions = [cls.parse(spec) for spec in specs.split(";") if spec.strip()]
+        names = [region.name for region in regions]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate region names: {names}")
+        return regions
+
+    @property
+    def key(self) -> str:
+        """
+        Get the key identifying the area, snapshots and tiles are checked against it.
+
+        :return: The region type followed by the place or bounding box
+        """
+        if self.type in REGION_TYPES:
+            return f"{self.type}:{self.value}"
+        return str(self.type)
+
+    def count_inside(self, lats, lons) -> int:
+        """
+        Count the coordinates inside the bounds of the region.
+
+        :param lats: Array of latitudes
+        :param lons: Array of longitudes
+        :return: The number of coordinates inside, 0 if the bounds are unknown
+        """
+        if self.bounds is None:
+            return 0
+        north, south, east, west = self.bounds
+        return int(
+            ((lats <= north) & (lats >= south) & (lons <= east) & (lons >= west)).sum()
+        )
+
+    def area(self) -> float:
+        """
+        Get the size of the bounds in square degrees.
+
+        :return: The size, infinite if the bounds are unknown
+        """
+        if self.bounds is None:
+            return float("inf")
+        north, south, east, west = self.bounds
+        return (north - south) * (east - west)
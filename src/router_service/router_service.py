@@ -6,9 +6,13 @@ import os
 
 from masstransitpython import RabbitMQConfiguration
 from pika import PlainCredentials
+from src.router_service.helpers import metrics
+from src.router_service.helpers.profiling import Profiler
 from src.router_service.services.receiver import Receiver
 from src.router_service.services.route_handler import RouteHandler
+from src.router_service.services.prefork import Prefork
 from src.router_service.services.sender import Sender
+from src.router_service.services.worker_pool import WorkerPool
 
 
 RABBITMQ_USERNAME = None
@@ -44,9 +48,105 @@ def run():
         port=RABBITMQ_PORT,
         virtual_host=RABBITMQ_VIRTUAL_HOST,
     )
-    route_handler = RouteHandler()
-    sender = Sender(conf, MASSTRANSIT_OUTPUT)
-    receiver = Receiver(conf, MASSTRANSIT_INPUT, route_handler.handle, sender)
+    # 0 handles messages on the consumer thread, more starts a pool of processes
+    WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", 0))
+    WORKER_MAX_IN_FLIGHT = int(
+        os.environ.get("WORKER_MAX_IN_FLIGHT", 2 * max(WORKER_PROCESSES, 1))
+    )
+    # Load the graph once and fork the workers, so they share it copy-on-write
+    WORKER_PRELOAD = os.environ.get("WORKER_PRELOAD", "false").lower() == "true"
+    # More than 0 loads the graph once and forks this many consuming children
+    PREFORK_CHILDREN = int(os.environ.get("PREFORK_CHILDREN", 0))
+    PREFORK_REPORT_INTERVAL = float(os.environ.get("PREFORK_REPORT_INTERVAL", 60))
+    # Seconds between sending the metrics of a forked consumer to the endpoint
+    PREFORK_METRICS_INTERVAL = float(os.environ.get("PREFORK_METRICS_INTERVAL", 5))
+
+    # More than 1 handles up to this many messages together, waiting at most
+    # BATCH_WAIT_MS for a batch to fill up
+    BATCH_SIZE = int(os.environ.get("BATCH_SIZE", 1))
+    BATCH_WAIT = float(os.environ.get("BATCH_WAIT_MS", 50)) / 1000
+
+    PUBLISH_CONFIRMS = os.environ.get("PUBLISH_CONFIRMS", "false").lower() == "true"
+    # Port of the Prometheus metrics endpoint, 0 disables it
+    METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+    if METRICS_PORT > 0:
+        metrics.start_server(METRICS_PORT)
+    if os.environ.get("SESSION_MODE", "false").lower() == "true" and (
+        WORKER_PROCESSES > 0 or PREFORK_CHILDREN > 0
+    ):
+        logging.warning(
+            "Match sessions are kept per process, messages of a vehicle must always "
+            "reach the same worker or its route is split over several sessions"
+        )
+
+    if (
+        os.environ.get("REGIONS")
+        and os.environ.get("REGION_PRELOAD", "false").lower() != "true"
+        and PREFORK_CHILDREN > 0
+    ):
+        logging.warning(
+            "REGIONS are loaded on demand by every consumer, their graphs are not "
+            "shared between the forked consumers"
+        )
+
+    if BATCH_SIZE > 1 and WORKER_PROCESSES > 0:
+        logging.warning("BATCH_SIZE is ignored with WORKER_PROCESSES")
+
+    if PREFORK_CHILDREN > 0:
+        route_handler = RouteHandler()
+        route_handler.before_fork()
+
+        def consume(index):
+            route_handler.after_fork()
+            receiver = Receiver(
+                conf,
+                MASSTRANSIT_INPUT,
+                route_handler.handle,
+                Sender(conf, MASSTRANSIT_OUTPUT, confirm=PUBLISH_CONFIRMS),
+                profiler=Profiler.from_env(),
+                batch_func=route_handler.handle_batch if BATCH_SIZE > 1 else None,
+                batch_size=BATCH_SIZE,
+                batch_wait=BATCH_WAIT,
+            )
+            logging.warning(f"Consumer {index} waiting for routes...")
+            receiver.start()
+
+        prefork = Prefork(
+            consume,
+            PREFORK_CHILDREN,
+            PREFORK_REPORT_INTERVAL,
+            PREFORK_METRICS_INTERVAL if METRICS_PORT > 0 else 0,
+        )
+        prefork.start()
+        try:
+            prefork.supervise()
+        finally:
+            prefork.stop()
+        return
+
+    sender = Sender(conf, MASSTRANSIT_OUTPUT, confirm=PUBLISH_CONFIRMS)
+    if WORKER_PROCESSES > 0:
+        pool = WorkerPool(RouteHandler, WORKER_PROCESSES, preload=WORKER_PRELOAD)
+        receiver = Receiver(
+            conf,
+            MASSTRANSIT_INPUT,
+            None,
+            sender,
+            pool=pool,
+            max_in_flight=WORKER_MAX_IN_FLIGHT,
+        )
+    else:
+        route_handler = RouteHandler()
+        receiver = Receiver(
+            conf,
+            MASSTRANSIT_INPUT,
+            route_handler.handle,
+            sender,
+            profiler=Profiler.from_env(),
+            batch_func=route_handler.handle_batch if BATCH_SIZE > 1 else None,
+            batch_size=BATCH_SIZE,
+            batch_wait=BATCH_WAIT,
+        )
     logging.warning("Waiting for routes...")
     receiver.start()
 
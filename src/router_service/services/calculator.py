@@ -3,21 +3,48 @@ The main route calculator.
 """
 import logging
 import os
+from itertools import repeat
 
 import networkx
+import numpy as np
 import osmnx
 import pandas
 from networkx import MultiDiGraph
 from osmnx import projection, settings
+from shapely import STRtree
 from src.router_service.helpers import custom_nearest_edge as cne
-from src.router_service.helpers.helpers import remove_duplicates
+from src.router_service.helpers import (
+    graph_snapshot,
+    graph_tiles,
+    hmm_matching,
+    memory,
+    thinning,
+)
+from src.router_service.helpers.cache import LRUCache
+from src.router_service.helpers.edge_table import EdgeTable
+from src.router_service.helpers.path_search import bounded_shortest_paths
+from src.router_service.helpers.helpers import remove_duplicates, road
+from src.router_service.helpers.metrics import (
+    CACHE_REQUESTS,
+    GAP_BRIDGES,
+    GAP_FILL_GENERATIONS,
+    ROUTE_EDGES,
+    KEPT_POINTS,
+    STAGE_SECONDS,
+    TRACE_POINTS,
+)
 from src.router_service.helpers.route_formatter import generate_formatted_route
 from src.router_service.helpers.time import (
     fill_timestamps,
+    get_edge_times,
     get_start_and_end_time_of_edges,
+    interpolate_timestamps,
     match_timestamps,
+    parse_timestamps,
 )
-from src.router_service.models.route_models import Route
+from src.router_service.models.compact_route import CompactRoute
+from src.router_service.models.match_session import MatchSession
+from src.router_service.models.region import Region
 
 
 class Calculator:
@@ -25,22 +52,153 @@ class Calculator:
     Route calculator service using osmnx and networkx.
     """
 
-    def __init__(self):
+    def __init__(self, area_graph: MultiDiGraph = None, region: Region = None):
         """
         Initialize the calculator.
+
+        :param area_graph: Graph to route on, loaded from the region if not given
+        :param region: The region to load, the one of REGION_TYPE if not given
         """
-        self.area_graph = self.init_osmnx()
-        self.geom, self.rtree = cne.init_rtree(self.area_graph)
+        self.region = region if region is not None else Region.from_env()
+        self.match_engine = os.environ.get("MATCH_ENGINE", "shortest_path")
+        self.hmm_candidates = int(os.environ.get("HMM_CANDIDATES", 5))
+        self.hmm_search_radius = float(os.environ.get("HMM_SEARCH_RADIUS", 50))
+        self.gap_fill_mode = os.environ.get("GAP_FILL_MODE", "expand")
+        self.gap_bridge_cutoff = float(os.environ.get("GAP_BRIDGE_CUTOFF", 2000))
+        self.timestamp_fill_mode = os.environ.get("TIMESTAMP_FILL_MODE", "copy")
+        self.bridge_cache = LRUCache(int(os.environ.get("BRIDGE_CACHE_SIZE", 10000)))
+        # Thinning of the points before matching, 0 disables a step
+        self.thin_min_distance = float(os.environ.get("THIN_MIN_DISTANCE", 0))
+        self.thin_min_interval = float(os.environ.get("THIN_MIN_INTERVAL", 0))
+        self.thin_stationary_radius = float(os.environ.get("THIN_STATIONARY_RADIUS", 0))
+        self.thin_tolerance = float(os.environ.get("THIN_TOLERANCE", 0))
 
-    @staticmethod
-    def init_osmnx() -> MultiDiGraph:
+        # Loaded tiles of the region when TILE_FOLDER is set, else the whole region is
+        self.tiles = None
+        tile_folder = self.folder("TILE_FOLDER")
+        if area_graph is not None:
+            self.set_graph(area_graph, *cne.init_rtree(area_graph))
+        elif tile_folder:
+            self.tiles = self.load_tiles(tile_folder)
+            self.set_graph(*self.tiles.compose())
+        else:
+            self.set_graph(*self.load_graph())
+
+    def set_graph(
+        self,
+        area_graph: MultiDiGraph,
+        geom: pandas.Series,
+        rtree: STRtree,
+        edge_table: EdgeTable = None,
+    ):
         """
-        Initialize OSMNX with configuration.
+        Start routing on the given graph, invalidating everything cached for the previous one.
 
-        :return osmnx_map: The OSMNX map of the given region as a networkx multidimensional graph
+        :param area_graph: The graph
+        :param geom: Geometry series of the graph indexed by u/v/key
+        :param rtree: The rtree over the geometries
+        :param edge_table: The edge table of the graph in the order of geom, built if
+            not given
+        """
+        self.area_graph = area_graph
+        self.geom = geom
+        self.rtree = rtree
+        self.edge_ids = cne.init_edge_ids(self.geom)
+        self.geometries = np.asarray(self.geom.values)
+        if edge_table is None:
+            edge_table = EdgeTable(self.area_graph, self.edge_ids)
+        self.edge_table = edge_table
+        self.bridge_cache.clear()
+
+    def folder(self, setting: str):
+        """
+        Get the folder a setting configures for the region of the calculator.
+
+        A named region gets a subfolder with its name, so regions don't share files.
+
+        :param setting: The name of the environment variable
+        :return: The folder, None if the setting isn't set
+        """
+        folder = os.environ.get(setting)
+        if folder and self.region.name is not None:
+            return os.path.join(folder, self.region.name)
+        return folder
+
+    def load_graph(self) -> (MultiDiGraph, pandas.Series, STRtree):
+        """
+        Load the graph of the region and build its spatial index.
+
+        If SNAPSHOT_FOLDER is set, the graph is loaded from the snapshot in that folder.
+        When there is no snapshot yet, or it was made for another region, the graph is
+        built with OSMNX and a new snapshot is written for the next start.
+
+        :return: The graph, its edge geometries and the rtree over those geometries
+        """
+        snapshot_folder = self.folder("SNAPSHOT_FOLDER")
+        region = self.region.key
+        if snapshot_folder:
+            try:
+                graph, geoms = graph_snapshot.load_snapshot(snapshot_folder, region)
+                return graph, geoms, STRtree(geoms)
+            except (FileNotFoundError, ValueError) as e:
+                logging.warning(f"Could not load graph snapshot, building graph: {e}")
+
+        graph = self.init_osmnx(self.region)
+        geoms, rtree = cne.init_rtree(graph)
+        if snapshot_folder:
+            graph_snapshot.save_snapshot(graph, geoms, snapshot_folder, region)
+        return graph, geoms, rtree
+
+    def load_tiles(self, folder: str) -> graph_tiles.TileStore:
+        """
+        Open the tiles of the region, no tile is loaded until a trace needs it.
+
+        When the folder has no tiles of the region yet, the whole region is loaded once
+        and split into tiles of TILE_SIZE degrees.
+
+        :param folder: The tile folder
+        :return: The tile store
+        """
+        region = self.region.key
+        if not graph_tiles.tiles_exist(folder, region):
+            logging.warning("No graph tiles for the region, splitting the graph...")
+            graph, geoms, _ = self.load_graph()
+            graph_tiles.write_tiles(
+                graph,
+                geoms,
+                folder,
+                float(os.environ.get("TILE_SIZE", 0.1)),
+                region,
+            )
+            del graph, geoms
+        return graph_tiles.TileStore(
+            folder,
+            int(os.environ.get("TILE_MAX_BYTES", 2 * 2**30)),
+            float(os.environ.get("TILE_MARGIN", 1000)),
+        )
+
+    def require_area(self, lats: np.ndarray, lons: np.ndarray):
+        """
+        Load the tiles around the coordinates if the graph is tiled.
+
+        The spatial index and edge table are rebuilt from the loaded tiles when they
+        changed, and the new objects are frozen like the graph loaded at startup.
+
+        :param lats: The latitudes of the coordinates
+        :param lons: The longitudes of the coordinates
+        """
+        if self.tiles is None:
+            return
+        with STAGE_SECONDS.time(stage="tiles"):
+            if self.tiles.require(lats, lons):
+                self.set_graph(*self.tiles.compose())
+                memory.freeze_new()
+
+    @staticmethod
+    def configure_osmnx():
+        """
+        Configure OSMNX, its cache is kept in CACHE_FOLDER if set.
         """
-        logging.warning("Starting OSMNX...")
-        # Configure osmnx, area and routing settings
         # For settings see https://osmnx.readthedocs.io/en/stable/osmnx.html?highlight=settings#module-osmnx.settings
         settings.log_console = False
         settings.use_cache = True
@@ -48,22 +206,33 @@ class Calculator:
         if cache_folder:
             settings.cache_folder = cache_folder
 
+    @staticmethod
+    def init_osmnx(region: Region = None) -> MultiDiGraph:
+        """
+        Initialize OSMNX with configuration.
+
+        :param region: The region to load, the one of REGION_TYPE if not given
+        :return osmnx_map: The OSMNX map of the given region as a networkx multidimensional graph
+        """
+        logging.warning("Starting OSMNX...")
+        Calculator.configure_osmnx()
+        region = region if region is not None else Region.from_env()
+
         # find the shortest route based on the mode of travel
         mode = "drive"  # 'drive', 'bike', 'walk'
-        REGION_TYPE = os.environ.get("REGION_TYPE")
-        match REGION_TYPE:
-            case "PLACE":
+        match region.type:
+            case "PLACE" if region.value:
                 # create graph from OSM within the boundaries of some
                 # geocodable place(s)
-                region = os.environ["REGION"]
-                osmnx_map = osmnx.graph_from_place(region, network_type=mode)
-            case "BBOX":
+                osmnx_map = osmnx.graph_from_place(region.value, network_type=mode)
+            case "BBOX" if region.bounds is not None:
                 # create graph from OSM within a bounding box
+                north, south, east, west = region.bounds
                 osmnx_map = osmnx.graph_from_bbox(
-                    north=float(os.environ.get("NORTH")),
-                    south=float(os.environ.get("SOUTH")),
-                    east=float(os.environ.get("EAST")),
-                    west=float(os.environ.get("WEST")),
+                    north=north,
+                    south=south,
+                    east=east,
+                    west=west,
                     network_type=mode,
                 )
             case _:
@@ -91,57 +260,203 @@ class Calculator:
         extra_edges = remove_duplicates(extra_edges)
         return extra_edges
 
-    def get_sorted_route_df(
-            self, route_node_ids: list
-    ) -> (pandas.DataFrame, pandas.DataFrame):
+    def bridge(self, from_edge: tuple, to_edge: tuple) -> (list, tuple):
+        """
+        Find the nodes that connect a traversed edge to the next matched edge.
+
+        The next edge may be driven in either direction if the road is two-way,
+        since both directions share the same geometry and snapping can pick either.
+
+        Results are kept in an LRU cache, as vehicles tend to drive the same roads. Only
+        GAP_FILL_MODE "bridge" and match sessions use it, "expand" searches the subgraph
+        of every trace anew.
+
+        :param from_edge: The (u, v) of the last traversed edge
+        :param to_edge: The (u, v) of the next matched edge
+        :return: The nodes to add after from_edge and the (u, v) the next edge is traversed as,
+            or None if the next edge can't be reached within the cutoff
+        """
+        key = (from_edge, to_edge)
+        cached = self.bridge_cache.get(key, False)
+        if cached is not False:
+            CACHE_REQUESTS.inc(cache="bridge", result="hit")
+            return cached
+        CACHE_REQUESTS.inc(cache="bridge", result="miss")
+        with STAGE_SECONDS.time(stage="path_search"):
+            bridged = self._search_bridge(from_edge, to_edge)
+        self.bridge_cache.put(key, bridged)
+        return bridged
+
+    def _search_bridge(self, from_edge: tuple, to_edge: tuple) -> (list, tuple):
+        options = [(to_edge[0], to_edge[1])]
+        if self.area_graph.has_edge(to_edge[1], to_edge[0]):
+            options.append((to_edge[1], to_edge[0]))
+        paths = bounded_shortest_paths(
+            self.area_graph,
+            from_edge[1],
+            [start for start, _ in options],
+            self.gap_bridge_cutoff,
+        )
+        reachable = [
+            (
+                paths[start][0]
+                + min(data["length"] for data in self.area_graph[start][end].values()),
+                paths[start][1][1:] + [end],
+                (start, end),
+            )
+            for start, end in options
+            if start in paths
+        ]
+        if not reachable:
+            return None
+        _, nodes, traversed = min(reachable, key=lambda option: option[0])
+        return nodes, traversed
+
+    def advance(self, current: tuple, edge: tuple) -> (list, tuple, bool):
         """
-        Generate the route edges and nodes tables.
+        Extend a route ending in the current edge to the next matched edge.
 
-        Edges are sorted in the order their nodes appear in route.
-        Nodes are not sorted.
+        :param current: The (u, v) of the last traversed edge
+        :param edge: The (u, v) of the next matched edge
+        :return: The nodes to add, the new last traversed edge and whether a bridge was
+            searched, or None if the edge can't be reached within the cutoff
+        """
+        if road(edge) == road(current):
+            return [], current, False
+        if edge[0] == current[1]:
+            return [edge[1]], edge, False
+        if edge[1] == current[1] and self.area_graph.has_edge(edge[1], edge[0]):
+            # Snapped to the other direction of the two-way road the route continues on
+            return [edge[0]], (edge[1], edge[0]), False
+        bridged = self.bridge(current, edge)
+        if bridged is None:
+            return None
+        nodes, current = bridged
+        return nodes, current, True
+
+    def bridge_edge_gaps(self, coordinate_edges: list) -> (list, int):
+        """
+        Connect the matched edges in trace order with bounded searches on the full graph.
+
+        Both directions of a road are taken as the same road. Points near an
+        intersection that snap to a side road for a moment are taken as snapping noise,
+        see _walk_session. Edges that can't be reached within GAP_BRIDGE_CUTOFF meters
+        are skipped as outliers.
+
+        :param coordinate_edges: The nearest edge of every coordinate
+        :return: The ordered route nodes and the number of bridges that were needed
+        """
+        session = MatchSession()
+        bridges, skipped = self._walk_session(session, coordinate_edges)
+        if session.candidates:
+            # Nothing comes after the last roads to tell which one was driven
+            bridged = self._take_candidate(session)
+            if bridged is None:
+                skipped += 1
+            else:
+                bridges += bridged
+        GAP_BRIDGES.inc(bridges)
+        if skipped:
+            logging.warning(
+                f"Skipped {skipped} edges that were not reachable within {self.gap_bridge_cutoff}m"
+            )
+        return session.nodes, bridges
+
+    def get_route_edges(self, route_node_ids: list) -> np.ndarray:
+        """
+        Get the route edges in the order they are driven.
 
         :param route_node_ids: The route to be mapped in the form of an ordered list of nodes.
-        :return: The route edges and nodes tables.
+        :return: The positions of the route edges in the edge table.
+        """
+        return self.edge_table.route_edges(route_node_ids)
+
+    @staticmethod
+    def get_lat_lon_arrays(
+        coordinates: list, longitude_field: str
+    ) -> (np.ndarray, np.ndarray):
         """
-        route_nodes, route_edges = osmnx.graph_to_gdfs(
-            self.area_graph.subgraph(route_node_ids)
+        Get the latitudes and longitudes of the coordinates as arrays.
+
+        :param coordinates: The coordinates
+        :param longitude_field: The name of the longitude field in the coordinates
+        :return: The latitudes and the longitudes
+        """
+        lats = np.fromiter(
+            (coordinate["lat"] for coordinate in coordinates),
+            dtype=float,
+            count=len(coordinates),
         )
-        route_edges = route_edges.reset_index()
-        # Sort the route table
-        previous_node = None
-        for index, node in enumerate(route_node_ids):
-            # Find next node and filter out backwards routes
-            route_edges.loc[
-                (route_edges["u"] == node) & ~(route_edges["v"] == previous_node),
-                "order",
-            ] = index
-            previous_node = node
-        route_edges = route_edges.loc[~route_edges["order"].isnull()].sort_values(
-            by=["order"]
+        lons = np.fromiter(
+            (coordinate[longitude_field] for coordinate in coordinates),
+            dtype=float,
+            count=len(coordinates),
         )
-        route_edges = route_edges.drop(columns=["order"]).set_index(["u", "v", "key"])
-        return route_edges, route_nodes
+        return lats, lons
 
-    def map_to_map(self, coordinates: list, longitude_field: str, time_field: str) -> Route:
+    def snap(self, lats: np.ndarray, lons: np.ndarray) -> list:
         """
-        Map the given coordinates to the given map.
+        Get the nearest edge of every coordinate using a single rtree query.
 
-        :param time_field:
-        :param longitude_field:
-        :param coordinates: The coordinates to map
-        :return:
+        :param lats: The latitudes of the coordinates
+        :param lons: The longitudes of the coordinates
+        :return: List of (u, v, key) tuples in the same order as the coordinates
         """
-        # Get a list of edges that are the nearest to the given coordinates
-        nearest_edges = [
-            cne.nearest_edges(
-                self.geom, self.rtree, lons=coordinate["lat"], lats=coordinate[longitude_field]
-            )
-            for coordinate in coordinates
-        ]
-        edge_start_end_timestamps = get_start_and_end_time_of_edges(
-            coordinates, nearest_edges, time_field
+        with STAGE_SECONDS.time(stage="snap"):
+            edges = cne.nearest_edges_batch(self.edge_ids, self.rtree, lats, lons)
+        return [tuple(edge) for edge in edges.tolist()]
+
+    def snap_traces(self, traces: list) -> list:
+        """
+        Get the nearest edge of every coordinate of several traces using a single rtree query.
+
+        :param traces: List of (lats, lons) array pairs
+        :return: The nearest edges of every trace, as returned by snap
+        """
+        if not traces:
+            return []
+        edges = self.snap(
+            np.concatenate([lats for lats, _ in traces]),
+            np.concatenate([lons for _, lons in traces]),
         )
-        nearest_edges = remove_duplicates(nearest_edges)
+        offsets = np.cumsum([0] + [len(lats) for lats, _ in traces])
+        return [edges[start:end] for start, end in zip(offsets, offsets[1:])]
+
+    def match_shortest_path(
+        self, lats: np.ndarray, lons: np.ndarray, coordinate_edges: list = None
+    ) -> (list, list):
+        """
+        Match the coordinates by snapping and finding the shortest path over the snapped edges.
+
+        With GAP_FILL_MODE "expand" (default), the edges around the snapped edges are
+        added until a path exists. With "bridge", consecutive snapped edges are connected
+        with bounded searches on the full graph.
+
+        :param lats: The latitudes of the coordinates
+        :param lons: The longitudes of the coordinates
+        :param coordinate_edges: The nearest edge of every coordinate if already snapped
+        :return: The nearest edge of every coordinate and the ordered route nodes
+        """
+        # Get a list of edges that are the nearest to the given coordinates
+        if coordinate_edges is None:
+            coordinate_edges = self.snap(lats, lons)
+        with STAGE_SECONDS.time(stage="gap_fill"):
+            route_node_ids = self.connect_edges(coordinate_edges)
+        return coordinate_edges, route_node_ids
+
+    def connect_edges(self, coordinate_edges: list) -> list:
+        """
+        Find the route over the snapped edges, filling the gaps between them.
+
+        :param coordinate_edges: The nearest edge of every coordinate
+        :return: The ordered route nodes
+        """
+        if self.gap_fill_mode == "bridge":
+            route_node_ids, bridges = self.bridge_edge_gaps(coordinate_edges)
+            logging.info(f"Bridged {bridges} gaps between matched edges")
+            return route_node_ids
+
+        nearest_edges = remove_duplicates(coordinate_edges)
 
         # Determine the start and end of the route
         start = (
@@ -163,11 +478,12 @@ class Calculator:
         while not path_found:
             try:
                 # Find the shortest route between the start and end using the filled graph
-                route_node_ids = networkx.shortest_path(
-                    self.area_graph.edge_subgraph(combined_edges),
-                    start,
-                    end,
-                )
+                with STAGE_SECONDS.time(stage="path_search"):
+                    route_node_ids = networkx.shortest_path(
+                        self.area_graph.edge_subgraph(combined_edges),
+                        start,
+                        end,
+                    )
                 path_found = True
             except networkx.exception.NetworkXNoPath:
                 logging.warning(
@@ -177,19 +493,389 @@ class Calculator:
                     combined_edges + self.fill_edge_gaps(combined_edges)
                 )
                 extra_edge_generations += 1
+        GAP_FILL_GENERATIONS.inc(extra_edge_generations)
+        return route_node_ids
+
+    def match_hmm(self, lats: np.ndarray, lons: np.ndarray) -> (list, list):
+        """
+        Match the coordinates with the hidden Markov model engine.
 
-        # Get the route edges and nodes tables
-        route_edges, route_nodes = self.get_sorted_route_df(route_node_ids)
+        :param lats: The latitudes of the coordinates
+        :param lons: The longitudes of the coordinates
+        :return: The matched edge of every coordinate and the ordered route nodes
+        """
+        with STAGE_SECONDS.time(stage="hmm_match"):
+            return hmm_matching.match(
+                self.area_graph,
+                self.geometries,
+                self.rtree,
+                self.edge_ids,
+                lats,
+                lons,
+                k=self.hmm_candidates,
+                radius=self.hmm_search_radius,
+                bridge_cutoff=self.gap_bridge_cutoff,
+            )
+
+    @property
+    def thinning(self) -> bool:
+        """
+        Check if any thinning step is configured.
 
-        indexed_edge_timestamps = match_timestamps(
-            nearest_edges, route_edges, edge_start_end_timestamps
+        :return: True if points are thinned before matching
+        """
+        return (
+            self.thin_min_distance > 0
+            or self.thin_min_interval > 0
+            or self.thin_stationary_radius > 0
+            or self.thin_tolerance > 0
         )
-        indexed_edge_timestamps = fill_timestamps(
-            indexed_edge_timestamps, len(route_edges.index) - 1
+
+    def thin(
+        self,
+        lats: np.ndarray,
+        lons: np.ndarray,
+        coordinates: list,
+        time_field: str,
+        coordinate_edges: list,
+    ) -> (np.ndarray, np.ndarray):
+        """
+        Select the points to match with the configured THIN_* steps.
+
+        The first and last point of every run on the same road are always kept, so
+        the route stays the same. So are the first and last point on every snapped
+        edge, which the times the edges are entered and left are taken from.
+
+        :param lats: The latitudes of the coordinates
+        :param lons: The longitudes of the coordinates
+        :param coordinates: The coordinates
+        :param time_field: The name of the time field in the coordinates
+        :param coordinate_edges: The nearest edge of every coordinate
+        :return: The indexes of the kept points and the timestamps of all points if
+            they were needed for thinning, else None
+        """
+        timestamps = None
+        if self.thin_min_interval > 0:
+            timestamps = parse_timestamps(
+                [coordinate[time_field] for coordinate in coordinates]
+            )
+        keep = thinning.thin(
+            lats,
+            lons,
+            timestamps,
+            min_distance=self.thin_min_distance,
+            min_interval=self.thin_min_interval,
+            stationary_radius=self.thin_stationary_radius,
+            tolerance=self.thin_tolerance,
         )
-        route = generate_formatted_route(
-            route_node_ids, route_edges, route_nodes, indexed_edge_timestamps
+        keep |= thinning.edge_run_bounds(coordinate_edges, directed=False)
+        keep |= thinning.edge_occurrence_bounds(coordinate_edges)
+        return np.flatnonzero(keep), timestamps
+
+    def map_to_map(
+        self,
+        coordinates: list,
+        longitude_field: str,
+        time_field: str,
+        coordinate_edges: list = None,
+    ) -> CompactRoute:
+        """
+        Map the given coordinates to the given map.
+
+        The matching engine is chosen with MATCH_ENGINE, either "shortest_path" (default)
+        or "hmm". Route edges without a matched timestamp copy the times of their
+        neighbours, or with TIMESTAMP_FILL_MODE "interpolate" get times proportional
+        to their distance along the route.
+
+        Only the first and last point on every snapped edge are matched, the points in
+        between don't change the route or its times. With THIN_* settings the points
+        are thinned further before matching, see thin.
+
+        :param time_field:
+        :param longitude_field:
+        :param coordinates: The coordinates to map
+        :param coordinate_edges: The nearest edge of every coordinate if already snapped
+        :return:
+        """
+        TRACE_POINTS.observe(len(coordinates))
+        lats, lons = self.get_lat_lon_arrays(coordinates, longitude_field)
+        self.require_area(lats, lons)
+        keep = None
+        timestamps = None
+        if self.match_engine != "hmm" or self.thinning:
+            if coordinate_edges is None:
+                coordinate_edges = self.snap(lats, lons)
+            with STAGE_SECONDS.time(stage="thin"):
+                if self.thinning:
+                    keep, timestamps = self.thin(
+                        lats, lons, coordinates, time_field, coordinate_edges
+                    )
+                else:
+                    keep = np.flatnonzero(thinning.edge_run_bounds(coordinate_edges))
+                coordinate_edges = [coordinate_edges[index] for index in keep]
+            lats, lons = lats[keep], lons[keep]
+        match self.match_engine:
+            case "hmm":
+                nearest_edges, route_node_ids = self.match_hmm(lats, lons)
+            case _:
+                nearest_edges, route_node_ids = self.match_shortest_path(
+                    lats, lons, coordinate_edges
+                )
+        KEPT_POINTS.observe(len(nearest_edges))
+        # Get the route edges in order
+        with STAGE_SECONDS.time(stage="route_edges"):
+            route_edges = self.get_route_edges(route_node_ids)
+        ROUTE_EDGES.observe(len(route_edges))
+
+        with STAGE_SECONDS.time(stage="timestamps"):
+            if timestamps is None:
+                timestamps = parse_timestamps(
+                    [coordinate[time_field] for coordinate in coordinates]
+                )
+            edge_start_end_timestamps = get_start_and_end_time_of_edges(
+                timestamps, nearest_edges, keep
+            )
+            nearest_edges = remove_duplicates(nearest_edges)
+            indexed_edge_timestamps = match_timestamps(
+                nearest_edges,
+                self.edge_table.edge_tuples(route_edges),
+                edge_start_end_timestamps,
+            )
+            if self.timestamp_fill_mode == "interpolate":
+                start_times, end_times = interpolate_timestamps(
+                    indexed_edge_timestamps, self.edge_table.length[route_edges]
+                )
+            else:
+                indexed_edge_timestamps = fill_timestamps(
+                    indexed_edge_timestamps, len(route_edges) - 1
+                )
+                start_times, end_times = get_edge_times(
+                    indexed_edge_timestamps, len(route_edges)
+                )
+        # Create the route object from the edge table
+        with STAGE_SECONDS.time(stage="format"):
+            return generate_formatted_route(
+                route_node_ids, self.edge_table, route_edges, start_times, end_times
+            )
+
+    def map_to_map_batch(self, traces: list) -> list:
+        """
+        Map several traces, snapping the coordinates of all of them in one rtree query.
+
+        The traces are matched independently, a trace that fails doesn't fail the others.
+
+        :param traces: List of (coordinates, longitude_field, time_field) tuples
+        :return: The CompactRoute of every trace, or the exception it failed with
+        """
+        coordinate_edges = [None] * len(traces)
+        if self.match_engine != "hmm" or self.thinning:
+            try:
+                arrays = [
+                    self.get_lat_lon_arrays(coordinates, longitude_field)
+                    for coordinates, longitude_field, _ in traces
+                ]
+                if arrays:
+                    # Load the tiles of the whole batch before snapping on them
+                    self.require_area(
+                        np.concatenate([lats for lats, _ in arrays]),
+                        np.concatenate([lons for _, lons in arrays]),
+                    )
+                coordinate_edges = self.snap_traces(arrays)
+            except Exception as e:
+                # Snap every trace on its own, so only the broken ones fail
+                logging.warning(f"Snapping the batch failed: {str(e)}")
+        routes = []
+        for (coordinates, longitude_field, time_field), edges in zip(
+            traces, coordinate_edges
+        ):
+            try:
+                routes.append(
+                    self.map_to_map(coordinates, longitude_field, time_field, edges)
+                )
+            except Exception as e:
+                routes.append(e)
+        return routes
+
+    def extend_session(
+        self,
+        session: MatchSession,
+        coordinates: list,
+        longitude_field: str,
+        time_field: str,
+    ) -> CompactRoute:
+        """
+        Match the next coordinates of a vehicle and emit the edges it has left.
+
+        The coordinates are matched edge by edge onto the end of the pending route, the
+        same way GAP_FILL_MODE "bridge" does for a full trace. Every pending edge except
+        the one the vehicle is on now is emitted, timed by the first and last point on
+        it and interpolated by distance where it had none.
+
+        :param session: The session of the vehicle, updated in place
+        :param coordinates: The next coordinates of the vehicle, in order
+        :param longitude_field: The name of the longitude field in the coordinates
+        :param time_field: The name of the time field in the coordinates
+        :return: The newly finalized route, empty if the vehicle didn't leave an edge
+        """
+        TRACE_POINTS.observe(len(coordinates))
+        lats, lons = self.get_lat_lon_arrays(coordinates, longitude_field)
+        self.require_area(lats, lons)
+        coordinate_edges = self.snap(lats, lons)
+        timestamps = parse_timestamps(
+            [coordinate[time_field] for coordinate in coordinates]
         )
-        del route_edges, route_nodes
-        # Create the route object from the tables
+
+        with STAGE_SECONDS.time(stage="gap_fill"):
+            bridges, skipped = self._walk_session(session, coordinate_edges, timestamps)
+        GAP_BRIDGES.inc(bridges)
+        if skipped:
+            logging.warning(
+                f"Skipped {skipped} roads that were not reachable within "
+                f"{self.gap_bridge_cutoff}m"
+            )
+
+        # The edge the vehicle is on can still get points
+        segment_count = max(len(session.nodes) - 2, 0)
+        with STAGE_SECONDS.time(stage="route_edges"):
+            route_edges = self.get_route_edges(session.nodes)
+        ROUTE_EDGES.observe(segment_count)
+        with STAGE_SECONDS.time(stage="timestamps"):
+            if segment_count:
+                start_times, end_times = interpolate_timestamps(
+                    session.times, self.edge_table.length[route_edges]
+                )
+            else:
+                start_times = end_times = np.empty(0, dtype="datetime64[ns]")
+        with STAGE_SECONDS.time(stage="format"):
+            route = generate_formatted_route(
+                session.nodes,
+                self.edge_table,
+                route_edges,
+                start_times,
+                end_times,
+                segment_count=segment_count,
+            )
+        if segment_count:
+            session.times = {0: session.times[len(session.nodes) - 2]}
+            session.nodes = session.nodes[-2:]
         return route
+
+    def _walk_session(
+        self,
+        session: MatchSession,
+        coordinate_edges: list,
+        timestamps: np.ndarray = None,
+    ) -> (int, int):
+        """
+        Extend the pending route of a session over the snapped edges of its points.
+
+        A road the points move onto is a candidate until they move on from it. Points
+        near an intersection often snap to the other roads at it, so while the points
+        stay on roads at the intersection the last edge ends in, they are all kept as
+        candidates. Once the points move away from the intersection, the candidate the
+        next road continues from is added to the route. When the points come back to the
+        last edge instead, the candidates were noise and are dropped.
+
+        :param session: The session, updated in place
+        :param coordinate_edges: The nearest edge of every coordinate
+        :param timestamps: The time of every coordinate, None if the route isn't timed
+        :return: The number of bridges that were needed and of roads that were skipped
+        """
+        bridges = 0
+        skipped = 0
+        if timestamps is None:
+            timestamps = repeat(None)
+        for edge, timestamp in zip(coordinate_edges, timestamps):
+            edge = edge[:2]
+            if not session.nodes:
+                session.nodes = list(edge)
+                session.times[0] = [timestamp, timestamp]
+                continue
+            candidates = session.candidates
+            if candidates and road(edge) == road(candidates[-1][0]):
+                candidates[-1][1][1] = timestamp
+                continue
+            if road(edge) == road(session.current):
+                candidates.clear()
+                session.times[len(session.nodes) - 2][1] = timestamp
+                continue
+            if candidates:
+                if session.junction is not None and session.junction in edge:
+                    # Still at the intersection, a later road shows which was driven
+                    session.candidates = [
+                        candidate
+                        for candidate in candidates
+                        if road(candidate[0]) != road(edge)
+                    ]
+                    session.candidates.append((edge, [timestamp, timestamp]))
+                    continue
+                bridged = self._take_candidate(session, edge)
+                if bridged is None:
+                    skipped += 1
+                else:
+                    bridges += bridged
+                if road(edge) == road(session.current):
+                    session.times[len(session.nodes) - 2][1] = timestamp
+                    continue
+            current = session.current
+            if current[1] in edge:
+                session.junction = current[1]
+            elif not session.anchored and current[0] in edge:
+                session.junction = current[0]
+            else:
+                session.junction = None
+            session.candidates = [(edge, [timestamp, timestamp])]
+        return bridges, skipped
+
+    def _take_candidate(self, session: MatchSession, following: tuple = None) -> int:
+        """
+        Add the candidate road the vehicle drove to the route of a session.
+
+        That is the last candidate whose far end the following road starts from. When
+        no candidate leads there, they are all dropped and the following road will be
+        bridged to. A single candidate the route is bridged to is dropped as well when
+        the following road starts where the bridge enters it.
+
+        :param session: The session, updated in place, its candidates are cleared
+        :param following: The (u, v) of the road after the candidates, None at the end
+            of the trace, which takes the last candidate
+        :return: Whether a bridge was needed, None if the candidate wasn't reachable
+        """
+        candidates, session.candidates = session.candidates, []
+        junction = session.junction
+        chosen = candidates[-1]
+        if following is not None and junction is not None:
+            chosen = next(
+                (
+                    candidate
+                    for candidate in reversed(candidates)
+                    if (set(candidate[0]) - {junction}) & set(following)
+                ),
+                None,
+            )
+            if chosen is None:
+                return 0
+        candidate, times = chosen
+        current = session.current
+        if following is not None and junction is None and session.anchored:
+            bridged = self.bridge(current, candidate)
+            if bridged is not None and bridged[1][0] in following:
+                return 0
+        if not session.anchored:
+            session.anchored = True
+            if (
+                current[0] in candidate
+                and current[1] not in candidate
+                and self.area_graph.has_edge(current[1], current[0])
+            ):
+                # The route continues from the start of the first edge, so it was
+                # driven reversed
+                session.nodes = [current[1], current[0]]
+                current = session.current
+        step = self.advance(current, candidate)
+        if step is None:
+            return None
+        nodes, _, bridged = step
+        session.nodes += nodes
+        session.times[len(session.nodes) - 2] = times
+        return bridged
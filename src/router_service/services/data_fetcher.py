@@ -2,20 +2,44 @@
 Handles API requests for fetching data.
 """
 import logging
+import os
 
 import requests
+from requests.adapters import HTTPAdapter
+from src.router_service.helpers.cache import TTLCache
+from src.router_service.helpers.metrics import CACHE_REQUESTS
 from src.router_service.models.price_model import PriceModel
 from src.router_service.models.vehicle import Vehicle, VehicleInt
 
+# Seconds to wait for the other services to connect and to respond
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 5))
 
-def get_prices(payment_service_url) -> PriceModel:
+
+def create_session(pool_size: int = 10) -> requests.Session:
+    """
+    Create a session that keeps connections to the other services alive.
+
+    :param pool_size: Number of connections kept per host
+    :return: The session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_prices(payment_service_url, session: requests.Session = None) -> PriceModel:
     """
     Get the price model from the payment service.
 
+    :param payment_service_url: Payment service url
+    :param session: Session to send the request with, a new connection if not given
     :return: Price model
     """
+    http = session or requests
     try:
-        response = requests.get(payment_service_url)
+        response = http.get(payment_service_url, timeout=HTTP_TIMEOUT)
         response.raise_for_status()
         price_model = PriceModel.parse_obj(response.json())
     except requests.exceptions.RequestException as e:
@@ -24,16 +48,32 @@ def get_prices(payment_service_url) -> PriceModel:
     return price_model
 
 
-def get_vehicle(car_service_url, vehicle_id) -> VehicleInt:
+def get_vehicle(
+    car_service_url,
+    vehicle_id,
+    session: requests.Session = None,
+    cache: TTLCache = None,
+) -> VehicleInt:
     """
     Get the vehicle from the car service.
 
     :param car_service_url: Car service url
     :param vehicle_id: Vehicle id
+    :param session: Session to send the request with, a new connection if not given
+    :param cache: Cache of vehicles by id, only successful lookups are cached
     :return: Vehicle model
     """
+    if cache is not None:
+        vehicle = cache.get(vehicle_id)
+        if vehicle is not None:
+            CACHE_REQUESTS.inc(cache="vehicle", result="hit")
+            return vehicle
+        CACHE_REQUESTS.inc(cache="vehicle", result="miss")
+    http = session or requests
     try:
-        response = requests.get(car_service_url, params={"vehicleId": vehicle_id})
+        response = http.get(
+            car_service_url, params={"vehicleId": vehicle_id}, timeout=HTTP_TIMEOUT
+        )
         response.raise_for_status()
         vehicle = Vehicle.parse_obj(response.json())
         vehicle = VehicleInt(
@@ -44,4 +84,6 @@ def get_vehicle(car_service_url, vehicle_id) -> VehicleInt:
     except requests.exceptions.RequestException as e:
         logging.error(f"Could not get vehicle with id {vehicle_id} from car service.")
         raise e
+    if cache is not None:
+        cache.put(vehicle_id, vehicle)
     return vehicle
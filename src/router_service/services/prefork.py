@@ -0,0 +1,175 @@
+"""
+Runs consumers in children forked from a process that already loaded the graph.
+"""
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+import psutil
+from src.router_service.helpers.memory import process_memory
+from src.router_service.helpers.metrics import REGISTRY
+
+
+class Prefork:
+    """
+    Forks consuming children that share the graph of the parent copy-on-write.
+
+    Load and freeze the graph before starting, so the collector never writes to the
+    shared pages. Children that exit are forked again from the same parent.
+
+    The children send the metrics they recorded to the parent, which merges them into
+    its registry, so the metrics endpoint of the parent covers all consumers.
+    """
+
+    def __init__(
+        self,
+        child_main,
+        children: int,
+        report_interval: float = 60,
+        metrics_interval: float = 5,
+    ):
+        """
+        Create the supervisor.
+
+        :param child_main: Function run in every child with the child index, it should
+            consume until the process is stopped
+        :param children: Number of children
+        :param report_interval: Seconds between memory reports, 0 disables them
+        :param metrics_interval: Seconds between sending the metrics of a child to the
+            parent, 0 disables it
+        """
+        self.child_main = child_main
+        self.children = children
+        self.report_interval = report_interval
+        self.metrics_interval = metrics_interval
+        self._context = multiprocessing.get_context("fork")
+        self._metrics = self._context.Queue() if metrics_interval > 0 else None
+        self._processes = [None] * children
+        self._stopped = False
+
+    def _child(self, index: int):
+        """
+        Run a child, sending its metrics to the parent while it consumes.
+
+        :param index: Index of the child
+        """
+        if self._metrics is not None:
+            # Forked children start with a copy of the metrics of the parent
+            REGISTRY.drain()
+            threading.Thread(
+                target=self._send_metrics, name="metrics", daemon=True
+            ).start()
+        self.child_main(index)
+
+    def _send_metrics(self):
+        while True:
+            time.sleep(self.metrics_interval)
+            self._metrics.put(REGISTRY.drain())
+
+    def merge_metrics(self, timeout: float = 0) -> int:
+        """
+        Merge the metrics the children sent into the registry of this process.
+
+        :param timeout: Seconds to wait for the first metrics
+        :return: The number of merged reports
+        """
+        merged = 0
+        while self._metrics is not None:
+            try:
+                drained = self._metrics.get(block=timeout > 0, timeout=timeout)
+            except queue.Empty:
+                break
+            REGISTRY.merge(drained)
+            merged += 1
+            timeout = 0
+        return merged
+
+    def _fork(self, index: int):
+        """
+        Fork a child.
+
+        :param index: Index of the child
+        """
+        process = self._context.Process(
+            target=self._child, args=(index,), name=f"router-{index}", daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+
+    def start(self):
+        """
+        Fork all children.
+        """
+        for index in range(self.children):
+            self._fork(index)
+        logging.warning(f"Forked {self.children} consumers...")
+
+    def memory_report(self) -> list:
+        """
+        Get the memory of every running child.
+
+        :return: List of dicts with the child index, pid and process_memory values
+        """
+        report = []
+        for index, process in enumerate(self._processes):
+            if process is None or not process.is_alive():
+                continue
+            try:
+                report.append(
+                    {"index": index, "pid": process.pid, **process_memory(process.pid)}
+                )
+            except psutil.Error:
+                continue
+        return report
+
+    def log_memory(self):
+        """
+        Log the memory of the parent and every child in MB.
+        """
+        parent = process_memory()
+        logging.warning(
+            f"Parent memory: rss {parent['rss'] / 2**20:.0f} MB, "
+            f"unique {parent['uss'] / 2**20:.0f} MB"
+        )
+        for child in self.memory_report():
+            logging.warning(
+                f"Consumer {child['index']} memory: rss {child['rss'] / 2**20:.0f} MB, "
+                f"unique {child['uss'] / 2**20:.0f} MB, "
+                f"shared {child['shared'] / 2**20:.0f} MB"
+            )
+
+    def supervise(self, poll_interval: float = 1):
+        """
+        Fork children again when they exit and report memory, until stopped.
+
+        :param poll_interval: Seconds between checks
+        """
+        next_report = time.monotonic() + self.report_interval
+        while not self._stopped:
+            for index, process in enumerate(self._processes):
+                if not self._stopped and not process.is_alive():
+                    logging.warning(
+                        f"Consumer {index} exited with {process.exitcode}, forking again"
+                    )
+                    self._fork(index)
+            if self.report_interval > 0 and time.monotonic() >= next_report:
+                self.log_memory()
+                next_report = time.monotonic() + self.report_interval
+            if self._metrics is not None:
+                self.merge_metrics(timeout=poll_interval)
+            else:
+                time.sleep(poll_interval)
+
+    def stop(self):
+        """
+        Stop supervising and terminate the children.
+        """
+        self._stopped = True
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            if process is not None:
+                process.join()
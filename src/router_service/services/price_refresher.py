@@ -0,0 +1,81 @@
+"""
+Keeps the pricer up to date with the price model of the payment service.
+"""
+import logging
+import threading
+
+from src.router_service.helpers.price_helpers import price_model_version
+from src.router_service.services.pricer import Pricer
+
+
+class PriceRefresher:
+    """
+    Keeps the pricer up to date with the price model.
+
+    The price model is fetched periodically on a background thread, and a new Pricer
+    is swapped in when it changed. Readers take the current pricer with a single
+    attribute read, so pricing never waits for the payment service or for a Pricer to
+    be built.
+    """
+
+    def __init__(self, fetch_prices, interval: float):
+        """
+        Create the refresher, call refresh for the first price model.
+
+        :param fetch_prices: Function returning the current PriceModel
+        :param interval: Seconds between refreshes, 0 disables refreshing
+        """
+        self.fetch_prices = fetch_prices
+        self.interval = interval
+        self.pricer = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def refresh(self) -> bool:
+        """
+        Fetch the price model and swap in a new Pricer if its version changed.
+
+        :return: True if the pricer was replaced
+        """
+        price_model = self.fetch_prices()
+        current = self.pricer
+        if current is not None and current.version == price_model_version(price_model):
+            return False
+        # Built completely before it's assigned, the assignment itself is atomic
+        self.pricer = Pricer(price_model=price_model)
+        if current is not None:
+            logging.warning(
+                f"Price model changed from {current.version} to {self.pricer.version}"
+            )
+        return True
+
+    def run(self):
+        """
+        Refresh every interval until stopped, keeping the old pricer on errors.
+        """
+        while not self._stopped.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.warning(f"Refreshing the price model failed: {str(e)}")
+
+    def start(self):
+        """
+        Start refreshing on a daemon thread.
+        """
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self.run, name="price-refresher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop refreshing, start can be called again afterwards.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -1,13 +1,17 @@
 """
 Responsible for calculating segment prices.
 """
+import threading
+
+import numpy as np
 from src.router_service.helpers.price_helpers import (
     get_price_mod_for,
-    int_to_percent_increase_multiplier,
+    price_model_version,
+    round_prices,
     to_int_percent,
 )
+from src.router_service.models.compact_route import CompactRoute
 from src.router_service.models.price_model import PriceModel
-from src.router_service.models.route_models import Route
 from src.router_service.models.vehicle import VehicleInt
 
 
@@ -18,6 +22,7 @@ class Pricer:
 
     def __init__(self, price_model: PriceModel):
         self.price_model = price_model
+        self.version = price_model_version(price_model)
         self.base_road_price = 20  # in cents
         self.highway_lookup = {}
         self.boundary_lookup = {}
@@ -50,7 +55,92 @@ class Pricer:
                         price.valueDescription
                     )
 
-    def calculate_price(self, route: Route, vehicle: VehicleInt):
+        # Dense modifier tables, indexed by highway code and by hour
+        self.rush_mods = np.array(
+            [self.rush_lookup.get(str(hour), 0) for hour in range(24)], dtype=np.float64
+        )
+        self.highway_codes = {}
+        self.highway_mods = np.zeros(0, dtype=np.float64)
+        self._highway_lock = threading.Lock()
+        for highway in self.highway_lookup:
+            self.get_highway_code(highway)
+
+    def get_highway_code(self, highway) -> int:
+        """
+        Get the index of a highway value in the highway modifier table.
+
+        Lists of highway types, as osmnx gives for merged ways, get their own entry with
+        the average modifier of the types. The pricer is shared by the worker threads,
+        new entries are added under a lock and the table is extended before the code is
+        handed out.
+
+        :param highway: Highway type or list of highway types
+        :return: The index in highway_mods
+        """
+        key = tuple(highway) if type(highway) is list else highway
+        code = self.highway_codes.get(key)
+        if code is not None:
+            return code
+        with self._highway_lock:
+            code = self.highway_codes.get(key)
+            if code is None:
+                code = len(self.highway_mods)
+                self.highway_mods = np.append(
+                    self.highway_mods, get_price_mod_for(highway, self.highway_lookup)
+                )
+                self.highway_codes[key] = code
+        return code
+
+    def price_segments(
+        self,
+        lengths: np.ndarray,
+        highway_codes: np.ndarray,
+        hours: np.ndarray,
+        vehicle: VehicleInt,
+    ) -> np.ndarray:
+        """
+        Calculate the price of every segment of a route at once.
+
+        :param lengths: Segment lengths
+        :param highway_codes: Highway codes of the segments, as returned by get_highway_code
+        :param hours: The hour of the day of every segment
+        :param vehicle: The vehicle
+        :return: Segment prices in euros
+        """
+        vehicle_classification_mod, fuel_type_mod = self.get_vehicle_mods(vehicle)
+        return self._price_segments(
+            lengths, highway_codes, hours, vehicle_classification_mod, fuel_type_mod
+        )
+
+    def get_vehicle_mods(self, vehicle: VehicleInt) -> (float, float):
+        """
+        Get the modifiers of a vehicle.
+
+        :param vehicle: The vehicle
+        :return: The vehicle classification and fuel type modifiers
+        """
+        return (
+            get_price_mod_for(
+                [vehicle.vehicleClassification], self.vehicle_classification_lookup
+            ),
+            get_price_mod_for([vehicle.fuelType], self.fuel_type_lookup),
+        )
+
+    def _price_segments(
+        self, lengths, highway_codes, hours, vehicle_classification_mod, fuel_type_mod
+    ) -> np.ndarray:
+        # Same order of operations as the per segment formula, so results are identical
+        total_mod = (
+            self.highway_mods[highway_codes]
+            + vehicle_classification_mod
+            + fuel_type_mod
+            + self.rush_mods[hours]
+            + 100
+        ) / 100.0
+        # Calculations use cents, end result want euro's
+        return round_prices(self.base_road_price * lengths * (total_mod + 1), 2) / 100
+
+    def calculate_price(self, route: CompactRoute, vehicle: VehicleInt):
         """
         Calculate the price of a route for the given vehicle.
 
@@ -58,11 +148,6 @@ class Pricer:
         :param vehicle: The vehicle
         :return: The route with prices added
         """
-        vehicle_classification_mod = get_price_mod_for(
-            [vehicle.vehicleClassification], self.vehicle_classification_lookup
-        )
-        fuel_type_mod = get_price_mod_for([vehicle.fuelType], self.fuel_type_lookup)
-
         """
         segment_price =
             base_road_price (set to something)
@@ -73,19 +158,73 @@ class Pricer:
                 + fuelType lookup Vehicle.fuelType in {type: price_mod}
                 + rushPrice lookup way.time.hour in {hour: price_per_km})
         """
-        for segment in route.segments:
-            distance = segment.way.length
-            highway_mod = get_price_mod_for(segment.way.highway, self.highway_lookup)
-            # TODO: boundary_mod = get_price_mod_for(segment.way.boundary, self.boundary_lookup)
-            rush_hour_mod = self.rush_lookup.get(str(segment.time.hour), 0)
-            total_mod = int_to_percent_increase_multiplier(
-                highway_mod + vehicle_classification_mod + fuel_type_mod + rush_hour_mod
-            )
-            # Calculations use cents, end result want euro's
-            segment.price = (
-                round(self.base_road_price * distance * (total_mod + 1), 2) / 100
-            )
-
-        route.price_total = round(sum([segment.price for segment in route.segments]), 2)
+        # TODO: boundary_mod = get_price_mod_for(segment.way.boundary, self.boundary_lookup)
+        route.prices = self.price_segments(
+            route.lengths,
+            self.get_highway_codes(route.highways),
+            self.get_hours(route.times),
+            vehicle,
+        )
+        return self._finish(route, vehicle)
+
+    def calculate_prices(self, routes: list, vehicles: list) -> list:
+        """
+        Calculate the prices of several routes at once.
+
+        The segments of all routes are priced with one vectorized calculation, with the
+        same results as calculate_price per route.
+
+        :param routes: The routes
+        :param vehicles: The vehicle of every route
+        :return: The routes with prices added
+        """
+        if not routes:
+            return routes
+        counts = [len(route) for route in routes]
+        mods = np.array([self.get_vehicle_mods(vehicle) for vehicle in vehicles])
+        times = np.concatenate([route.times for route in routes])
+        prices = self._price_segments(
+            np.concatenate([route.lengths for route in routes]),
+            self.get_highway_codes(
+                [highway for route in routes for highway in route.highways]
+            ),
+            self.get_hours(times),
+            np.repeat(mods[:, 0], counts),
+            np.repeat(mods[:, 1], counts),
+        )
+        offsets = np.cumsum([0] + counts)
+        for route, vehicle, start, end in zip(routes, vehicles, offsets, offsets[1:]):
+            route.prices = prices[start:end]
+            self._finish(route, vehicle)
+        return routes
+
+    def get_highway_codes(self, highways) -> np.ndarray:
+        """
+        Get the highway codes of segments.
+
+        :param highways: The highway value of every segment
+        :return: Array of codes, as returned by get_highway_code
+        """
+        return np.fromiter(
+            (self.get_highway_code(highway) for highway in highways),
+            dtype=np.intp,
+            count=len(highways),
+        )
+
+    @staticmethod
+    def get_hours(times: np.ndarray) -> np.ndarray:
+        """
+        Get the hour of the day of times.
+
+        :param times: datetime64 array
+        :return: Array of hours
+        """
+        return (times - times.astype("datetime64[D]")).astype("timedelta64[h]").astype(
+            np.intp
+        )
+
+    def _finish(self, route: CompactRoute, vehicle: VehicleInt) -> CompactRoute:
+        route.price_total = round(sum(route.prices.tolist()), 2)
         route.vehicle_id = vehicle.id
+        route.price_version = self.version
         return route
@@ -1,14 +1,21 @@
 """
 The receiver for masstransit.
 """
-import gc
 import logging
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 from json import loads, JSONDecodeError
 from time import sleep
 
 import pika.exceptions
 from masstransitpython import RabbitMQReceiver
+from src.router_service.helpers.metrics import BATCH_MESSAGES, MESSAGES, STAGE_SECONDS
+from src.router_service.helpers.profiling import Profiler
+from src.router_service.library_overrides.RabbitMQReceiver import (
+    RabbitMQReceiver as AckingRabbitMQReceiver,
+)
 from src.router_service.services.sender import Sender
+from src.router_service.services.worker_pool import WorkerPool
 
 
 class Receiver:
@@ -16,11 +23,35 @@ class Receiver:
     The receiver for masstransit.
     """
 
-    def __init__(self, conf, exchange, handler_func, sender: Sender = None):
+    def __init__(
+        self,
+        conf,
+        exchange,
+        handler_func,
+        sender: Sender = None,
+        pool: WorkerPool = None,
+        max_in_flight: int = 1,
+        profiler: Profiler = None,
+        batch_func=None,
+        batch_size: int = 1,
+        batch_wait: float = 0.05,
+    ):
         self.sender = sender
         self.handler_func = handler_func
         self.conf = conf
         self.exchange = exchange
+        # With a pool messages are handled by the workers and acked after publishing
+        self.pool = pool
+        self.max_in_flight = max_in_flight
+        # Profiles sampled and slow messages when PROFILE_* is configured
+        self.profiler = profiler
+        # With a batch function messages are collected and handled together, the
+        # function gets a list of messages and returns a result or exception for each
+        self.batch_func = batch_func
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._batch = []
+        self._batch_timer = None
 
     def handler(
             self,
@@ -45,22 +76,206 @@ class Receiver:
                 print(f'Decoding JSON has failed with error: {str(e)}')
                 raise e
             try:
-                val = self.handler_func(msg["message"])
+                if self.profiler:
+                    val = self.profiler.run(self.handler_func, msg["message"])
+                else:
+                    val = self.handler_func(msg["message"])
             except Exception as e:
                 logging.error(f"Error in handler: {str(e)}")
                 raise e
-            if self.sender:
+            if self.sender and val is not None:
                 try:
-                    self.sender.send_message(body=body, message=val)
+                    with STAGE_SECONDS.time(stage="publish"):
+                        self.sender.send_message(body=body, message=val)
                 except Exception as e:
                     logging.error(f"Error when sending: {str(e)}")
                     raise e
+                MESSAGES.inc(result="ok")
                 del val
             else:
+                MESSAGES.inc(result="ok")
                 return val
         except Exception:
-            pass
-        gc.collect()
+            MESSAGES.inc(result="error")
+
+    def dispatch(
+            self,
+            ch,
+            method,
+            properties,
+            body,
+    ):
+        """
+        Trigger this when a message is consumed from the queue in pool mode.
+
+        The message is handled on a worker, the result is published and the message
+        acknowledged on the connection thread once the worker is done.
+
+        :param ch:
+        :param method:
+        :param properties:
+        :param body:
+        :return:
+        """
+        try:
+            msg = loads(body.decode())
+        except Exception as e:  # includes simplejson.decoder.JSONDecodeError
+            logging.error(f"Decoding JSON has failed with error: {str(e)}")
+            MESSAGES.inc(result="error")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            return
+        try:
+            future = self.pool.submit(msg["message"])
+        except Exception as e:
+            logging.error(f"Could not start route workers: {str(e)}")
+            MESSAGES.inc(result="requeued")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            return
+        future.add_done_callback(
+            lambda done: ch.connection.add_callback_threadsafe(
+                partial(
+                    self.complete,
+                    ch,
+                    method.delivery_tag,
+                    body,
+                    done,
+                    method.redelivered,
+                )
+            )
+        )
+
+    def complete(self, ch, delivery_tag, body, future, redelivered=False):
+        """
+        Publish the result of a worker and acknowledge its message.
+
+        Failed messages are rejected without requeueing, like they were dropped before.
+        Messages that failed because a worker died are requeued, unless they were
+        redelivered already, a message that kills its worker again is dropped.
+
+        :param ch: The channel the message was consumed on
+        :param delivery_tag: The delivery tag of the message
+        :param body: The consumed message
+        :param future: The finished future of the worker
+        :param redelivered: Whether the message was requeued before
+        """
+        try:
+            val = future.result()
+        except BrokenProcessPool as e:
+            if redelivered:
+                logging.error(f"Dropping message, a worker died again: {str(e)}")
+                MESSAGES.inc(result="error")
+                ch.basic_nack(delivery_tag=delivery_tag, requeue=False)
+            else:
+                logging.error(f"A worker died, requeueing message: {str(e)}")
+                MESSAGES.inc(result="requeued")
+                ch.basic_nack(delivery_tag=delivery_tag, requeue=True)
+            return
+        except Exception as e:
+            logging.error(f"Error in handler: {str(e)}")
+            MESSAGES.inc(result="error")
+            ch.basic_nack(delivery_tag=delivery_tag, requeue=False)
+            return
+        try:
+            if self.sender and val is not None:
+                with STAGE_SECONDS.time(stage="publish"):
+                    self.sender.send_message(body=body, message=val)
+        except Exception as e:
+            logging.error(f"Error when sending: {str(e)}")
+            MESSAGES.inc(result="error")
+            ch.basic_nack(delivery_tag=delivery_tag, requeue=False)
+            return
+        MESSAGES.inc(result="ok")
+        ch.basic_ack(delivery_tag=delivery_tag)
+
+    def collect(
+            self,
+            ch,
+            method,
+            properties,
+            body,
+    ):
+        """
+        Trigger this when a message is consumed from the queue in batch mode.
+
+        Messages are handled once batch_size are collected or batch_wait seconds after
+        the first one arrived, whichever comes first.
+
+        :param ch:
+        :param method:
+        :param properties:
+        :param body:
+        :return:
+        """
+        try:
+            msg = loads(body.decode())
+        except Exception as e:  # includes simplejson.decoder.JSONDecodeError
+            logging.error(f"Decoding JSON has failed with error: {str(e)}")
+            MESSAGES.inc(result="error")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            return
+        self._batch.append((method.delivery_tag, body, msg["message"]))
+        if len(self._batch) >= self.batch_size:
+            self.flush(ch)
+        elif self._batch_timer is None:
+            self._batch_timer = ch.connection.call_later(
+                self.batch_wait, partial(self._flush_on_timer, ch)
+            )
+
+    def _flush_on_timer(self, ch):
+        self._batch_timer = None
+        self.flush(ch)
+
+    def flush(self, ch):
+        """
+        Handle the collected messages, publish their results and acknowledge them.
+
+        Failed messages are rejected without requeueing, the others are acknowledged
+        with a single ack when the whole batch succeeded.
+
+        :param ch: The channel the messages were consumed on
+        """
+        if self._batch_timer is not None:
+            ch.connection.remove_timeout(self._batch_timer)
+            self._batch_timer = None
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        BATCH_MESSAGES.observe(len(batch))
+        try:
+            results = self.batch_func([message for _, _, message in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        errors = [val if isinstance(val, Exception) else None for val in results]
+        for error in errors:
+            if error is not None:
+                logging.error(f"Error in handler: {str(error)}")
+
+        sending = [
+            index
+            for index, val in enumerate(results)
+            if errors[index] is None and val is not None
+        ]
+        if self.sender and sending:
+            with STAGE_SECONDS.time(stage="publish"):
+                sent = self.sender.send_messages(
+                    [(batch[index][1], results[index]) for index in sending]
+                )
+            for index, error in zip(sending, sent):
+                if error is not None:
+                    logging.error(f"Error when sending: {str(error)}")
+                    errors[index] = error
+
+        if not any(errors):
+            MESSAGES.inc(len(batch), result="ok")
+            ch.basic_ack(delivery_tag=batch[-1][0], multiple=True)
+            return
+        for (delivery_tag, _, _), error in zip(batch, errors):
+            if error is None:
+                MESSAGES.inc(result="ok")
+                ch.basic_ack(delivery_tag=delivery_tag)
+            else:
+                MESSAGES.inc(result="error")
+                ch.basic_nack(delivery_tag=delivery_tag, requeue=False)
 
     def start(self):
         """
@@ -73,7 +288,17 @@ class Receiver:
         attempts = 0
         while attempts < 10:
             try:
-                receiver = RabbitMQReceiver(self.conf, self.exchange)
+                if self.pool:
+                    receiver = AckingRabbitMQReceiver(
+                        self.conf, self.exchange, prefetch_count=self.max_in_flight
+                    )
+                elif self.batch_func:
+                    # Only the collected batch is unacknowledged, so it can be acked at once
+                    receiver = AckingRabbitMQReceiver(
+                        self.conf, self.exchange, prefetch_count=self.batch_size
+                    )
+                else:
+                    receiver = RabbitMQReceiver(self.conf, self.exchange)
                 break
             # TODO: Pretty sure this isn't the right error to catch...
             except pika.exceptions.ConnectionWrongStateError as e:
@@ -83,5 +308,10 @@ class Receiver:
                 if attempts >= 10:
                     raise e
 
-        receiver.add_on_message_callback(self.handler)
+        if self.pool:
+            receiver.add_on_message_callback(self.dispatch)
+        elif self.batch_func:
+            receiver.add_on_message_callback(self.collect)
+        else:
+            receiver.add_on_message_callback(self.handler)
         receiver.start_consuming()
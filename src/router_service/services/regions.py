@@ -0,0 +1,281 @@
+"""
+Routes traces of several regions, each on the graph of its own region.
+"""
+import logging
+import time
+from collections import OrderedDict
+
+import numpy as np
+import osmnx
+from src.router_service.helpers import memory
+from src.router_service.helpers.metrics import (
+    REGION_LOADS,
+    REGIONS_UNLOADED,
+    STAGE_SECONDS,
+)
+from src.router_service.models.compact_route import CompactRoute
+from src.router_service.models.match_session import MatchSession
+from src.router_service.models.region import Region
+from src.router_service.services.calculator import Calculator
+
+
+class RegionDispatcher:
+    """
+    A calculator per region, loaded when the first trace of the region arrives.
+
+    A trace goes to the region whose bounds contain most of its first points, the
+    smallest one if several contain as many. Calculators that weren't used for the
+    idle ttl are unloaded, except preloaded ones. It is used like a single Calculator.
+    """
+
+    def __init__(
+        self,
+        regions: list,
+        idle_ttl: float,
+        dispatch_points: int = 5,
+        clock=time.monotonic,
+        factory=Calculator,
+    ):
+        """
+        Create the dispatcher, no region is loaded yet.
+
+        :param regions: The regions, place regions get the bounds of their geocoded area
+        :param idle_ttl: Seconds a region is kept loaded after its last trace, 0 keeps it
+        :param dispatch_points: Number of first points of a trace the region is chosen by
+        :param clock: Function returning the current time in seconds
+        :param factory: Function creating the calculator of a region
+        """
+        self.regions = OrderedDict((region.name, region) for region in regions)
+        self.idle_ttl = idle_ttl
+        self.dispatch_points = dispatch_points
+        self.clock = clock
+        self.factory = factory
+        self._calculators = OrderedDict()
+        self._last_used = {}
+        # Preloaded regions, never unloaded
+        self._pinned = set()
+        self.loads = 0
+        self.unloads = 0
+        for region in regions:
+            if region.bounds is None:
+                self.geocode(region)
+
+    def __len__(self):
+        """
+        Get the number of loaded regions.
+
+        :return: The number of regions
+        """
+        return len(self._calculators)
+
+    @staticmethod
+    def geocode(region: Region) -> bool:
+        """
+        Set the bounds of a place region to the bounds of the geocoded place.
+
+        :param region: The region, updated in place
+        :return: True if the place was found
+        """
+        Calculator.configure_osmnx()
+        try:
+            west, south, east, north = osmnx.geocode_to_gdf(region.value).total_bounds
+        except Exception as e:
+            logging.warning(f"Could not geocode region {region.name}: {e}")
+            return False
+        region.bounds = (north, south, east, west)
+        return True
+
+    def region_for(self, lats: np.ndarray, lons: np.ndarray) -> Region:
+        """
+        Choose the region of a trace.
+
+        :param lats: The latitudes of the trace
+        :param lons: The longitudes of the trace
+        :return: The region
+        """
+        lats, lons = lats[: self.dispatch_points], lons[: self.dispatch_points]
+        best, best_count = None, 0
+        for region in self.regions.values():
+            if region.bounds is None and not self.geocode(region):
+                continue
+            count = region.count_inside(lats, lons)
+            if count > best_count or (
+                count and count == best_count and region.area() < best.area()
+            ):
+                best, best_count = region, count
+        if best is None:
+            raise ValueError("The trace is outside of every region")
+        return best
+
+    def preload(self, names: list = None):
+        """
+        Load regions now instead of on their first trace, they are never unloaded.
+
+        Call at startup, a region loaded on demand blocks the consumer while it loads.
+
+        :param names: The names of the regions, every region if not given
+        """
+        for name in names if names is not None else list(self.regions):
+            if name not in self.regions:
+                raise ValueError(f"Unknown region to preload: {name}")
+            self.calculator(name)
+            self._pinned.add(name)
+
+    def calculator(self, name: str) -> Calculator:
+        """
+        Get the calculator of a region, loading it if needed.
+
+        Regions that were idle for the ttl are unloaded first.
+
+        :param name: The name of the region
+        :return: The calculator
+        """
+        self.unload_idle(keep=name)
+        calculator = self._calculators.get(name)
+        if calculator is None:
+            logging.warning(f"Loading region {name}...")
+            with STAGE_SECONDS.time(stage="region_load"):
+                calculator = self.factory(region=self.regions[name])
+            self._calculators[name] = calculator
+            self.loads += 1
+            REGION_LOADS.inc(region=name)
+            # Keep the collector away from the new graph without a full collection
+            memory.freeze_new()
+        self._calculators.move_to_end(name)
+        self._last_used[name] = self.clock()
+        return calculator
+
+    def unload_idle(self, keep: str = None):
+        """
+        Unload the regions that weren't used for the idle ttl.
+
+        :param keep: Name of a region that is never unloaded
+        """
+        if self.idle_ttl <= 0:
+            return
+        idle_before = self.clock() - self.idle_ttl
+        unloaded = False
+        for name in list(self._calculators):
+            if self._last_used[name] > idle_before:
+                # The calculators are in least recently used order
+                break
+            if name == keep or name in self._pinned:
+                continue
+            del self._calculators[name], self._last_used[name]
+            self.unloads += 1
+            unloaded = True
+            REGIONS_UNLOADED.inc(region=name)
+            logging.warning(f"Unloaded region {name}, it was idle")
+        if unloaded:
+            # The graph was frozen, let the collector free what reference counting can't
+            memory.unfreeze()
+
+    def _dispatch(self, coordinates: list, longitude_field: str) -> Region:
+        lats, lons = Calculator.get_lat_lon_arrays(
+            coordinates[: self.dispatch_points], longitude_field
+        )
+        return self.region_for(lats, lons)
+
+    def map_to_map(
+        self,
+        coordinates: list,
+        longitude_field: str,
+        time_field: str,
+    ) -> CompactRoute:
+        """
+        Map the coordinates on the graph of their region, see Calculator.map_to_map.
+
+        :param coordinates: The coordinates to map
+        :param longitude_field: The name of the longitude field in the coordinates
+        :param time_field: The name of the time field in the coordinates
+        :return: The route
+        """
+        region = self._dispatch(coordinates, longitude_field)
+        return self.calculator(region.name).map_to_map(
+            coordinates, longitude_field, time_field
+        )
+
+    def map_to_map_batch(self, traces: list) -> list:
+        """
+        Map several traces, the traces of every region as one batch on its calculator.
+
+        :param traces: List of (coordinates, longitude_field, time_field) tuples
+        :return: The CompactRoute of every trace, or the exception it failed with
+        """
+        routes = [None] * len(traces)
+        by_region = OrderedDict()
+        for index, (coordinates, longitude_field, _) in enumerate(traces):
+            try:
+                region = self._dispatch(coordinates, longitude_field)
+            except Exception as e:
+                routes[index] = e
+                continue
+            by_region.setdefault(region.name, []).append(index)
+        for name, indexes in by_region.items():
+            try:
+                results = self.calculator(name).map_to_map_batch(
+                    [traces[index] for index in indexes]
+                )
+            except Exception as e:
+                results = [e] * len(indexes)
+            for index, result in zip(indexes, results):
+                routes[index] = result
+        return routes
+
+    def extend_session(
+        self,
+        session: MatchSession,
+        coordinates: list,
+        longitude_field: str,
+        time_field: str,
+    ) -> CompactRoute:
+        """
+        Match the next coordinates of a vehicle on the graph of their region.
+
+        See Calculator.extend_session. When the vehicle enters another region its
+        pending route is dropped, the nodes of a graph can't be bridged to those of
+        another one.
+
+        :param session: The session of the vehicle, updated in place
+        :param coordinates: The next coordinates of the vehicle, in order
+        :param longitude_field: The name of the longitude field in the coordinates
+        :param time_field: The name of the time field in the coordinates
+        :return: The newly finalized route
+        """
+        region = self._dispatch(coordinates, longitude_field)
+        if session.region != region.name:
+            if session.nodes:
+                logging.warning(
+                    f"Vehicle moved from region {session.region} to {region.name}, "
+                    f"dropping its pending route"
+                )
+            session.reset()
+            session.region = region.name
+        return self.calculator(region.name).extend_session(
+            session, coordinates, longitude_field, time_field
+        )
+
+    def stats(self) -> dict:
+        """
+        Get the counters and the caches of the loaded regions.
+
+        :return: Dict with regions, loaded, loads, unloads and the stats of every loaded
+            region
+        """
+        return {
+            "regions": len(self.regions),
+            "loaded": len(self._calculators),
+            "loads": self.loads,
+            "unloads": self.unloads,
+            "calculators": {
+                name: {
+                    "bridge_cache": calculator.bridge_cache.stats(),
+                    "tiles": (
+                        calculator.tiles.stats()
+                        if calculator.tiles is not None
+                        else None
+                    ),
+                }
+                for name, calculator in self._calculators.items()
+            },
+        }
@@ -3,14 +3,20 @@ Handler for route messages.
 """
 import logging
 import os
+from functools import partial
 from time import sleep
 
 import requests.exceptions
 import src.router_service.services.data_fetcher as data_fetcher
-from src.router_service.helpers.helpers import remove_way_id_lists
+from src.router_service.helpers import memory
+from src.router_service.helpers.cache import TTLCache
+from src.router_service.helpers.metrics import STAGE_SECONDS
+from src.router_service.models.region import Region
 from src.router_service.models.vehicle import VehicleInt
 from src.router_service.services.calculator import Calculator
-from src.router_service.services.pricer import Pricer
+from src.router_service.services.price_refresher import PriceRefresher
+from src.router_service.services.regions import RegionDispatcher
+from src.router_service.services.sessions import SessionStore
 
 
 class RouteHandler:
@@ -21,18 +27,97 @@ class RouteHandler:
     def __init__(self):
         self.PAYMENT_SERVICE_URL = os.environ.get("PAYMENT_SERVICE_URL")
         self.CAR_SERVICE_URL = os.environ.get("CAR_SERVICE_URL")
+        self.HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 10))
+        self.VEHICLE_CACHE_SIZE = int(os.environ.get("VEHICLE_CACHE_SIZE", 10000))
+        self.VEHICLE_CACHE_TTL = float(os.environ.get("VEHICLE_CACHE_TTL", 3600))
+        # Seconds between price model refreshes, 0 only fetches it at startup
+        self.PRICE_REFRESH_INTERVAL = float(
+            os.environ.get("PRICE_REFRESH_INTERVAL", 300)
+        )
+        # Match every message onto the route of its vehicle and only send new segments
+        self.SESSION_MODE = os.environ.get("SESSION_MODE", "false").lower() == "true"
+        self.SESSION_TTL = float(os.environ.get("SESSION_TTL", 600))
+        self.SESSION_MAX_BYTES = int(os.environ.get("SESSION_MAX_BYTES", 256 * 2**20))
+        # Named regions loaded on demand instead of the single region of REGION_TYPE
+        self.REGIONS = os.environ.get("REGIONS")
+        self.REGION_IDLE_TTL = float(os.environ.get("REGION_IDLE_TTL", 3600))
+        self.REGION_DISPATCH_POINTS = int(os.environ.get("REGION_DISPATCH_POINTS", 5))
+        # Load every region at startup and keep it, instead of on its first trace
+        self.REGION_PRELOAD = os.environ.get("REGION_PRELOAD", "false").lower() == "true"
 
-        self.calculator = Calculator()
+        self.session = data_fetcher.create_session(self.HTTP_POOL_SIZE)
+        self.vehicle_cache = TTLCache(self.VEHICLE_CACHE_SIZE, self.VEHICLE_CACHE_TTL)
+        if self.REGIONS:
+            self.calculator = RegionDispatcher(
+                Region.parse_all(self.REGIONS),
+                self.REGION_IDLE_TTL,
+                self.REGION_DISPATCH_POINTS,
+            )
+            if self.REGION_PRELOAD:
+                self.calculator.preload()
+        else:
+            self.calculator = Calculator()
+        self.sessions = (
+            SessionStore(self.SESSION_TTL, self.SESSION_MAX_BYTES)
+            if self.SESSION_MODE
+            else None
+        )
+        self.price_refresher = PriceRefresher(
+            self.create_price_fetcher(), self.PRICE_REFRESH_INTERVAL
+        )
         tries = 0
-        try:
-            price_model = data_fetcher.get_prices(self.PAYMENT_SERVICE_URL)
-            self.pricer = Pricer(price_model=price_model)
-            logging.warning("Got prices from payment service...")
-        except requests.exceptions.ConnectionError as e:
-            tries += 1
-            if tries > 10:
-                raise e
-            sleep(5)
+        while True:
+            try:
+                self.price_refresher.refresh()
+                logging.warning("Got prices from payment service...")
+                break
+            except requests.exceptions.RequestException as e:
+                tries += 1
+                if tries > 10:
+                    raise e
+                logging.warning(f"Getting prices failed {tries} times...")
+                sleep(5)
+        self.price_refresher.start()
+        # Keep the collector away from the graph, it lives as long as the handler
+        memory.configure_gc()
+        memory.freeze_heap()
+
+    def create_price_fetcher(self):
+        """
+        Create the function the price refresher fetches the price model with.
+
+        The refresher thread gets its own session, sessions aren't thread safe.
+
+        :return: Function returning the price model
+        """
+        return partial(
+            data_fetcher.get_prices,
+            self.PAYMENT_SERVICE_URL,
+            session=data_fetcher.create_session(1),
+        )
+
+    def before_fork(self):
+        """
+        Stop the background threads, so the handler can be forked safely.
+        """
+        self.price_refresher.stop()
+
+    def after_fork(self):
+        """
+        Give a forked child its own connections and restart the background threads.
+        """
+        self.session = data_fetcher.create_session(self.HTTP_POOL_SIZE)
+        self.price_refresher.fetch_prices = self.create_price_fetcher()
+        self.price_refresher.start()
+
+    @property
+    def pricer(self):
+        """
+        Get the current pricer.
+
+        :return: The most recent Pricer
+        """
+        return self.price_refresher.pricer
 
     def handle(self, publish_coordinates_dto):
         """
@@ -49,6 +134,61 @@ class RouteHandler:
         #   {"lat":3,"long":21,"timeStamp":"2023-06-01T13:04:30.4366608Z"}
         #   ]
         # }
+        with STAGE_SECONDS.time(stage="handle"):
+            return self._handle(publish_coordinates_dto)
+
+    def handle_batch(self, messages: list) -> list:
+        """
+        Process several received messages at once.
+
+        The points of all messages are snapped together and all routes are priced
+        together. In session mode the messages are handled one by one, in order.
+
+        :param messages: The messages
+        :return: The priced route of every message, or the exception it failed with
+        """
+        logging.warning(f"Received batch of {len(messages)} requests")
+        with STAGE_SECONDS.time(stage="handle_batch"):
+            if self.sessions is not None:
+                return [self._try(self._handle, message) for message in messages]
+            decoded = [self._try(self._read, message) for message in messages]
+            valid = [
+                index
+                for index, request in enumerate(decoded)
+                if not isinstance(request, Exception)
+            ]
+            routes = self.calculator.map_to_map_batch(
+                [decoded[index][1:] for index in valid]
+            )
+            priced = [
+                (index, route)
+                for index, route in zip(valid, routes)
+                if not isinstance(route, Exception)
+            ]
+            with STAGE_SECONDS.time(stage="price"):
+                self.pricer.calculate_prices(
+                    [route for _, route in priced],
+                    [decoded[index][0] for index, _ in priced],
+                )
+            results = list(decoded)
+            for index, route in zip(valid, routes):
+                results[index] = route
+            return results
+
+    @staticmethod
+    def _try(func, message):
+        try:
+            return func(message)
+        except Exception as e:
+            return e
+
+    def _read(self, publish_coordinates_dto) -> tuple:
+        """
+        Get the vehicle and coordinates of a message.
+
+        :param publish_coordinates_dto: The message
+        :return: The vehicle, coordinates, longitude field and time field
+        """
         # Determine if request comes from international or domestic
         if "vehicle" in publish_coordinates_dto.keys():
             vehicle = VehicleInt.parse_obj(publish_coordinates_dto["vehicle"])
@@ -56,17 +196,61 @@ class RouteHandler:
             longitude_field = "lon"
             time_field = "time"
         else:
-            vehicle = data_fetcher.get_vehicle(
-                self.CAR_SERVICE_URL, publish_coordinates_dto["vehicleId"]
-            )
+            with STAGE_SECONDS.time(stage="vehicle_lookup"):
+                vehicle = data_fetcher.get_vehicle(
+                    self.CAR_SERVICE_URL,
+                    publish_coordinates_dto["vehicleId"],
+                    session=self.session,
+                    cache=self.vehicle_cache,
+                )
             coords = publish_coordinates_dto["cords"]
             longitude_field = "long"
             time_field = "timeStamp"
+        return vehicle, coords, longitude_field, time_field
 
+    def _handle(self, publish_coordinates_dto):
+        """
+        Process the received message, see handle.
+
+        :param publish_coordinates_dto: The message
+        :return: The priced route, None if a session had no new segments
+        """
+        vehicle, coords, longitude_field, time_field = self._read(
+            publish_coordinates_dto
+        )
         logging.warning(f"Received request for: {vehicle.id}")
-        route = self.calculator.map_to_map(coordinates=coords, longitude_field=longitude_field, time_field=time_field)
-        logging.warning(f"Processing price for: {vehicle.id}")
-        route = self.pricer.calculate_price(route=route, vehicle=vehicle)
-        # Workaround to deal with way lists. If anyone notices find a better fix :/
-        route = remove_way_id_lists(route)
+        if self.sessions is not None:
+            route = self.calculator.extend_session(
+                self.sessions.get(vehicle.id), coords, longitude_field, time_field
+            )
+            self.sessions.update(vehicle.id)
+            if not len(route):
+                return None
+        else:
+            route = self.calculator.map_to_map(coordinates=coords, longitude_field=longitude_field, time_field=time_field)
+        pricer = self.pricer
+        logging.warning(f"Processing price for: {vehicle.id} ({pricer.version})")
+        with STAGE_SECONDS.time(stage="price"):
+            route = pricer.calculate_price(route=route, vehicle=vehicle)
         return route
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the caches of the handler.
+
+        :return: Dict with the stats of every cache
+        """
+        stats = {
+            "vehicle_cache": self.vehicle_cache.stats(),
+            "sessions": self.sessions.stats() if self.sessions is not None else None,
+        }
+        if isinstance(self.calculator, RegionDispatcher):
+            stats["regions"] = self.calculator.stats()
+        else:
+            stats["bridge_cache"] = self.calculator.bridge_cache.stats()
+            stats["tiles"] = (
+                self.calculator.tiles.stats()
+                if self.calculator.tiles is not None
+                else None
+            )
+        return stats
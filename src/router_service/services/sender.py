@@ -2,7 +2,9 @@
 Sender for masstransit.
 """
 import json
+import logging
 
+import pika.exceptions
 from pydantic import BaseModel
 from src.router_service.library_overrides.RabbitMQSender import RabbitMQSender
 
@@ -10,11 +12,42 @@ from src.router_service.library_overrides.RabbitMQSender import RabbitMQSender
 class Sender:
     """
     Sender for masstransit.
+
+    Keeps one connection with a declared exchange open between messages and reconnects
+    when it is lost.
     """
 
-    def __init__(self, conf, exchange):
+    def __init__(self, conf, exchange, confirm: bool = False):
+        """
+        Create the sender, the connection is opened on the first message.
+
+        :param conf: RabbitMQConfiguration object
+        :param exchange: The exchange to publish to
+        :param confirm: Wait for the broker to confirm every published message
+        """
         self.exchange = exchange
         self.conf = conf
+        self.confirm = confirm
+        self._sender = None
+
+    def connect(self) -> RabbitMQSender:
+        """
+        Get the open publisher, connecting and declaring the exchange if needed.
+
+        :return: The publisher
+        """
+        if self._sender is not None:
+            try:
+                self._sender.process_data_events()
+            except pika.exceptions.AMQPError:
+                self.close()
+        if self._sender is None or not self._sender.is_open:
+            sender = RabbitMQSender(self.conf)
+            sender.set_exchange(exchange=self.exchange)
+            if self.confirm:
+                sender.enable_confirms()
+            self._sender = sender
+        return self._sender
 
     def send_message(self, body, message: BaseModel):
         """
@@ -24,8 +57,54 @@ class Sender:
         :param body: Message received from MassTransit client
         :return: None
         """
-        with RabbitMQSender(self.conf) as sender:
-            sender.set_exchange(exchange=self.exchange)
+        self._publish(self.connect(), body, message)
+
+    def send_messages(self, messages: list) -> list:
+        """
+        Send several messages, checking the connection once for all of them.
 
-            response = sender.create_masstransit_response(message, json.loads(body))
+        :param messages: List of (body, message) pairs, like the arguments of send_message
+        :return: The exception every message failed with, None for sent messages
+        """
+        sender = self.connect()
+        errors = []
+        for body, message in messages:
+            try:
+                sender = self._publish(sender, body, message)
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+    def _publish(self, sender: RabbitMQSender, body, message) -> RabbitMQSender:
+        """
+        Publish a message, reconnecting and trying once more if the connection was lost.
+
+        :param sender: The open publisher
+        :param body: Message received from MassTransit client
+        :param message: Message object to send
+        :return: The publisher that is open now
+        """
+        response = sender.create_masstransit_response(message, json.loads(body))
+        try:
+            sender.publish(message=response)
+        except (
+            pika.exceptions.AMQPConnectionError,
+            pika.exceptions.AMQPChannelError,
+        ) as e:
+            logging.warning(f"Publishing failed, reconnecting: {str(e)}")
+            self.close()
+            sender = self.connect()
             sender.publish(message=response)
+        return sender
+
+    def close(self):
+        """
+        Close the connection.
+        """
+        if self._sender is not None:
+            try:
+                self._sender.close()
+            except pika.exceptions.AMQPError:
+                pass
+            self._sender = None
@@ -0,0 +1,111 @@
+"""
+Keeps the match sessions of the vehicles that are currently driving.
+"""
+import logging
+import time
+from collections import OrderedDict
+
+from src.router_service.helpers.metrics import SESSIONS_EVICTED
+from src.router_service.models.match_session import MatchSession
+
+
+class SessionStore:
+    """
+    Match sessions by vehicle, in least recently used order.
+
+    Sessions that weren't used for the ttl are evicted, and the least recently used
+    ones while the sessions together take more than the memory budget.
+    """
+
+    def __init__(self, ttl: float, max_bytes: int, clock=time.monotonic):
+        """
+        Create the store.
+
+        :param ttl: Seconds a session is kept after its last message
+        :param max_bytes: Memory budget of all sessions together, 0 for no budget
+        :param clock: Function returning the current time in seconds
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self._sessions = OrderedDict()
+        self._sizes = {}
+        self.nbytes = 0
+
+    def __len__(self):
+        """
+        Get the number of sessions.
+
+        :return: The number of sessions
+        """
+        return len(self._sessions)
+
+    def __contains__(self, key):
+        """
+        Check if a vehicle has a session.
+
+        :param key: The vehicle key
+        :return: True if it has one
+        """
+        return key in self._sessions
+
+    def get(self, key) -> MatchSession:
+        """
+        Get the session of a vehicle, creating a new one if it has none.
+
+        :param key: The vehicle key
+        :return: The session
+        """
+        self.evict_expired()
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._sessions[key] = MatchSession()
+            self._sizes[key] = 0
+        self._sessions.move_to_end(key)
+        session.last_seen = self.clock()
+        return session
+
+    def update(self, key):
+        """
+        Account for the new size of a session and evict sessions over the budget.
+
+        :param key: The vehicle key of the changed session
+        """
+        session = self._sessions.get(key)
+        if session is None:
+            return
+        size = session.nbytes()
+        self.nbytes += size - self._sizes[key]
+        self._sizes[key] = size
+        while self.max_bytes > 0 and self.nbytes > self.max_bytes and self._sessions:
+            self._evict(next(iter(self._sessions)), "memory")
+
+    def evict_expired(self):
+        """
+        Evict the sessions that weren't used for the ttl.
+        """
+        expired_before = self.clock() - self.ttl
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if session.last_seen > expired_before:
+                break
+            self._evict(key, "ttl")
+
+    def _evict(self, key, reason: str):
+        self._sessions.pop(key)
+        self.nbytes -= self._sizes.pop(key)
+        SESSIONS_EVICTED.inc(reason=reason)
+        logging.info(f"Evicted the match session of {key} ({reason})")
+
+    def stats(self) -> dict:
+        """
+        Get the current size.
+
+        :return: Dict with sessions, bytes, ttl and max_bytes
+        """
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self.nbytes,
+            "ttl": self.ttl,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,153 @@
+"""
+Pool of worker processes that handle route messages.
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from src.router_service.helpers.metrics import REGISTRY
+from src.router_service.helpers.profiling import Profiler
+
+# The handler and profiler of the worker process, created by the pool initializer
+_handler = None
+_profiler = None
+
+
+def _init_worker(handler_factory):
+    """
+    Create the handler of a worker process.
+
+    :param handler_factory: Picklable callable returning an object with
+        handle(message), or None to use the handler preloaded in the parent
+    """
+    global _handler, _profiler
+    # Forked workers start with a copy of the metrics of the parent
+    REGISTRY.drain()
+    if handler_factory is None:
+        if hasattr(_handler, "after_fork"):
+            _handler.after_fork()
+    else:
+        _handler = handler_factory()
+    _profiler = Profiler.from_env()
+
+
+def _handle(message):
+    """
+    Handle a message with the handler of this worker process.
+
+    :param message: The decoded message
+    :return: The handler result and the metrics recorded since the last message
+    """
+    try:
+        if _profiler:
+            result = _profiler.run(_handler.handle, message)
+        else:
+            result = _handler.handle(message)
+    except Exception as e:
+        return e, REGISTRY.drain()
+    return result, REGISTRY.drain()
+
+
+def _ready():
+    """
+    Do nothing, used to wait for the workers to start.
+
+    :return: True
+    """
+    return True
+
+
+class WorkerPool:
+    """
+    Pool of worker processes, each with its own handler and loaded graph.
+
+    With preload the handler is created once in this process and the workers share
+    its graph copy-on-write instead of loading their own.
+
+    When a worker dies the executor breaks and fails every message it was handling
+    with BrokenProcessPool. The workers are started again on the next submit.
+    """
+
+    def __init__(self, handler_factory, processes: int, preload: bool = False):
+        """
+        Start the workers and wait until they have created their handler.
+
+        :param handler_factory: Picklable callable returning an object with
+            handle(message), called once in every worker or once here with preload
+        :param processes: Number of worker processes
+        :param preload: Create the handler before forking the workers
+        """
+        global _handler
+        self.processes = processes
+        if preload:
+            _handler = handler_factory()
+            if hasattr(_handler, "before_fork"):
+                _handler.before_fork()
+            handler_factory = None
+        self.handler_factory = handler_factory
+        self.restarts = 0
+        self._lock = threading.Lock()
+        self._executor = self._start()
+        wait([self._executor.submit(_ready) for _ in range(processes)])
+        logging.warning(f"Started {processes} route workers...")
+
+    def _start(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(self.handler_factory,),
+        )
+
+    def _submit(self, message) -> Future:
+        """
+        Submit a message to the executor, starting new workers if it broke.
+
+        :param message: The decoded message
+        :return: Future of the executor
+        """
+        with self._lock:
+            try:
+                return self._executor.submit(_handle, message)
+            except BrokenProcessPool:
+                logging.error("A route worker died, starting new workers")
+                self._executor.shutdown(wait=False)
+                self._executor = self._start()
+                self.restarts += 1
+                return self._executor.submit(_handle, message)
+
+    def submit(self, message) -> Future:
+        """
+        Handle a message on one of the workers.
+
+        The metrics the worker recorded are merged into the registry of this process.
+        If a worker died while the message was queued or handled, the future fails
+        with BrokenProcessPool.
+
+        :param message: The decoded message
+        :return: Future with the handler result
+        """
+        future = Future()
+
+        def done(handled: Future):
+            try:
+                result, metrics = handled.result()
+            except Exception as e:
+                future.set_exception(e)
+                return
+            REGISTRY.merge(metrics)
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+        self._submit(message).add_done_callback(done)
+        return future
+
+    def shutdown(self):
+        """
+        Wait for the submitted messages and stop the workers.
+        """
+        self._executor.shutdown(wait=True)
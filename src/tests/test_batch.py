@@ -0,0 +1,143 @@
+"""Test micro-batched handling of messages."""
+import json
+
+import pytest
+from src.benchmarks.synthetic import grid_graph, price_model, random_trace
+from src.router_service.models.vehicle import VehicleInt
+from src.router_service.services.calculator import Calculator
+from src.router_service.services.pricer import Pricer
+from src.router_service.services.receiver import Receiver
+
+VEHICLES = [
+    VehicleInt(id="v1", vehicleClassification="M1", fuelType="Diesel"),
+    VehicleInt(id="v2", vehicleClassification="N1", fuelType="Petrol"),
+]
+
+
+@pytest.fixture(scope="module")
+def calculator():
+    """Create a calculator on a small synthetic graph."""
+    return Calculator(grid_graph(rows=15, cols=15))
+
+
+def test_batch_matches_single_traces(calculator):
+    """Test batched mapping and pricing give the same routes as one by one."""
+    pricer = Pricer(price_model())
+    traces = [
+        random_trace(calculator.area_graph, length=120, seed=seed) for seed in range(4)
+    ]
+    broken = [{"lat": float("nan"), "long": 0.0, "timeStamp": "2023-06-01T13:04:30Z"}]
+
+    routes = calculator.map_to_map_batch(
+        [(trace, "long", "timeStamp") for trace in traces[:2]]
+        + [(broken, "long", "timeStamp")]
+        + [(trace, "long", "timeStamp") for trace in traces[2:]]
+    )
+
+    assert isinstance(routes.pop(2), ValueError)
+    vehicles = [VEHICLES[index % 2] for index in range(len(traces))]
+    pricer.calculate_prices(routes, vehicles)
+    for trace, vehicle, route in zip(traces, vehicles, routes):
+        single = pricer.calculate_price(
+            calculator.map_to_map(trace, "long", "timeStamp"), vehicle
+        )
+        assert json.dumps(route.to_wire()) == json.dumps(single.to_wire())
+
+
+class Channel:
+    """Channel recording acknowledgements and scheduled timers."""
+
+    def __init__(self):
+        """Start without acknowledgements or timers."""
+        self.acks = []
+        self.nacks = []
+        self.timers = []
+        self.connection = self
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        """Record an acknowledgement."""
+        self.acks.append((delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        """Record a negative acknowledgement."""
+        self.nacks.append(delivery_tag)
+
+    def call_later(self, delay, callback):
+        """Record the timer instead of scheduling it."""
+        self.timers.append(callback)
+        return callback
+
+    def remove_timeout(self, timer):
+        """Remove a recorded timer."""
+        self.timers.remove(timer)
+
+
+class Method:
+    """Delivery method with only a delivery tag."""
+
+    def __init__(self, delivery_tag):
+        """Keep the delivery tag."""
+        self.delivery_tag = delivery_tag
+
+
+class Sender:
+    """Sender recording the messages of every batch."""
+
+    def __init__(self):
+        """Start without batches."""
+        self.batches = []
+
+    def send_messages(self, messages):
+        """Record the batch and report every message as sent."""
+        self.batches.append([message for _, message in messages])
+        return [None] * len(messages)
+
+
+def batch_func(messages):
+    """Handle messages, failing on fail and returning nothing for skip."""
+    return [
+        ValueError("failed")
+        if message.get("fail")
+        else None
+        if message.get("skip")
+        else message["value"]
+        for message in messages
+    ]
+
+
+def consume(receiver, channel, messages):
+    """Deliver the messages to the receiver one by one."""
+    for tag, message in enumerate(messages, start=1):
+        receiver.collect(
+            channel, Method(tag), None, json.dumps({"message": message}).encode()
+        )
+
+
+def test_full_batch_is_published_and_acked_at_once():
+    """Test a full batch is published together and acknowledged with one ack."""
+    channel, sender = Channel(), Sender()
+    receiver = Receiver(
+        None, "exchange", None, sender, batch_func=batch_func, batch_size=3
+    )
+
+    consume(receiver, channel, [{"value": 1}, {"value": 2}, {"skip": True}])
+
+    assert sender.batches == [[1, 2]]
+    assert channel.acks == [(3, True)]
+    assert channel.timers == []
+
+
+def test_partial_batch_is_flushed_by_the_timer():
+    """Test a batch that doesn't fill up is handled when the wait is over."""
+    channel, sender = Channel(), Sender()
+    receiver = Receiver(
+        None, "exchange", None, sender, batch_func=batch_func, batch_size=5
+    )
+
+    consume(receiver, channel, [{"value": 1}, {"fail": True}])
+    assert sender.batches == [] and len(channel.timers) == 1
+    channel.timers.pop()()
+
+    assert sender.batches == [[1]]
+    assert channel.acks == [(1, False)]
+    assert channel.nacks == [2]
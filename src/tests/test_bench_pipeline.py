@@ -0,0 +1,21 @@
+"""Test the pipeline benchmark runs and writes comparable results."""
+import json
+
+from src.benchmarks import bench_pipeline
+
+
+def test_bench_pipeline_times_every_stage(tmp_path):
+    """Test every stage is timed and a run compares with itself."""
+    output = tmp_path / "results.json"
+
+    bench_pipeline.main(
+        ["--lengths", "60", "--repeats", "1", "--rows", "10", "--cols", "10"]
+        + ["--output", str(output)]
+    )
+
+    result = json.loads(output.read_text())
+    timings = result["results"]["60"]
+    assert "nearest_edges" in timings and "serialize" in timings
+    assert all(timing["min_ms"] >= 0 for timing in timings.values())
+    assert result["meta"]["graph"]["nodes"] == 100
+    assert len(bench_pipeline.compare(result, result)) == len(timings)
@@ -0,0 +1,125 @@
+"""Test calculator."""
+import json
+
+import pytest
+from src.benchmarks.synthetic import (
+    grid_graph,
+    random_trace,
+    route_length,
+    trace_length,
+    u_turns,
+)
+from src.router_service.services.calculator import Calculator
+
+
+@pytest.fixture(scope="module")
+def calculator():
+    """Create a calculator on a small synthetic graph."""
+    return Calculator(grid_graph(rows=15, cols=15))
+
+
+def test_bridge_edge_gaps_returns_connected_route(calculator):
+    """Test bridging connects matched edges points apart with a path on the graph."""
+    trace = random_trace(calculator.area_graph, length=400, noise=0.0001)[::8]
+    lats, lons = calculator.get_lat_lon_arrays(trace, "long")
+    coordinate_edges = calculator.snap(lats, lons)
+
+    route, bridges = calculator.bridge_edge_gaps(coordinate_edges)
+
+    graph = calculator.area_graph
+    assert all(graph.has_edge(u, v) for u, v in zip(route, route[1:]))
+    assert bridges > 0
+    assert u_turns(route) == 0
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("noise", [0.0, 0.00005])
+def test_bridged_route_follows_the_walk(seed, noise):
+    """Test points snapping to side roads at intersections don't add detours."""
+    calculator = Calculator(grid_graph(rows=30, cols=30))
+    graph = calculator.area_graph
+    walk = trace_length(random_trace(graph, length=300, noise=0.0, seed=seed))
+    trace = random_trace(graph, length=300, noise=noise, seed=seed)
+    lats, lons = calculator.get_lat_lon_arrays(trace, "long")
+
+    route, _ = calculator.bridge_edge_gaps(calculator.snap(lats, lons))
+
+    # The route holds the whole first and last edge the walk is partly on
+    assert walk <= route_length(graph, route) <= walk + 300
+    assert u_turns(route) == 0
+
+
+def test_reversed_first_edge_does_not_turn_back(calculator):
+    """Test the first road snapped in both directions starts the way it is driven."""
+    graph = calculator.area_graph
+    u, v = next((u, v) for u, v in graph.edges() if graph.has_edge(v, u))
+    w = next(node for node in graph.successors(v) if node != u)
+
+    route, _ = calculator.bridge_edge_gaps([(u, v, 0), (v, u, 0), (v, w, 0)])
+
+    assert route == [u, v, w]
+
+
+def test_bridge_cache_is_reused_and_invalidated(calculator):
+    """Test repeated routes are bridged from the cache and reloading the graph clears it."""
+    trace = random_trace(calculator.area_graph, length=400, noise=0.0001, seed=3)[::8]
+    lats, lons = calculator.get_lat_lon_arrays(trace, "long")
+    coordinate_edges = calculator.snap(lats, lons)
+    calculator.bridge_cache.clear()
+
+    first_route, bridges = calculator.bridge_edge_gaps(coordinate_edges)
+    misses = calculator.bridge_cache.misses
+    second_route, _ = calculator.bridge_edge_gaps(coordinate_edges)
+
+    assert second_route == first_route
+    assert calculator.bridge_cache.misses == misses
+    assert bridges > 0 and calculator.bridge_cache.hits >= bridges
+    assert len(calculator.bridge_cache) > 0
+
+    calculator.set_graph(calculator.area_graph, calculator.geom, calculator.rtree)
+    assert len(calculator.bridge_cache) == 0
+
+
+@pytest.mark.parametrize("mode, cached", [("expand", False), ("bridge", True)])
+def test_only_bridge_mode_uses_the_cache(calculator, monkeypatch, mode, cached):
+    """Test connecting edges goes through the bridge cache in bridge mode only."""
+    monkeypatch.setattr(calculator, "gap_fill_mode", mode)
+    trace = random_trace(calculator.area_graph, length=400, noise=0.0001, seed=3)[::8]
+    lats, lons = calculator.get_lat_lon_arrays(trace, "long")
+    calculator.bridge_cache.clear()
+
+    calculator.connect_edges(calculator.snap(lats, lons))
+
+    assert (len(calculator.bridge_cache) > 0) == cached
+
+
+def test_map_to_map_reads_attributes_from_edge_table(calculator, monkeypatch):
+    """Test the formatted route follows the route edges with their graph attributes."""
+    monkeypatch.setattr(calculator, "match_engine", "hmm")
+    trace = random_trace(calculator.area_graph, length=300, seed=1)
+    lats, lons = calculator.get_lat_lon_arrays(trace, "long")
+    _, route_node_ids = calculator.match_hmm(lats, lons)
+
+    route = calculator.map_to_map(trace, "long", "timeStamp")
+
+    graph = calculator.area_graph
+    assert len(route) == len(route_node_ids) - 2
+    pairs = list(zip(route_node_ids, route_node_ids[1:]))[: len(route)]
+    for index, (u, v) in enumerate(pairs):
+        data = graph.edges[u, v, 0]
+        assert route.node_ids[index : index + 2] == [str(u), str(v)]
+        assert route.node_lats[index] == graph.nodes[u]["lat"]
+        assert route.way_ids[index] == str(data["osmid"])
+        assert route.highways[index] == data["highway"]
+        assert route.way_names[index] == data.get("name", "")
+        assert route.lengths[index] == data["length"] / 1000
+
+
+def test_to_wire_matches_route_model_json(calculator):
+    """Test the compact route serializes to the same message as the Route model."""
+    trace = random_trace(calculator.area_graph, length=300, seed=2)
+    route = calculator.map_to_map(trace, "long", "timeStamp")
+    route.vehicle_id = "250aae3e-4c20-46e4-b5dc-7b32af4dbf9a"
+
+    assert len(route) > 0
+    assert json.dumps(route.to_wire()) == route.to_route().json(by_alias=True)
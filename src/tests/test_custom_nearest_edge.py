@@ -0,0 +1,26 @@
+"""Test custom nearest edge."""
+import numpy as np
+from src.benchmarks.synthetic import grid_graph, random_trace
+from src.router_service.helpers import custom_nearest_edge as cne
+
+
+def test_nearest_edges_batch_matches_per_point():
+    """Test the batched query returns the same edges as the per point query."""
+    graph = grid_graph(rows=10, cols=10)
+    geoms, rtree = cne.init_rtree(graph)
+    edge_ids = cne.init_edge_ids(geoms)
+    trace = random_trace(graph, length=200)
+
+    expected = [
+        cne.nearest_edges(geoms, rtree, lons=point["lat"], lats=point["long"])
+        for point in trace
+    ]
+    result = cne.nearest_edges_batch(
+        edge_ids,
+        rtree,
+        np.array([point["lat"] for point in trace]),
+        np.array([point["long"] for point in trace]),
+    )
+
+    assert result.dtype == np.int64
+    assert [tuple(edge) for edge in result.tolist()] == expected
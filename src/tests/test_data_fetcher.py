@@ -0,0 +1,91 @@
+"""Test data fetcher vehicle lookups and the TTL cache."""
+from src.router_service.helpers.cache import TTLCache
+from src.router_service.services import data_fetcher
+
+VEHICLE = {
+    "id": "250aae3e-4c20-46e4-b5dc-7b32af4dbf9a",
+    "vehicleClassification": "M1",
+    "fuelType": "Diesel",
+    "licence": "1-ABC-123",
+}
+
+
+class FakeClock:
+    """Clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        """Return the current time."""
+        return self.now
+
+
+class FakeResponse:
+    """Response with a json body."""
+
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        """Accept every status."""
+        pass
+
+    def json(self):
+        """Return the body."""
+        return self.body
+
+
+class FakeSession:
+    """Session counting the requests it answers."""
+
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, params=None, timeout=None):
+        """Record the request and answer with the vehicle."""
+        self.requests.append((url, params, timeout))
+        return FakeResponse(dict(VEHICLE, id=params["vehicleId"]))
+
+
+def test_ttl_cache_expires_and_evicts():
+    """Test entries expire after the ttl and the oldest entries are evicted."""
+    clock = FakeClock()
+    cache = TTLCache(max_size=2, ttl=10, clock=clock)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    clock.now = 10
+    assert cache.get("a") is None
+
+    assert cache.stats() == {
+        "size": 1,
+        "max_size": 2,
+        "ttl": 10,
+        "hits": 1,
+        "misses": 2,
+        "evictions": 1,
+        "expirations": 1,
+    }
+
+
+def test_get_vehicle_is_cached_until_it_expires():
+    """Test repeated lookups of a vehicle only reach the car service after the ttl."""
+    clock = FakeClock()
+    cache = TTLCache(max_size=100, ttl=60, clock=clock)
+    session = FakeSession()
+
+    for second in range(0, 120, 15):
+        clock.now = second
+        vehicle = data_fetcher.get_vehicle(
+            "http://car-service/vehicle", "v1", session=session, cache=cache
+        )
+        assert vehicle.id == "v1"
+        assert vehicle.fuelType == "Diesel"
+
+    assert len(session.requests) == 2
+    assert session.requests[0][2] == data_fetcher.HTTP_TIMEOUT
+    assert (cache.hits, cache.misses) == (6, 2)
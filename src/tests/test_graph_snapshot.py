@@ -0,0 +1,56 @@
+"""Test graph snapshot."""
+import os
+
+import pytest
+from src.benchmarks.synthetic import grid_graph
+from src.router_service.helpers import custom_nearest_edge as cne
+from src.router_service.helpers.graph_snapshot import load_snapshot, save_snapshot
+
+
+def test_snapshot_round_trip(tmp_path):
+    """Test a loaded snapshot has the same nodes, edges and geometries."""
+    graph = grid_graph(rows=8, cols=8)
+    geoms, _ = cne.init_rtree(graph)
+    folder = str(tmp_path / "snapshot")
+    save_snapshot(graph, geoms, folder, region="PLACE:Eindhoven")
+
+    loaded_graph, loaded_geoms = load_snapshot(folder, region="PLACE:Eindhoven")
+
+    assert loaded_graph.graph["crs"] == "EPSG:4326"
+    assert dict(loaded_graph.nodes(data=True)) == dict(graph.nodes(data=True))
+    assert list(loaded_graph.edges(keys=True, data=True)) == list(
+        graph.edges(keys=True, data=True)
+    )
+    assert list(loaded_geoms.index) == list(geoms.index)
+    assert all(loaded_geoms.geom_equals(geoms))
+
+
+def test_snapshot_for_other_region(tmp_path):
+    """Test loading a snapshot made for another region fails."""
+    graph = grid_graph(rows=4, cols=4)
+    geoms, _ = cne.init_rtree(graph)
+    folder = str(tmp_path / "snapshot")
+    save_snapshot(graph, geoms, folder, region="PLACE:Eindhoven")
+
+    with pytest.raises(ValueError):
+        load_snapshot(folder, region="PLACE:Brussels, Belgium")
+
+
+def test_snapshot_is_replaced_by_a_new_version(tmp_path):
+    """Test saving again swaps the folder to a new version and keeps the previous."""
+    folder = str(tmp_path / "snapshot")
+    for rows in (4, 5, 6):
+        graph = grid_graph(rows=rows, cols=4)
+        geoms, _ = cne.init_rtree(graph)
+        previous = os.path.realpath(folder)
+        save_snapshot(graph, geoms, folder, region="PLACE:Eindhoven")
+
+    loaded_graph, _ = load_snapshot(folder)
+    assert len(loaded_graph) == len(graph)
+    assert os.path.islink(folder)
+    # A replica that resolved the folder before the last save can still load it
+    assert len(load_snapshot(previous)[0]) == 5 * 4
+    versions = [
+        entry for entry in os.listdir(tmp_path) if entry.startswith(".snapshot-")
+    ]
+    assert len(versions) == 2
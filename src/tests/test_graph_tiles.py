@@ -0,0 +1,99 @@
+"""Test the tiled graph."""
+import numpy as np
+import pytest
+from src.benchmarks.synthetic import grid_graph, random_trace
+from src.router_service.helpers import custom_nearest_edge as cne
+from src.router_service.helpers import graph_tiles
+from src.router_service.helpers.edge_table import EdgeTable
+from src.router_service.models.region import Region
+from src.router_service.services.calculator import Calculator
+
+
+@pytest.fixture(scope="module")
+def graph():
+    """Grid graph of about 3 by 3 tiles."""
+    return grid_graph(rows=30, cols=30)
+
+
+@pytest.fixture(scope="module")
+def tile_folder(graph, tmp_path_factory):
+    """Folder with the tiles of the grid graph."""
+    folder = str(tmp_path_factory.mktemp("tiles"))
+    geoms, _ = cne.init_rtree(graph)
+    graph_tiles.write_tiles(graph, geoms, folder, 0.01, region=Region.from_env().key)
+    return folder
+
+
+def node_coordinates(graph):
+    """Latitudes and longitudes of every node of the graph."""
+    lats = np.array([data["lat"] for _, data in graph.nodes(data=True)])
+    lons = np.array([data["lon"] for _, data in graph.nodes(data=True)])
+    return lats, lons
+
+
+def test_all_tiles_stitch_into_the_whole_graph(graph, tile_folder):
+    """Test loading every tile gives every node and edge exactly once."""
+    store = graph_tiles.TileStore(tile_folder, max_bytes=0, margin=100)
+
+    assert store.require(*node_coordinates(graph))
+    stitched, geoms, rtree, table = store.compose()
+
+    assert len(store) == len(store.available) > 4
+    assert set(stitched.edges(keys=True)) == set(graph.edges(keys=True))
+    assert set(stitched.nodes) == set(graph.nodes)
+    assert len(geoms) == graph.number_of_edges()
+    assert len(rtree) == len(geoms)
+    # The joined tables are the same as a table of the whole graph
+    whole = EdgeTable(stitched, cne.init_edge_ids(geoms))
+    assert (table.edge_ids == whole.edge_ids).all()
+    assert (table.length == whole.length).all()
+    assert table.node_pair_index == whole.node_pair_index
+    assert set(table.node_index) == set(whole.node_index)
+    for node, position in whole.node_index.items():
+        assert table.node_lat[table.node_index[node]] == whole.node_lat[position]
+
+
+def test_margin_must_be_smaller_than_the_tiles(tile_folder):
+    """Test a margin reaching past the neighbouring tiles is refused."""
+    with pytest.raises(ValueError):
+        graph_tiles.TileStore(tile_folder, max_bytes=0, margin=2000)
+
+
+def test_least_recently_used_tiles_are_evicted_over_the_budget(graph, tile_folder):
+    """Test tiles of earlier traces are evicted while over budget and needed ones kept."""
+    store = graph_tiles.TileStore(tile_folder, max_bytes=1, margin=100)
+    lats, lons = node_coordinates(graph)
+    corner = (lats < lats.min() + 0.002) & (lons < lons.min() + 0.002)
+    other = (lats > lats.max() - 0.002) & (lons > lons.max() - 0.002)
+
+    store.require(lats[corner], lons[corner])
+    corner_tiles = set(store.tiles_for(lats[corner], lons[corner]))
+    assert set(store._tiles) == corner_tiles
+
+    assert store.require(lats[other], lons[other])
+    assert set(store._tiles) == set(store.tiles_for(lats[other], lons[other]))
+    assert store.evictions == len(corner_tiles)
+    # Only the edges of the loaded tiles are left in the graph
+    stitched, geoms, _, _ = store.compose()
+    assert set(stitched.edges(keys=True)) == set(geoms.index)
+    # Nothing new is needed, so nothing is evicted
+    assert not store.require(lats[other][:1], lons[other][:1])
+
+
+def test_tiled_calculator_matches_the_whole_graph(graph, tile_folder, monkeypatch):
+    """Test routes crossing tile borders are the same as on the whole graph."""
+    monkeypatch.setenv("TILE_FOLDER", tile_folder)
+    monkeypatch.setenv("TILE_MARGIN", "300")
+    tiled = Calculator()
+    whole = Calculator(graph)
+    # Which direction of a two-way road snapping picks depends on the rtree order, bridging
+    # takes both directions as the same road
+    tiled.gap_fill_mode = whole.gap_fill_mode = "bridge"
+    assert tiled.area_graph.number_of_edges() == 0
+
+    trace = random_trace(graph, length=300, seed=2)
+    route = tiled.map_to_map(trace, "long", "timeStamp")
+
+    assert route.node_ids == whole.map_to_map(trace, "long", "timeStamp").node_ids
+    assert 0 < len(tiled.tiles) < len(tiled.tiles.available)
+    assert tiled.area_graph.number_of_edges() < graph.number_of_edges()
@@ -0,0 +1,48 @@
+"""Test hmm matching."""
+import numpy as np
+from src.benchmarks.synthetic import grid_graph, random_trace
+from src.router_service.helpers import custom_nearest_edge as cne
+from src.router_service.helpers import hmm_matching
+
+
+def test_match_returns_connected_route():
+    """Test every point gets an edge and the route is a connected path over those edges."""
+    graph = grid_graph(rows=15, cols=15)
+    geoms, rtree = cne.init_rtree(graph)
+    edge_ids = cne.init_edge_ids(geoms)
+    trace = random_trace(graph, length=400)
+    lats = np.array([point["lat"] for point in trace])
+    lons = np.array([point["long"] for point in trace])
+
+    matched_edges, route = hmm_matching.match(
+        graph, np.asarray(geoms.values), rtree, edge_ids, lats, lons
+    )
+
+    assert len(matched_edges) == len(trace)
+    assert all(graph.has_edge(u, v) for u, v in zip(route, route[1:]))
+    route_edges = set(zip(route, route[1:]))
+    assert all((u, v) in route_edges for u, v, _ in matched_edges)
+
+
+def test_unreachable_point_is_skipped():
+    """Test a point whose only candidate is unreachable is left out of the route."""
+    graph = grid_graph(rows=15, cols=15)
+    trace = random_trace(graph, length=200, seed=3)
+    lats = np.array([point["lat"] for point in trace])
+    lons = np.array([point["long"] for point in trace])
+    # A road without connection to the grid, far enough that it is the only candidate
+    lat, lon = lats.max() + 0.01, lons[100]
+    graph.add_node(1, x=lon, y=lat, lon=lon, lat=lat)
+    graph.add_node(2, x=lon + 0.001, y=lat, lon=lon + 0.001, lat=lat)
+    graph.add_edge(1, 2, key=0, length=70.0, highway="residential")
+    lats[100], lons[100] = lat, lon + 0.0005
+    geoms, rtree = cne.init_rtree(graph)
+    edge_ids = cne.init_edge_ids(geoms)
+
+    matched_edges, route = hmm_matching.match(
+        graph, np.asarray(geoms.values), rtree, edge_ids, lats, lons
+    )
+
+    assert matched_edges[100] == (1, 2, 0)
+    assert 1 not in route and 2 not in route
+    assert all(graph.has_edge(u, v) for u, v in zip(route, route[1:]))
@@ -0,0 +1,19 @@
+"""Test garbage collector settings."""
+import gc
+
+from src.router_service.helpers import memory
+
+
+def test_configure_gc_and_freeze_heap():
+    """Test thresholds are applied and live objects are frozen."""
+    thresholds = gc.get_threshold()
+    graph = [{"node": index} for index in range(1000)]
+    try:
+        memory.configure_gc("10000,20,20")
+        memory.freeze_heap()
+
+        assert gc.get_threshold() == (10000, 20, 20)
+        assert gc.get_freeze_count() >= len(graph)
+    finally:
+        gc.set_threshold(*thresholds)
+        gc.unfreeze()
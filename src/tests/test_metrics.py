@@ -0,0 +1,97 @@
+"""Test metrics registry, endpoint and pipeline instrumentation."""
+import urllib.request
+from concurrent.futures import wait
+
+from src.benchmarks.synthetic import grid_graph, random_trace
+from src.router_service.helpers import metrics
+from src.router_service.helpers.metrics import REGISTRY, STAGE_SECONDS, Registry
+from src.router_service.services.calculator import Calculator
+from src.router_service.services.worker_pool import WorkerPool
+
+
+class StageHandler:
+    """Handler observing a stage in the worker process."""
+
+    def handle(self, message):
+        """Observe the message as the stage duration."""
+        STAGE_SECONDS.observe(message, stage="test_worker")
+        return message
+
+
+def test_render_prometheus_text():
+    """Test counters and cumulative histogram buckets are rendered."""
+    registry = Registry()
+    counter = registry.counter("test_total", "Test counter.", ("result",))
+    histogram = registry.histogram("test_seconds", "Test histogram.", buckets=(1, 2))
+    counter.inc(result="ok")
+    counter.inc(2, result="ok")
+    for value in (0.5, 1.5, 1.7, 3):
+        histogram.observe(value)
+
+    assert registry.render().splitlines() == [
+        "# HELP test_seconds Test histogram.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{le="1"} 1',
+        'test_seconds_bucket{le="2"} 3',
+        'test_seconds_bucket{le="+Inf"} 4',
+        "test_seconds_sum 6.7",
+        "test_seconds_count 4",
+        "# HELP test_total Test counter.",
+        "# TYPE test_total counter",
+        'test_total{result="ok"} 3',
+    ]
+
+
+def test_drain_and_merge():
+    """Test drained values move to another registry with the same metrics."""
+    worker, parent = Registry(), Registry()
+    for registry in (worker, parent):
+        registry.histogram("test_seconds", "Test histogram.", ("stage",))
+        registry.counter("test_total", "Test counter.")
+    worker.histogram("test_seconds", "").observe(0.2, stage="snap")
+    worker.counter("test_total", "").inc(3)
+    parent.counter("test_total", "").inc(1)
+
+    parent.merge(worker.drain())
+    parent.merge(worker.drain())
+
+    assert parent.histogram("test_seconds", "").count(stage="snap") == 1
+    assert parent.counter("test_total", "").value() == 4
+    assert worker.counter("test_total", "").value() == 0
+
+
+def test_map_to_map_records_stages_and_endpoint_serves_them():
+    """Test the pipeline stages are timed and served over HTTP."""
+    calculator = Calculator(grid_graph(rows=10, cols=10))
+    trace = random_trace(calculator.area_graph, length=100)
+    before = {
+        stage: STAGE_SECONDS.count(stage=stage)
+        for stage in ("snap", "gap_fill", "route_edges", "timestamps", "format")
+    }
+
+    calculator.map_to_map(trace, "long", "timeStamp")
+
+    for stage, count in before.items():
+        assert STAGE_SECONDS.count(stage=stage) == count + 1
+    server = metrics.start_server(0, host="127.0.0.1")
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            text = response.read().decode()
+    finally:
+        server.shutdown()
+    assert 'router_stage_seconds_count{stage="snap"}' in text
+    assert "router_trace_points_bucket" in text
+
+
+def test_worker_metrics_are_merged():
+    """Test metrics recorded in worker processes end up in this process."""
+    count = STAGE_SECONDS.count(stage="test_worker")
+    pool = WorkerPool(StageHandler, 2)
+    try:
+        wait([pool.submit(0.01) for _ in range(10)])
+    finally:
+        pool.shutdown()
+
+    assert STAGE_SECONDS.count(stage="test_worker") == count + 10
+    assert REGISTRY.render().count('stage="test_worker"') > 0
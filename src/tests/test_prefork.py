@@ -0,0 +1,104 @@
+"""Test forking consumers and workers that share a preloaded handler."""
+import gc
+import multiprocessing
+import os
+import time
+import urllib.request
+from concurrent.futures import wait
+
+from src.router_service.helpers import memory, metrics
+from src.router_service.services.prefork import Prefork
+from src.router_service.services.worker_pool import WorkerPool
+
+# Preloaded in the parent, the children only read it
+PRELOADED = bytearray(64 * 2**20)
+
+
+class PreloadedHandler:
+    """Handler remembering the process it was created in and forks it went through."""
+
+    def __init__(self):
+        self.created_in = os.getpid()
+        self.forks = 0
+
+    def before_fork(self):
+        """Count a fork prepared in the parent."""
+        self.forks -= 100
+
+    def after_fork(self):
+        """Count a fork finished in the child."""
+        self.forks += 101
+
+    def handle(self, message):
+        """Return where the handler was created, the forks and a preloaded sum."""
+        return self.created_in, self.forks, sum(PRELOADED[:: 2**16])
+
+
+def test_prefork_children_share_preloaded_memory():
+    """Test children report most of the preloaded memory as shared."""
+    ready = multiprocessing.get_context("fork").Semaphore(0)
+    release = multiprocessing.get_context("fork").Event()
+
+    def child_main(index):
+        sum(PRELOADED[::4096])
+        ready.release()
+        release.wait(30)
+
+    memory.freeze_heap()
+    prefork = Prefork(child_main, 2, report_interval=0)
+    prefork.start()
+    try:
+        for _ in range(2):
+            assert ready.acquire(timeout=30)
+        report = prefork.memory_report()
+    finally:
+        release.set()
+        prefork.stop()
+        gc.unfreeze()
+
+    assert len(report) == 2
+    assert all(child["shared"] > len(PRELOADED) for child in report)
+    assert all(child["uss"] < child["rss"] - len(PRELOADED) for child in report)
+
+
+def test_prefork_children_metrics_are_served_by_the_parent():
+    """Test a metric recorded in a forked child shows up on the metrics endpoint."""
+    release = multiprocessing.get_context("fork").Event()
+
+    def child_main(index):
+        metrics.MESSAGES.inc(result=f"prefork-{index}")
+        release.wait(30)
+
+    prefork = Prefork(child_main, 2, report_interval=0, metrics_interval=0.05)
+    server = metrics.start_server(0, host="127.0.0.1")
+    prefork.start()
+    try:
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline and not all(
+            metrics.MESSAGES.value(result=f"prefork-{index}") for index in range(2)
+        ):
+            prefork.merge_metrics(timeout=0.1)
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            text = response.read().decode()
+    finally:
+        release.set()
+        prefork.stop()
+        server.shutdown()
+
+    assert 'router_messages_total{result="prefork-0"} 1' in text
+    assert 'router_messages_total{result="prefork-1"} 1' in text
+
+
+def test_worker_pool_preload_creates_handler_once():
+    """Test preloaded workers use the handler created in this process."""
+    pool = WorkerPool(PreloadedHandler, 2, preload=True)
+    try:
+        futures = [pool.submit({}) for _ in range(4)]
+        wait(futures)
+        results = [future.result() for future in futures]
+    finally:
+        pool.shutdown()
+
+    assert {created_in for created_in, _, _ in results} == {os.getpid()}
+    assert {forks for _, forks, _ in results} == {1}
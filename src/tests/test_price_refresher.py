@@ -0,0 +1,66 @@
+"""Test price refresher."""
+import random
+import threading
+
+from src.benchmarks.synthetic import price_model
+from src.router_service.models.price_model import PriceModel
+from src.router_service.models.vehicle import VehicleInt
+from src.router_service.services.price_refresher import PriceRefresher
+from src.tests.test_pricer import random_route
+
+VEHICLE = VehicleInt(
+    id="250aae3e-4c20-46e4-b5dc-7b32af4dbf9a",
+    vehicleClassification="M1",
+    fuelType="Diesel",
+)
+
+
+def raised_base_price():
+    """Get the test price model with a higher base price."""
+    model = price_model()
+    modifiers = [modifier.copy() for modifier in model]
+    modifiers[0].valueDescription = 0.26
+    return PriceModel.parse_obj([modifier.dict() for modifier in modifiers])
+
+
+def test_refresh_swaps_pricer_only_when_model_changes():
+    """Test the pricer is only replaced for a new price model version."""
+    models = [price_model(), price_model(), raised_base_price()]
+    refresher = PriceRefresher(lambda: models.pop(0), interval=0)
+
+    assert refresher.refresh()
+    first = refresher.pricer
+    assert not refresher.refresh()
+    assert refresher.pricer is first
+    assert refresher.refresh()
+    assert refresher.pricer.version != first.version
+
+    route = refresher.pricer.calculate_price(random_route(random.Random(1)), VEHICLE)
+    assert route.price_version == refresher.pricer.version
+
+
+def test_background_refresh_keeps_pricer_on_errors():
+    """Test failed refreshes keep the old pricer and later ones swap in the new one."""
+    swapped = threading.Event()
+    calls = []
+
+    def fetch_prices():
+        calls.append(None)
+        if len(calls) == 1:
+            return price_model()
+        if len(calls) == 2:
+            raise ConnectionError("payment service down")
+        swapped.set()
+        return raised_base_price()
+
+    refresher = PriceRefresher(fetch_prices, interval=0.01)
+    refresher.refresh()
+    first = refresher.pricer
+    refresher.start()
+    try:
+        assert swapped.wait(5)
+    finally:
+        refresher.stop()
+
+    assert refresher.pricer is not first
+    assert refresher.pricer.base_road_price == 26
@@ -0,0 +1,110 @@
+"""Test pricer against the per segment formula it replaced."""
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.benchmarks.synthetic import price_model
+from src.router_service.helpers.price_helpers import (
+    get_price_mod_for,
+    int_to_percent_increase_multiplier,
+)
+from src.router_service.models.compact_route import CompactRoute
+from src.router_service.models.route_models import Route
+from src.router_service.models.vehicle import VehicleInt
+from src.router_service.services.pricer import Pricer
+
+HIGHWAYS = ["motorway", "primary", "secondary", "residential", "unclassified", ""]
+
+
+def legacy_calculate_price(pricer: Pricer, route: Route, vehicle: VehicleInt):
+    """Price a route segment by segment like the replaced implementation."""
+    vehicle_classification_mod = get_price_mod_for(
+        [vehicle.vehicleClassification], pricer.vehicle_classification_lookup
+    )
+    fuel_type_mod = get_price_mod_for([vehicle.fuelType], pricer.fuel_type_lookup)
+    for segment in route.segments:
+        distance = segment.way.length
+        highway_mod = get_price_mod_for(segment.way.highway, pricer.highway_lookup)
+        rush_hour_mod = pricer.rush_lookup.get(str(segment.time.hour), 0)
+        total_mod = int_to_percent_increase_multiplier(
+            highway_mod + vehicle_classification_mod + fuel_type_mod + rush_hour_mod
+        )
+        segment.price = (
+            round(pricer.base_road_price * distance * (total_mod + 1), 2) / 100
+        )
+    route.price_total = round(sum([segment.price for segment in route.segments]), 2)
+    route.vehicle_id = vehicle.id
+    return route
+
+
+def random_route(rng):
+    """Route with random lengths, highway types and times."""
+    count = 500
+    highways = np.empty(count, dtype=object)
+    for index in range(count):
+        highway = rng.choice(HIGHWAYS)
+        if rng.random() < 0.1:
+            highway = [highway, rng.choice(HIGHWAYS)]
+        highways[index] = highway
+    start = np.datetime64("2023-06-01T00:00:00", "s")
+    times = start + np.array(
+        [int(86400 * rng.random()) for _ in range(count)], dtype="timedelta64[s]"
+    )
+    node_times = np.full(count, start)
+    return CompactRoute(
+        node_ids=[str(index) for index in range(count + 1)],
+        node_lats=np.full(count + 1, 51.0),
+        node_lons=np.full(count + 1, 5.0),
+        way_ids=[str(index) for index in range(count)],
+        way_names=np.full(count, "", dtype=object),
+        highways=highways,
+        lengths=np.array([rng.random() * 2 for _ in range(count)]),
+        start_times=node_times,
+        end_times=node_times,
+        times=times,
+    )
+
+
+def test_calculate_price_matches_legacy():
+    """Test the vectorized prices are identical to the per segment ones."""
+    pricer = Pricer(price_model())
+    rng = random.Random(5)
+    for fuel_type in ("Diesel", "Electric", "Petrol"):
+        vehicle = VehicleInt(
+            id="250aae3e-4c20-46e4-b5dc-7b32af4dbf9a",
+            vehicleClassification="M1",
+            fuelType=fuel_type,
+        )
+        route = random_route(rng)
+        expected = legacy_calculate_price(pricer, route.to_route(), vehicle)
+
+        priced = pricer.calculate_price(route, vehicle)
+
+        assert priced.prices.tolist() == [
+            segment.price for segment in expected.segments
+        ]
+        assert priced.price_total == expected.price_total
+        assert priced.vehicle_id == vehicle.id
+
+
+def test_highway_codes_from_threads():
+    """Test threads adding the same highway lists get one code with its modifier."""
+    pricer = Pricer(price_model())
+    highways = [["motorway", "primary"], ["residential", "secondary"], ["trunk"]] * 50
+    barrier = threading.Barrier(8)
+
+    def add():
+        barrier.wait()
+        return [pricer.get_highway_code(highway) for highway in highways]
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda _: add(), range(8)))
+
+    assert all(codes == results[0] for codes in results)
+    assert len(pricer.highway_mods) == len(pricer.highway_codes)
+    for highway, code in zip(highways, results[0]):
+        assert pricer.highway_mods[code] == get_price_mod_for(
+            highway, pricer.highway_lookup
+        )
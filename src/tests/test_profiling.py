@@ -0,0 +1,85 @@
+"""Test profiling of sampled and slow messages."""
+import json
+import time
+
+import pytest
+from src.router_service.helpers.profiling import Profiler
+from src.router_service.services.receiver import Receiver
+
+
+def handle(message):
+    """Sleep for the requested time, failing on fail."""
+    if message.get("fail"):
+        raise ValueError("failed")
+    time.sleep(message.get("sleep", 0))
+    return [0] * 1000
+
+
+def dumps(folder, suffix):
+    """List the files with a suffix in a folder, sorted."""
+    return sorted(path for path in folder.iterdir() if path.suffix == suffix)
+
+
+def test_sampled_messages_are_dumped_with_payload(tmp_path):
+    """Test one in every sample rate messages is profiled."""
+    profiler = Profiler(str(tmp_path), sample_rate=2)
+
+    for number in range(4):
+        assert profiler.run(handle, {"vehicleId": str(number)}) == [0] * 1000
+
+    summaries = [json.loads(path.read_text()) for path in dumps(tmp_path, ".json")]
+    assert len(dumps(tmp_path, ".prof")) == 2
+    assert sorted(summary["payload"]["vehicleId"] for summary in summaries) == [
+        "1",
+        "3",
+    ]
+    assert all(summary["reason"] == "sample" for summary in summaries)
+    assert all(summary["top_functions"] for summary in summaries)
+    assert all(summary["peak_memory_bytes"] > 0 for summary in summaries)
+
+
+def test_slow_messages_are_profiled(tmp_path):
+    """Test messages over the threshold are handled again under the profiler."""
+    profiler = Profiler(str(tmp_path), threshold=0.05)
+
+    profiler.run(handle, {"sleep": 0})
+    profiler.run(handle, {"sleep": 0.06})
+
+    (path,) = dumps(tmp_path, ".json")
+    summary = json.loads(path.read_text())
+    assert summary["reason"] == "slow"
+    assert summary["seconds"] > 0.05
+    assert summary["payload"] == {"sleep": 0.06}
+
+
+def test_failed_sampled_messages_raise_and_are_dumped(tmp_path):
+    """Test errors of profiled messages are recorded and raised."""
+    profiler = Profiler(str(tmp_path), sample_rate=1)
+
+    with pytest.raises(ValueError):
+        profiler.run(handle, {"fail": True})
+
+    (path,) = dumps(tmp_path, ".json")
+    assert json.loads(path.read_text())["error"] == "failed"
+
+
+def test_dumps_are_rotated(tmp_path):
+    """Test the oldest dumps are removed when the folder is over the size limit."""
+    profiler = Profiler(str(tmp_path), sample_rate=1, max_bytes=1)
+
+    profiler.run(handle, {})
+    profiler.run(handle, {})
+
+    assert len(list(tmp_path.iterdir())) <= 1
+
+
+def test_receiver_handler_uses_profiler(tmp_path):
+    """Test the receiver runs its handler through the profiler."""
+    receiver = Receiver(
+        None, "exchange", handle, profiler=Profiler(str(tmp_path), sample_rate=1)
+    )
+
+    result = receiver.handler(None, None, None, b'{"message": {"vehicleId": "v"}}')
+
+    assert result == [0] * 1000
+    assert len(dumps(tmp_path, ".prof")) == 1
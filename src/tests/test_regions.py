@@ -0,0 +1,169 @@
+"""Test routing several regions in one service."""
+import json
+
+import numpy as np
+import pytest
+from src.benchmarks.synthetic import grid_graph, random_trace
+from src.router_service.models.match_session import MatchSession
+from src.router_service.models.region import Region
+from src.router_service.services.calculator import Calculator
+from src.router_service.services.regions import RegionDispatcher
+
+
+@pytest.fixture(scope="module")
+def graph():
+    """Small synthetic graph shared by every region."""
+    return grid_graph(rows=15, cols=15)
+
+
+@pytest.fixture(scope="module")
+def bounds(graph):
+    """North, south, east, west and the middle longitude of the graph."""
+    lats = np.array([data["lat"] for _, data in graph.nodes(data=True)])
+    lons = np.array([data["lon"] for _, data in graph.nodes(data=True)])
+    return lats.max(), lats.min(), lons.max(), lons.min(), (lons.max() + lons.min()) / 2
+
+
+class Clock:
+    """Clock that only moves when told to."""
+
+    def __init__(self):
+        """Start the clock at zero."""
+        self.now = 0.0
+
+    def __call__(self):
+        """Return the current time."""
+        return self.now
+
+
+def dispatcher(graph, bounds, clock=None):
+    """Dispatcher over a west and an east half of the graph."""
+    north, south, east, west, middle = bounds
+    regions = Region.parse_all(
+        f"west=BBOX:{north},{south},{middle},{west};east=BBOX:{north},{south},{east},{middle}"
+    )
+    return RegionDispatcher(
+        regions,
+        idle_ttl=60,
+        clock=clock or Clock(),
+        factory=lambda region: Calculator(graph, region=region),
+    )
+
+
+def test_region_keys_match_the_single_region(monkeypatch):
+    """Test the keys of snapshots and tiles are made the same way as before."""
+    monkeypatch.setenv("REGION_TYPE", "BBOX")
+    for side, value in zip(
+        ("NORTH", "SOUTH", "EAST", "WEST"), ("50.30", "49.4", "6.3", "5.4")
+    ):
+        monkeypatch.setenv(side, value)
+
+    assert Region.from_env().key == "BBOX:50.30,49.4,6.3,5.4"
+    assert Region.from_env().bounds == (50.3, 49.4, 6.3, 5.4)
+    assert Region.parse("lux = BBOX:50.30,49.4,6.3,5.4").key == Region.from_env().key
+    assert Region.parse("brussels=PLACE:Brussels, Belgium").value == "Brussels, Belgium"
+    with pytest.raises(ValueError):
+        Region.parse("lux=BBOX:50.30,49.4")
+    with pytest.raises(ValueError):
+        Region.parse_all("a=PLACE:Brussels;a=PLACE:Ghent")
+
+
+def test_traces_are_routed_on_their_region(graph, bounds):
+    """Test a region is loaded by its first trace and routes like a single calculator."""
+    regions = dispatcher(graph, bounds)
+    trace = random_trace(graph, length=200, seed=3)
+    lats, lons = Calculator.get_lat_lon_arrays(trace, "long")
+    expected = "west" if lons[0] < bounds[4] else "east"
+    assert len(regions) == 0
+
+    route = regions.map_to_map(trace, "long", "timeStamp")
+
+    assert regions.region_for(lats, lons).name == expected
+    assert list(regions.stats()["calculators"]) == [expected]
+    single = Calculator(graph).map_to_map(trace, "long", "timeStamp")
+    assert json.dumps(route.to_wire()) == json.dumps(single.to_wire())
+    with pytest.raises(ValueError):
+        regions.region_for(lats + 1, lons)
+
+
+def test_smallest_region_wins(bounds):
+    """Test a region inside another one gets the traces within it."""
+    north, south, east, west, middle = bounds
+    regions = RegionDispatcher(
+        Region.parse_all(
+            f"all=BBOX:{north},{south},{east},{west};"
+            f"part=BBOX:{north},{(north + south) / 2},{middle},{west}"
+        ),
+        idle_ttl=0,
+    )
+
+    assert regions.region_for(np.array([north]), np.array([west])).name == "part"
+    assert regions.region_for(np.array([south]), np.array([east])).name == "all"
+
+
+def test_idle_regions_are_unloaded(graph, bounds):
+    """Test a region is unloaded once it wasn't used for the idle ttl."""
+    clock = Clock()
+    regions = dispatcher(graph, bounds, clock)
+
+    regions.calculator("west")
+    clock.now = 50
+    regions.calculator("east")
+    clock.now = 100
+    regions.calculator("east")
+
+    assert regions.stats()["loaded"] == 1 and regions.unloads == 1
+    clock.now = 1000
+    # The requested region is kept even when it was idle
+    regions.calculator("east")
+    assert regions.loads == 2 and len(regions) == 1
+
+
+def test_preloaded_regions_are_kept(graph, bounds):
+    """Test preloaded regions are loaded at once and never unloaded."""
+    clock = Clock()
+    regions = dispatcher(graph, bounds, clock)
+
+    regions.preload()
+    clock.now = 1000
+    regions.calculator("east")
+
+    assert regions.loads == 2 and regions.unloads == 0 and len(regions) == 2
+    with pytest.raises(ValueError):
+        regions.preload(["north"])
+
+
+def test_batch_is_split_by_region(graph, bounds):
+    """Test a batch gets the route of every trace in order, and an error outside."""
+    regions = dispatcher(graph, bounds)
+    traces = [random_trace(graph, length=120, seed=seed) for seed in range(4)]
+    outside = [dict(point, lat=point["lat"] + 1) for point in traces[0]]
+
+    routes = regions.map_to_map_batch(
+        [(trace, "long", "timeStamp") for trace in traces + [outside]]
+    )
+
+    assert isinstance(routes.pop(), ValueError)
+    single = Calculator(graph)
+    for trace, route in zip(traces, routes):
+        expected = single.map_to_map(trace, "long", "timeStamp")
+        assert json.dumps(route.to_wire()) == json.dumps(expected.to_wire())
+
+
+def test_session_restarts_in_another_region(graph, bounds):
+    """Test the pending route of a vehicle is dropped when it enters another region."""
+    regions = dispatcher(graph, bounds)
+    trace = random_trace(graph, length=100, noise=0.0001, seed=4)
+    session = MatchSession()
+    regions.extend_session(session, trace[:50], "long", "timeStamp")
+    region = session.region
+
+    session.region = "east" if region == "west" else "west"
+    route = regions.extend_session(session, trace[50:], "long", "timeStamp")
+
+    # Matched as if the vehicle just started
+    fresh = Calculator(graph).extend_session(
+        MatchSession(), trace[50:], "long", "timeStamp"
+    )
+    assert session.region == region
+    assert json.dumps(route.to_wire()) == json.dumps(fresh.to_wire())
@@ -0,0 +1,56 @@
+"""Test sender against the stand-in broker."""
+import json
+import uuid
+
+import pytest
+from masstransitpython import RabbitMQConfiguration
+from pika import PlainCredentials
+from src.benchmarks.stand_in_broker import StandInBroker
+from src.router_service.services.sender import Sender
+
+BODY = json.dumps({"conversationId": str(uuid.uuid4()), "message": {}}).encode()
+
+
+@pytest.fixture
+def broker():
+    """Stand-in broker, stopped after the test."""
+    broker = StandInBroker()
+    yield broker
+    broker.stop()
+
+
+def configuration(broker):
+    """Create a configuration pointing to the broker."""
+    return RabbitMQConfiguration(
+        PlainCredentials("guest", "guest"),
+        queue="py-router",
+        host=broker.host,
+        port=broker.port,
+        virtual_host="/",
+    )
+
+
+@pytest.mark.parametrize("confirm", [False, True])
+def test_sender_reuses_connection(broker, confirm):
+    """Test messages are published on one connection."""
+    sender = Sender(configuration(broker), "exchange", confirm=confirm)
+
+    for _ in range(20):
+        sender.send_message(body=BODY, message={"id": None})
+    sender.close()
+
+    assert broker.published == 20
+    assert broker.connections_opened == 1
+
+
+def test_sender_reconnects_after_connection_loss(broker):
+    """Test the sender reconnects when the broker closed the connection."""
+    sender = Sender(configuration(broker), "exchange", confirm=True)
+    sender.send_message(body=BODY, message={"id": None})
+
+    broker.drop_connections()
+    sender.send_message(body=BODY, message={"id": None})
+    sender.close()
+
+    assert broker.published == 2
+    assert broker.connections_opened == 2
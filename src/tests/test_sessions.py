@@ -0,0 +1,158 @@
+"""Test incremental matching with per-vehicle sessions."""
+import numpy as np
+import pytest
+from src.benchmarks.synthetic import (
+    grid_graph,
+    random_trace,
+    route_length,
+    trace_length,
+    u_turns,
+)
+from src.router_service.helpers.metrics import SESSIONS_EVICTED
+from src.router_service.models.match_session import MatchSession
+from src.router_service.services.calculator import Calculator
+from src.router_service.services.receiver import Receiver
+from src.router_service.services.sessions import SessionStore
+
+
+@pytest.fixture(scope="module")
+def calculator():
+    """Create a calculator on a small synthetic graph."""
+    return Calculator(grid_graph(rows=15, cols=15))
+
+
+def stream(calculator, trace, chunk):
+    """Match a trace in chunks and return the emitted routes."""
+    session = MatchSession()
+    routes = []
+    for start in range(0, len(trace), chunk):
+        routes.append(
+            calculator.extend_session(
+                session, trace[start : start + chunk], "long", "timeStamp"
+            )
+        )
+    return session, routes
+
+
+@pytest.mark.parametrize("chunk", [1, 25, 80])
+def test_chunks_emit_the_batch_route_once(calculator, chunk):
+    """Test the emitted segments join up to the bridged route of the whole trace."""
+    trace = random_trace(calculator.area_graph, length=400, noise=0.0001, seed=4)
+    lats, lons = calculator.get_lat_lon_arrays(trace, "long")
+    batch_route, _ = calculator.bridge_edge_gaps(calculator.snap(lats, lons))
+
+    session, routes = stream(calculator, trace, chunk)
+
+    nodes = []
+    for route in routes:
+        if not len(route):
+            continue
+        # Every route continues where the previous one ended
+        assert not nodes or route.node_ids[0] == nodes[-1]
+        nodes += route.node_ids[1:] if nodes else route.node_ids
+    # Everything but the edge the vehicle is on now and the roads it may have turned
+    # onto was emitted, the batch route ends on the last of those roads
+    streamed = nodes + [str(session.nodes[-1])]
+    assert streamed == [str(node) for node in batch_route[: len(streamed)]]
+    assert len(batch_route) - len(streamed) <= 1
+    assert len(session.nodes) == 2 and list(session.times) == [0]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_streamed_route_follows_the_walk(seed):
+    """Test the streamed route has no detours at intersections."""
+    calculator = Calculator(grid_graph(rows=30, cols=30))
+    graph = calculator.area_graph
+    walk = trace_length(random_trace(graph, length=300, noise=0.0, seed=seed))
+    trace = random_trace(graph, length=300, noise=0.00005, seed=seed)
+
+    session, routes = stream(calculator, trace, 20)
+
+    route = []
+    for segment in routes:
+        nodes = [int(node) for node in segment.node_ids]
+        route += nodes[1:] if route else nodes
+    route.append(session.nodes[-1])
+    assert walk - 300 <= route_length(graph, route) <= walk + 300
+    assert u_turns(route) == 0
+
+
+def test_emitted_times_are_ordered(calculator):
+    """Test the emitted segments are timed in driving order."""
+    trace = random_trace(calculator.area_graph, length=300, noise=0.0001, seed=5)
+
+    _, routes = stream(calculator, trace, 30)
+
+    start_times = np.concatenate([route.start_times for route in routes])
+    end_times = np.concatenate([route.end_times for route in routes])
+    assert not np.isnat(start_times).any()
+    assert (end_times >= start_times).all()
+    assert (np.diff(start_times) >= np.timedelta64(0)).all()
+
+
+class Clock:
+    """Clock that only moves when told to."""
+
+    def __init__(self):
+        """Start the clock at zero."""
+        self.now = 0.0
+
+    def __call__(self):
+        """Return the current time."""
+        return self.now
+
+
+def test_idle_sessions_expire():
+    """Test sessions that weren't used for the ttl are evicted."""
+    clock = Clock()
+    store = SessionStore(ttl=10, max_bytes=0, clock=clock)
+    evicted = SESSIONS_EVICTED.value(reason="ttl")
+
+    store.get("a")
+    clock.now = 6
+    store.get("b")
+    clock.now = 12
+    store.get("b")
+
+    assert "a" not in store and "b" in store
+    assert SESSIONS_EVICTED.value(reason="ttl") == evicted + 1
+
+
+def test_sessions_over_the_budget_are_evicted(calculator):
+    """Test the least recently used sessions are evicted when over the memory budget."""
+    trace = random_trace(calculator.area_graph, length=50, seed=6)
+    store = SessionStore(ttl=600, max_bytes=1)
+    sizes = []
+
+    for key in ("a", "b"):
+        calculator.extend_session(store.get(key), trace, "long", "timeStamp")
+        sizes.append(store.get(key).nbytes())
+        store.update(key)
+    assert len(store) == 0 and store.nbytes == 0
+
+    store.max_bytes = sum(sizes) + sizes[0] // 2
+    for key in ("a", "b", "c"):
+        calculator.extend_session(store.get(key), trace, "long", "timeStamp")
+        store.update(key)
+    assert "a" not in store and "b" in store and "c" in store
+    assert store.nbytes <= store.max_bytes
+
+
+def test_receiver_does_not_publish_empty_results():
+    """Test messages without new segments are consumed without publishing."""
+
+    class Sender:
+        """Sender that keeps the messages."""
+
+        sent = []
+
+        def send_message(self, body, message):
+            """Keep the message instead of publishing it."""
+            self.sent.append(message)
+
+    sender = Sender()
+    receiver = Receiver(None, "exchange", lambda message: None, sender)
+
+    receiver.handler(None, None, None, b'{"message": {}}')
+
+    assert sender.sent == []
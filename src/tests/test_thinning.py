@@ -0,0 +1,139 @@
+"""Test thinning of GPS traces."""
+import json
+
+import numpy as np
+import pytest
+from src.benchmarks.synthetic import grid_graph, price_model, random_trace
+from src.router_service.helpers import thinning
+from src.router_service.helpers.metrics import KEPT_POINTS
+from src.router_service.models.vehicle import VehicleInt
+from src.router_service.services.calculator import Calculator
+from src.router_service.services.pricer import Pricer
+
+# Degrees of latitude per meter
+METER = 1 / 111195
+
+
+def test_edge_run_bounds_keeps_first_and_last_point_of_every_run():
+    """Test only points inside a run of the same edge are dropped."""
+    a, b, c = (1, 2, 0), (2, 3, 0), (3, 2, 0)
+    edges = [a, a, a, a, b, b, b, c, b, a]
+
+    assert np.flatnonzero(thinning.edge_run_bounds(edges)).tolist() == [
+        0,
+        3,
+        4,
+        6,
+        7,
+        8,
+        9,
+    ]
+    # Both directions of a road are one edge when not directed
+    assert np.flatnonzero(thinning.edge_run_bounds(edges, directed=False)).tolist() == [
+        0,
+        3,
+        4,
+        8,
+        9,
+    ]
+    # Over the whole trace only the first and last point of every edge
+    assert np.flatnonzero(thinning.edge_occurrence_bounds(edges)).tolist() == [
+        0,
+        4,
+        7,
+        8,
+        9,
+    ]
+
+
+def test_stationary_clusters_collapse_to_first_and_last_point():
+    """Test a vehicle waiting in place keeps its arrival and departure point."""
+    lats = np.array([0, 100, 101, 100, 102, 101, 200, 300]) * METER
+    lons = np.zeros(len(lats))
+
+    keep = thinning.thin(lats, lons, stationary_radius=5)
+
+    assert np.flatnonzero(keep).tolist() == [0, 1, 5, 6, 7]
+
+
+def test_close_points_are_dropped_by_distance_and_time():
+    """Test points within the minimum distance or time of the last kept point are dropped."""
+    lats = np.arange(10) * 4 * METER
+    lons = np.zeros(len(lats))
+    timestamps = np.datetime64("2023-06-01T13:00:00") + np.arange(10) * np.timedelta64(
+        1, "s"
+    )
+
+    assert np.flatnonzero(thinning.thin(lats, lons, min_distance=10)).tolist() == [
+        0,
+        3,
+        6,
+        9,
+    ]
+    assert np.flatnonzero(
+        thinning.thin(lats, lons, timestamps, min_interval=4)
+    ).tolist() == [0, 4, 8, 9]
+
+
+def test_douglas_peucker_keeps_corners():
+    """Test a straight stretch is simplified to its ends and corners are kept."""
+    lats = np.concatenate([np.arange(10), np.full(10, 9)]) * 10 * METER
+    lons = np.concatenate([np.zeros(10), np.arange(1, 11)]) * 10 * METER
+    lats += np.tile([0, 0.5 * METER], 10)
+
+    keep = thinning.thin(lats, lons, tolerance=2)
+
+    assert np.flatnonzero(keep).tolist() == [0, 9, 19]
+
+
+@pytest.mark.parametrize("engine", ["shortest_path", "hmm"])
+def test_thinned_traces_are_matched_on_fewer_points(engine):
+    """Test a thinned trace still gives a timed route on the graph."""
+    calculator = Calculator(grid_graph(rows=15, cols=15))
+    calculator.match_engine = engine
+    calculator.thin_min_distance = 20
+    calculator.thin_tolerance = 5
+    trace = random_trace(calculator.area_graph, length=600, noise=0.00001, seed=3)
+    lats, lons = calculator.get_lat_lon_arrays(trace, "long")
+    before = KEPT_POINTS.count()
+
+    keep, _ = calculator.thin(
+        lats, lons, trace, "timeStamp", calculator.snap(lats, lons)
+    )
+    route = calculator.map_to_map(trace, "long", "timeStamp")
+
+    assert len(keep) < len(trace) / 2
+    assert KEPT_POINTS.count() == before + 1
+    graph = calculator.area_graph
+    nodes = [int(node) for node in route.node_ids]
+    assert len(route) > 10
+    assert all(graph.has_edge(u, v) for u, v in zip(nodes, nodes[1:]))
+    assert not np.isnat(route.start_times).any()
+
+
+@pytest.mark.parametrize("gap_fill_mode", ["expand", "bridge"])
+def test_thinning_keeps_the_priced_route(gap_fill_mode):
+    """Test thinning never changes the route, its times or its prices."""
+    graph = grid_graph(rows=15, cols=15)
+    pricer = Pricer(price_model())
+    vehicle = VehicleInt(
+        id="250aae3e-4c20-46e4-b5dc-7b32af4dbf9a",
+        vehicleClassification="M1",
+        fuelType="Diesel",
+    )
+    thinned = Calculator(graph)
+    thinned.thin_min_distance = 50
+    thinned.thin_stationary_radius = 10
+    thinned.thin_tolerance = 20
+    whole = Calculator(graph)
+    thinned.gap_fill_mode = whole.gap_fill_mode = gap_fill_mode
+
+    for seed in range(5):
+        trace = random_trace(graph, length=400, noise=0.00005, seed=seed)
+        expected = pricer.calculate_price(
+            whole.map_to_map(trace, "long", "timeStamp"), vehicle
+        )
+        route = pricer.calculate_price(
+            thinned.map_to_map(trace, "long", "timeStamp"), vehicle
+        )
+        assert json.dumps(route.to_wire()) == json.dumps(expected.to_wire())
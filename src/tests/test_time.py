@@ -0,0 +1,294 @@
+"""Test time helpers against the implementation they replaced."""
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from src.router_service.helpers.helpers import get_first_occurrence_indexes
+from src.router_service.helpers.thinning import edge_run_bounds
+from src.router_service.helpers.time import (
+    fill_timestamps,
+    get_halfway_times,
+    get_start_and_end_time_of_edges,
+    interpolate_timestamps,
+    match_timestamps,
+    parse_timestamps,
+    to_datetimes,
+)
+from src.router_service.services.pricer import Pricer
+
+
+def legacy_get_start_and_end_time_of_edges(
+    coordinates: list, nearest_edges: list, time_field: str
+) -> list[(str, str)]:
+    """
+    Get the first and last timestamp associated with an edge.
+
+    :param time_field:
+    :param coordinates: coordinates list with timeStamp property
+    :param nearest_edges: the edges to match timestamps to
+    :return: the timestamps in the same order the edges are in
+    """
+    first_occurrence_index = get_first_occurrence_indexes(nearest_edges)
+    last_occurrence_index = get_first_occurrence_indexes(nearest_edges[::-1])
+    # Get the first timestamp
+    first_occurrence_timestamps = [
+        [coordinate[time_field] for coordinate in coordinates][i]
+        for i in first_occurrence_index
+    ]
+    last_occurrence_timestamps = [
+        [coordinate[time_field] for coordinate in coordinates][i]
+        for i in last_occurrence_index
+    ]
+    # No idea why but the timestamps where the wrong way around. Now they feel like they should be wrong but aren't...
+    return [
+        (x, y) for x, y in zip(last_occurrence_timestamps, first_occurrence_timestamps)
+    ]
+
+
+def legacy_match_timestamps(
+    nearest_edges: list[(int, int, int)],
+    route_edges: list[(int, int, int)],
+    edge_start_end_timestamps: list[(str, str)],
+):
+    """
+    Match the timestamps to the nearest edges they belong to.
+
+    :param nearest_edges: The edges to match index with
+    :param route_edges: The (u, v, key) of the route edges in order
+    :param edge_start_end_timestamps: The timestamps
+    :return: The times with the same index as the matching edges.
+    """
+    return_timestamps = {}
+    for i, edge in enumerate(route_edges):
+        try:
+            index = nearest_edges.index(edge)
+            return_timestamps[i] = edge_start_end_timestamps[index]
+        except ValueError:
+            continue
+    return return_timestamps
+
+
+def legacy_fill_timestamps(
+    edge_timestamps: dict[int : tuple[str, str]], highest_index: int
+):
+    """
+    Fill in the missing indexes using neighbouring timestamps.
+
+    The replaced implementation as it was, without the prints before raising.
+
+    :param edge_timestamps: The list of matched timestamps with indexes for their edge
+    :param highest_index: The highest index to fill up to
+    :return: edge_timestamps with missing indexes filled
+    """
+    missing_ranges = []
+    # Find ranges of missing indexes
+    for i in range(highest_index):
+        if i in edge_timestamps.keys():
+            continue
+        if len(missing_ranges) == 0:
+            missing_ranges.append([i])
+        elif missing_ranges[-1][-1] == i - 1:
+            missing_ranges[-1].append(i)
+        else:
+            missing_ranges.append([i])
+
+    # First, make sure index 0 and highest_index have timestamps
+    # by setting all elements in that list to the first/last element that has a timestamp
+    if 0 in missing_ranges[0]:
+        for i in missing_ranges[0]:
+            edge_timestamps[i] = edge_timestamps[max(missing_ranges[0]) + 1]
+        missing_ranges.pop(0)
+    if highest_index in missing_ranges[-1]:
+        for i in missing_ranges[-1]:
+            edge_timestamps[i] = edge_timestamps[min(missing_ranges[-1]) - 1]
+        missing_ranges.pop(-1)
+
+    for index, missing_range in enumerate(missing_ranges):
+        # For longer ranges, full copy both sides, then check if any elements are left empty
+        while len(missing_range) > 1:
+            try:
+                edge_timestamps[missing_range[0]] = edge_timestamps[
+                    min(missing_range) - 1
+                ]
+                edge_timestamps[missing_range[-1]] = edge_timestamps[
+                    max(missing_range) + 1
+                ]
+                missing_range.pop(0)
+                missing_range.pop(-1)
+            except KeyError as e:
+                raise e
+        # Do the 2 way copy for len 1 ranges
+        if len(missing_range) == 1:
+            edge_timestamps[missing_range[0]] = (
+                edge_timestamps[missing_range[0] - 1][1],
+                edge_timestamps[missing_range[0] + 1][0],
+            )
+        # This should only leave len 0  ranges, which we can move on from
+
+    return edge_timestamps
+
+
+def legacy_get_halfway_time(time_one, time_two):
+    """Get the halfway time of two timestamps like the replaced implementation."""
+    start_time = datetime.fromisoformat(time_one)
+    end_time = datetime.fromisoformat(time_two)
+    duration = end_time - start_time
+    halfway_time = start_time + (duration / 2)
+    halfway_time_str = halfway_time.strftime("%Y-%m-%d %H:%M:%S")
+    return halfway_time_str
+
+
+def random_edges(rng, length):
+    """Random edge sequence with runs and revisits, like a snapped trace."""
+    edges = []
+    while len(edges) < length:
+        edge = (rng.randrange(20), rng.randrange(20), 0)
+        edges += [edge] * rng.randrange(1, 6)
+    return edges[:length]
+
+
+def test_get_start_and_end_time_of_edges_matches_legacy():
+    """Test the indexed version returns the same timestamps."""
+    rng = random.Random(1)
+    for _ in range(200):
+        edges = random_edges(rng, rng.randrange(1, 80))
+        coordinates = [{"timeStamp": f"t{i}"} for i in range(len(edges))]
+        timestamps = [coordinate["timeStamp"] for coordinate in coordinates]
+        assert get_start_and_end_time_of_edges(
+            timestamps, edges
+        ) == legacy_get_start_and_end_time_of_edges(coordinates, edges, "timeStamp")
+
+
+def test_get_start_and_end_time_of_edges_with_thinned_positions():
+    """Test keeping the first and last coordinate of every run gives the same timestamps."""
+    rng = random.Random(2)
+    for _ in range(200):
+        edges = random_edges(rng, rng.randrange(1, 80))
+        timestamps = [f"t{i}" for i in range(len(edges))]
+        positions = np.flatnonzero(edge_run_bounds(edges))
+        assert get_start_and_end_time_of_edges(
+            timestamps, [edges[index] for index in positions], positions
+        ) == get_start_and_end_time_of_edges(timestamps, edges)
+
+
+def test_match_timestamps_matches_legacy():
+    """Test the indexed version matches the same route edges."""
+    rng = random.Random(2)
+    for _ in range(200):
+        nearest_edges = list(dict.fromkeys(random_edges(rng, rng.randrange(1, 40))))
+        timestamps = [(f"s{i}", f"e{i}") for i in range(len(nearest_edges))]
+        route_edges = random_edges(rng, rng.randrange(1, 60))
+        assert match_timestamps(
+            nearest_edges, route_edges, timestamps
+        ) == legacy_match_timestamps(nearest_edges, route_edges, timestamps)
+
+
+def test_fill_timestamps_matches_legacy():
+    """Test the indexed version fills gaps the same way wherever the old one succeeded."""
+    rng = random.Random(3)
+    compared = 0
+    for _ in range(1000):
+        highest_index = rng.randrange(1, 40)
+        matched = {
+            i: (f"s{i}", f"e{i}")
+            for i in range(highest_index + 1)
+            if rng.random() < 0.5
+        }
+        try:
+            expected = legacy_fill_timestamps(dict(matched), highest_index)
+        except (KeyError, IndexError):
+            continue
+        assert fill_timestamps(dict(matched), highest_index) == expected
+        compared += 1
+    assert compared > 100
+
+
+def test_fill_timestamps_trailing_gap():
+    """Test a gap up to the last edge is filled from the left instead of failing."""
+    matched = {0: ("s0", "e0"), 1: ("s1", "e1")}
+
+    filled = fill_timestamps(matched, 5)
+
+    assert [filled[i] for i in range(5)] == [("s0", "e0")] + [("s1", "e1")] * 4
+
+
+def test_fill_timestamps_without_any_timestamp():
+    """Test filling fails clearly when there is nothing to fill from."""
+    with pytest.raises(ValueError):
+        fill_timestamps({}, 3)
+
+
+def test_parse_timestamps():
+    """Test .NET timestamps with any number of fractional digits are parsed."""
+    parsed = parse_timestamps(
+        [
+            "2023-06-01T13:04:30.4366085Z",
+            "2023-06-06T21:17:01.042Z",
+            "2023-06-06T21:17:01Z",
+            "2023-06-06T23:17:01+02:00",
+        ]
+    )
+
+    assert parsed.dtype == np.dtype("datetime64[ns]")
+    assert parsed.tolist() == [
+        1685624670436608500,
+        1686086221042000000,
+        1686086221000000000,
+        # The local time, the offset is dropped
+        1686093421000000000,
+    ]
+
+
+def test_offset_timestamps_keep_the_local_hour():
+    """Test timestamps with an offset are timed and priced on their local hour."""
+    starts = ["2023-06-06T07:10:00+02:00", "2023-06-06T16:50:00.5-05:00"]
+    ends = ["2023-06-06T07:40:00+02:00", "2023-06-06T17:20:00.5-05:00"]
+
+    halfway = get_halfway_times(parse_timestamps(starts), parse_timestamps(ends))
+
+    assert [time.strftime("%Y-%m-%d %H:%M:%S") for time in to_datetimes(halfway)] == [
+        legacy_get_halfway_time(start, end) for start, end in zip(starts, ends)
+    ]
+    assert Pricer.get_hours(halfway).tolist() == [7, 17]
+
+
+def test_get_halfway_times_matches_legacy():
+    """Test the vectorized halfway times equal the ones parsed from the old strings."""
+    rng = random.Random(4)
+    starts = []
+    ends = []
+    for _ in range(200):
+        start = datetime(2023, 6, 1) + timedelta(days=rng.random())
+        end = start + timedelta(minutes=10 * rng.random())
+        starts.append(start.strftime("%Y-%m-%dT%H:%M:%S.%f") + "1Z")
+        ends.append(end.strftime("%Y-%m-%dT%H:%M:%S.%f") + "9Z")
+
+    halfway = to_datetimes(
+        get_halfway_times(parse_timestamps(starts), parse_timestamps(ends))
+    )
+
+    assert [time.strftime("%Y-%m-%d %H:%M:%S") for time in halfway] == [
+        legacy_get_halfway_time(start, end) for start, end in zip(starts, ends)
+    ]
+
+
+def test_interpolate_timestamps_by_distance():
+    """Test unmatched edges are timed by cumulative length between matched edges."""
+    times = parse_timestamps(
+        [
+            "2023-06-01T08:00:00Z",
+            "2023-06-01T08:00:10Z",
+            "2023-06-01T08:01:50Z",
+            "2023-06-01T08:02:00Z",
+        ]
+    )
+    matched = {1: (times[0], times[1]), 4: (times[2], times[3])}
+    lengths = np.array([10.0, 10.0, 20.0, 80.0, 10.0, 10.0])
+
+    start_times, end_times = interpolate_timestamps(matched, lengths)
+
+    seconds = (start_times - times[0]) / np.timedelta64(1, "s")
+    assert seconds.tolist() == [0, 0, 10, 30, 110, 120]
+    seconds = (end_times - times[0]) / np.timedelta64(1, "s")
+    assert seconds.tolist() == [0, 10, 30, 110, 120, 120]
@@ -0,0 +1,135 @@
+"""Test worker pool and pool mode of the receiver."""
+import json
+import os
+import time
+from concurrent.futures import wait
+
+from src.router_service.services.receiver import Receiver
+from src.router_service.services.worker_pool import WorkerPool
+
+
+class PidHandler:
+    """Handler returning the pid of the worker it runs on."""
+
+    def handle(self, message):
+        """Return the value and the pid, dying or failing when asked."""
+        if message.get("die"):
+            os._exit(1)
+        if message.get("fail"):
+            raise ValueError("failed")
+        return {"value": message["value"], "pid": os.getpid()}
+
+
+class FakeConnection:
+    """Connection running thread safe callbacks immediately."""
+
+    def add_callback_threadsafe(self, callback):
+        """Run the callback now."""
+        callback()
+
+
+class FakeChannel:
+    """Channel recording acks and nacks."""
+
+    def __init__(self):
+        self.connection = FakeConnection()
+        self.acked = []
+        self.nacked = []
+        self.requeued = []
+
+    def basic_ack(self, delivery_tag):
+        """Record an ack."""
+        self.acked.append(delivery_tag)
+
+    def basic_nack(self, delivery_tag, requeue):
+        """Record a nack, requeued or not."""
+        (self.requeued if requeue else self.nacked).append(delivery_tag)
+
+
+class FakeMethod:
+    """Delivery method with a delivery tag."""
+
+    def __init__(self, delivery_tag, redelivered=False):
+        self.delivery_tag = delivery_tag
+        self.redelivered = redelivered
+
+
+class FakeSender:
+    """Sender recording the published messages."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, body, message):
+        """Record the message instead of publishing it."""
+        self.sent.append(message)
+
+
+def test_worker_pool_handles_messages_on_workers():
+    """Test messages are handled in the worker processes."""
+    pool = WorkerPool(PidHandler, 2)
+    try:
+        futures = [pool.submit({"value": value}) for value in range(20)]
+        wait(futures)
+        results = [future.result() for future in futures]
+    finally:
+        pool.shutdown()
+
+    assert [result["value"] for result in results] == list(range(20))
+    assert os.getpid() not in {result["pid"] for result in results}
+
+
+def test_receiver_acks_after_publish_and_rejects_failures():
+    """Test pool mode publishes before acking and rejects failed messages."""
+    pool = WorkerPool(PidHandler, 2)
+    sender = FakeSender()
+    receiver = Receiver(None, "exchange", None, sender, pool=pool, max_in_flight=4)
+    channel = FakeChannel()
+    messages = [{"value": 1}, {"fail": True}, {"value": 2}]
+    try:
+        for tag, message in enumerate(messages):
+            body = json.dumps({"conversationId": "c", "message": message}).encode()
+            receiver.dispatch(channel, FakeMethod(tag), None, body)
+        receiver.dispatch(channel, FakeMethod(3), None, b"not json")
+    finally:
+        pool.shutdown()
+
+    assert sorted(channel.acked) == [0, 2]
+    assert sorted(channel.nacked) == [1, 3]
+    assert sorted(message["value"] for message in sender.sent) == [1, 2]
+
+
+def dispatch_all(receiver, channel, messages, redelivered=False):
+    """Dispatch messages and wait until all of them are acked or rejected."""
+    for tag, message in messages:
+        body = json.dumps({"conversationId": "c", "message": message}).encode()
+        receiver.dispatch(channel, FakeMethod(tag, redelivered), None, body)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        done = channel.acked + channel.nacked + channel.requeued
+        if all(tag in done for tag, _ in messages):
+            return
+        time.sleep(0.01)
+    raise TimeoutError("Messages were not completed")
+
+
+def test_dead_worker_requeues_its_messages_and_restarts():
+    """Test messages of a dead worker are requeued and new workers are started."""
+    pool = WorkerPool(PidHandler, 1)
+    receiver = Receiver(
+        None, "exchange", None, FakeSender(), pool=pool, max_in_flight=4
+    )
+    channel = FakeChannel()
+    try:
+        dispatch_all(receiver, channel, [(0, {"die": True}), (1, {"value": 1})])
+        assert sorted(channel.requeued) == [0, 1]
+
+        # The redelivered message that kills its worker again is dropped
+        dispatch_all(receiver, channel, [(2, {"die": True})], redelivered=True)
+        dispatch_all(receiver, channel, [(3, {"value": 1})], redelivered=True)
+    finally:
+        pool.shutdown()
+
+    assert channel.nacked == [2]
+    assert channel.acked == [3]
+    assert pool.restarts == 2